@@ -0,0 +1,295 @@
+import matplotlib
+matplotlib.use("Agg")  # before any of the scripts import pyplot
+
+import numpy as np
+import argparse
+import copy
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+for directory in ("Simulations", "VideoProcessing", "Verification"):
+    sys.path.append(str(ROOT / directory))
+import simulation
+from trajectory import Trajectory
+import verificiation
+
+CONFIG = {
+    "baseline_path": "./Benchmarks/baseline.json",
+    "results_path": "./Benchmarks/results.json",
+    "repeats": 5,
+    # A benchmark is a regression when it is this many times slower than its baseline
+    "tolerance": 1.2,
+    "eom_calls": 20000,
+    "solver_methods": ["RK45", "DOP853", "Radau", "Yoshida4"],
+    "solve_time_span": (0.0, 5.0),
+    "solve_num_points": 500,
+    "process_num_points": 4000,
+    "animation_time_span": (0.0, 5.0),
+    "frame_size": (720, 1280),
+    "frames": 100,
+    "fourier_terms": [10, 50, 100],
+    "fourier_samples": 1000,
+    "alignment_minutes": 10,
+    "alignment_fps": 60
+}
+
+# Fixed reference state, independent of whatever CONFIG["params"] the simulation is set to
+REFERENCE_PARAMS = {
+    "masses": (1.137, 1.455),
+    "lengths": (0.525, 0.473),
+    "gravity": 9.81,
+    "initial_angles": (1.58544729307629, 0.007936341307466063),
+    "initial_velocities": (0.0, 0.0),
+    "time_span": (0.0, 5.0),
+    "num_points": 500,
+    "solver": {"method": "DOP853", "rtol": 1e-9, "atol": 1e-10}
+}
+REFERENCE_SOLVERS = {
+    "RK45": {"method": "RK45", "rtol": 1e-9, "atol": 1e-10},
+    "DOP853": {"method": "DOP853", "rtol": 1e-9, "atol": 1e-10},
+    "Radau": {"method": "Radau", "rtol": 1e-9, "atol": 1e-10},
+    "Yoshida4": {"method": "Yoshida4", "dt": 2.5e-4}
+}
+
+# A setup returns the timed workload and how many units (calls, frames, ...) one run of it covers
+Workload = Tuple[Callable[[], None], int, str]
+
+def use_reference_params(**overrides) -> None:
+    simulation.CONFIG["params"] = dict(copy.deepcopy(REFERENCE_PARAMS), **overrides)
+
+def reference_solution(time_span: Tuple[float, float], num_points: int) -> dict:
+    use_reference_params(time_span=time_span, num_points=num_points)
+    solution, _ = simulation.solve_pendulum_ode()
+    return solution
+
+def setup_eom() -> Workload:
+    use_reference_params()
+    states = np.random.default_rng(0).uniform(-np.pi, np.pi, (CONFIG["eom_calls"], 4))
+    def run():
+        for state in states:
+            simulation.equations_of_motion(0.0, state)
+    return run, len(states), "call"
+
+def setup_kernel_rhs() -> Workload:
+    use_reference_params()
+    kernel = simulation.get_kernel()
+    states = np.random.default_rng(0).uniform(-np.pi, np.pi, (CONFIG["eom_calls"], 4))
+    kernel.rhs(0.0, states[0])  # compile outside the timed runs
+    def run():
+        for state in states:
+            kernel.rhs(0.0, state)
+    return run, len(states), "call"
+
+def setup_solve(method: str) -> Workload:
+    use_reference_params(
+        time_span=CONFIG["solve_time_span"],
+        num_points=CONFIG["solve_num_points"],
+        solver=REFERENCE_SOLVERS[method]
+    )
+    simulation.solve_pendulum_ode()  # compile the numba kernels outside the timed runs
+    return simulation.solve_pendulum_ode, 1, "solve"
+
+def setup_process_pendulum_data() -> Workload:
+    solution = reference_solution(CONFIG["solve_time_span"], CONFIG["process_num_points"])
+    return lambda: simulation.process_pendulum_data(solution), 1, "run"
+
+def setup_create_animation() -> Workload:
+    time_span = CONFIG["animation_time_span"]
+    solution = reference_solution(time_span, CONFIG["solve_num_points"])
+    simulation.CONFIG["sim_outpath"] = tempfile.mkdtemp(prefix="pendulum_benchmark_") + os.sep
+    simulation.CONFIG["animation"] = dict(simulation.CONFIG["animation"], format="gif", workers=1)
+    frames = int((time_span[1] - time_span[0]) * simulation.CONFIG["animation"]["fps"])
+    return lambda: simulation.create_animation(solution), frames, "frame"
+
+def make_synthetic_frames(count: int) -> Tuple[List[np.ndarray], Tuple[int, int], float, List[Tuple[int, int]]]:
+    # Two bright blobs moving along the arms of a swinging pendulum on a dim, noisy background
+    import cv2
+    height, width = CONFIG["frame_size"]
+    pivot = (width // 2, height // 4)
+    l1, l2 = 150, 130
+    rng = np.random.default_rng(0)
+    frames, positions = [], []
+    for i in range(count):
+        theta1 = 1.2 * np.sin(i * 0.1)
+        theta2 = 2.0 * np.sin(i * 0.17)
+        first = (int(pivot[0] + l1*np.sin(theta1)), int(pivot[1] + l1*np.cos(theta1)))
+        second = (int(first[0] + l2*np.sin(theta2)), int(first[1] + l2*np.cos(theta2)))
+        frame = rng.integers(0, 60, (height, width, 3), dtype=np.uint8)
+        cv2.circle(frame, first, 6, (255, 255, 255), -1)
+        cv2.circle(frame, second, 6, (255, 255, 255), -1)
+        frames.append(frame)
+        positions.append((first, second))
+    return frames, pivot, float(l1), positions
+
+def setup_process_frame(roi: bool) -> Workload:
+    import VideoProcessing
+    frames, pivot, arm_length, positions = make_synthetic_frames(CONFIG["frames"])
+    brightness = VideoProcessing.CONFIG["brightness_value"]
+    detector = VideoProcessing.make_detector(frames[0].shape, pivot, arm_length) if roi else None
+    def run():
+        prev_pos = list(positions[0])
+        for frame in frames:
+            _, prev_pos = VideoProcessing.process_frame(frame, pivot, prev_pos, brightness, arm_length, detector=detector)
+    return run, len(frames), "frame"
+
+def setup_tracker_update() -> Workload:
+    import VideoProcessing
+    frames, pivot, arm_length, positions = make_synthetic_frames(CONFIG["frames"])
+    settings = dict(VideoProcessing.get_tracking_settings(), tracker="predictive")
+    detector = VideoProcessing.make_detector(frames[0].shape, pivot, arm_length, settings)
+    def run():
+        tracker = VideoProcessing.make_tracker(pivot, positions[0], arm_length, detector, settings)
+        for frame in frames:
+            tracker.update(frame)
+    return run, len(frames), "frame"
+
+def setup_fit_fourier(num_terms: int) -> Workload:
+    solution = reference_solution(CONFIG["solve_time_span"], CONFIG["fourier_samples"])
+    t = solution["t"]
+    y = np.degrees(solution["y"][1])
+    return lambda: verificiation.fit_fourier(t, y, num_terms), 1, "fit"
+
+def setup_fourier_series(num_terms: int) -> Workload:
+    # The evaluation grid of plot_deviation, which doesn't line up with the fitted period
+    rng = np.random.default_rng(0)
+    coeffs = rng.normal(size=2*num_terms + 1)
+    t = np.linspace(0.0, CONFIG["solve_time_span"][1], CONFIG["fourier_samples"])
+    def run():
+        verificiation.harmonics_cache.clear()   # time building the harmonics, not just reusing them
+        verificiation.fourier_series(t, 1.1 * t[-1], *coeffs)
+    return run, 1, "evaluation"
+
+def setup_align_trajectories() -> Workload:
+    # A long recording that sits still except for the 5 simulated seconds, two minutes in
+    solution = reference_solution(CONFIG["solve_time_span"], CONFIG["process_num_points"])
+    arm1, arm2 = verificiation.process_pendulum_data(dict(solution, lengths=REFERENCE_PARAMS["lengths"]))
+    rng = np.random.default_rng(0)
+    t = np.arange(CONFIG["alignment_minutes"] * 60 * CONFIG["alignment_fps"]) / CONFIG["alignment_fps"]
+    video = [Trajectory.from_columns(t, np.interp(t - 120.0, arm.time, arm.angle) + rng.normal(0, 0.01, len(t)), 0.0, 0.0)
+             for arm in (arm1, arm2)]
+    return lambda: verificiation.align_trajectories(*video, arm1, arm2, max_scale=0.002), 1, "alignment"
+
+def get_benchmarks() -> Dict[str, Callable[[], Workload]]:
+    benchmarks = {"equations_of_motion": setup_eom, "kernel_rhs": setup_kernel_rhs}
+    for method in CONFIG["solver_methods"]:
+        benchmarks[f"solve_pendulum_ode[{method}]"] = lambda method=method: setup_solve(method)
+    benchmarks["process_pendulum_data"] = setup_process_pendulum_data
+    benchmarks["create_animation"] = setup_create_animation
+    benchmarks["process_frame"] = lambda: setup_process_frame(roi=False)
+    benchmarks["process_frame[roi]"] = lambda: setup_process_frame(roi=True)
+    benchmarks["tracker_update[predictive]"] = setup_tracker_update
+    for num_terms in CONFIG["fourier_terms"]:
+        benchmarks[f"fit_fourier[{num_terms}]"] = lambda num_terms=num_terms: setup_fit_fourier(num_terms)
+    benchmarks["fourier_series[499]"] = lambda: setup_fourier_series(499)
+    benchmarks["align_trajectories"] = setup_align_trajectories
+    return benchmarks
+
+def time_workload(run: Callable[[], None], repeats: int) -> float:
+    # The fastest repeat is the least disturbed by whatever else the machine is doing
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run_benchmarks(names: Optional[List[str]] = None, repeats: int = None) -> Dict[str, dict]:
+    benchmarks = get_benchmarks()
+    results = {}
+    original = copy.deepcopy(simulation.CONFIG)
+    for name in names or benchmarks:
+        try:
+            run, units, unit = benchmarks[name]()
+        except ImportError as e:
+            # process_frame needs cv2, which the simulation side doesn't
+            results[name] = {"status": "skipped", "reason": str(e)}
+            print(f"{name:<32}skipped ({e})")
+            continue
+        seconds = time_workload(run, repeats or CONFIG["repeats"])
+        simulation.CONFIG.update(copy.deepcopy(original))
+        results[name] = {"status": "ok", "seconds": seconds, "units": units, "unit": unit,
+                         "seconds_per_unit": seconds / units}
+        print(f"{name:<32}{seconds:>10.4f} s{seconds / units * 1e6:>14.2f} µs/{unit}")
+    return results
+
+def get_machine() -> dict:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count()
+    }
+
+def load_baseline(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_results(path: str, results: Dict[str, dict]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": get_machine(), "results": results}, f, indent=2)
+
+def compare(results: Dict[str, dict], baseline: dict, tolerance: float) -> List[str]:
+    """Print each benchmark against its baseline and return the names that regressed."""
+    regressions = []
+    print(f"\n{'benchmark':<32}{'baseline (s)':>14}{'now (s)':>12}{'ratio':>8}")
+    for name, result in results.items():
+        reference = baseline["results"].get(name)
+        if result["status"] != "ok" or reference is None or reference["status"] != "ok":
+            continue
+        ratio = result["seconds_per_unit"] / reference["seconds_per_unit"]
+        flag = "  REGRESSION" if ratio > tolerance else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<32}{reference['seconds']:>14.4f}{result['seconds']:>12.4f}{ratio:>8.2f}{flag}")
+    if baseline.get("machine") != get_machine():
+        print("Note: the baseline was recorded on a different machine or environment")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the fixed reference workloads and compare them to a baseline.")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="run only these benchmarks")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    parser.add_argument("--repeats", type=int, default=CONFIG["repeats"])
+    parser.add_argument("--baseline", default=CONFIG["baseline_path"])
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=CONFIG["tolerance"])
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(get_benchmarks()))
+        return
+    unknown = set(args.only or []) - set(get_benchmarks())
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = run_benchmarks(args.only, args.repeats)
+    save_results(CONFIG["results_path"], results)
+    if args.save_baseline:
+        # Merge, so re-recording a single benchmark keeps the others
+        baseline = load_baseline(args.baseline) or {"results": {}}
+        save_results(args.baseline, {**baseline["results"], **results})
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one")
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
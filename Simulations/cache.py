@@ -0,0 +1,386 @@
+import numpy as np
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import socket
+import time
+
+INDEX_NAME = "index.json"
+LOCK_NAME = "index.lock"
+META_NAME = "meta.json"
+LOCK_TIMEOUT = 30.0
+LOCK_STALE = 300.0  # seconds after which a lock counts as left behind, even if its owner can't be checked
+TRASH_SUFFIX = ".trash"
+
+class CacheEntry(NamedTuple):
+    key: str
+    params: Optional[dict]
+    lengths: List[float]
+    nbytes: int
+    created: float
+    last_access: float
+    path: str
+
+class SimulationCache:
+    """Binary trajectory store keyed by parameter hash, with an index and LRU eviction.
+
+    Each entry is a directory holding one .npy file per array plus a meta.json sidecar,
+    so arrays can be memory-mapped instead of parsed. index.json mirrors the sidecars for
+    quick queries and can always be rebuilt from them. Reads only bump the modification
+    time of the sidecar, which eviction takes as the entry's last access.
+    """
+
+    def __init__(self, root: str, max_bytes: Optional[int] = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.entry_dir(key), META_NAME))
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        # A lock file works the same on Windows and POSIX and across pool workers
+        lock_path = os.path.join(self.root, LOCK_NAME)
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                if break_stale_lock(lock_path):
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(
+                        f"Could not lock simulation cache index at {lock_path}; if no other process is "
+                        f"using the cache, run \"python Simulations/cache.py unlock\""
+                    )
+                time.sleep(0.01)
+        # Who holds the lock, so one left behind by a killed process can be recognised and broken
+        owner = json.dumps({"pid": os.getpid(), "host": socket.gethostname(), "time": time.time()})
+        os.write(fd, owner.encode())
+        try:
+            yield
+        finally:
+            os.close(fd)
+            # A lock held past LOCK_STALE may have been broken and taken by someone else since
+            held = read_lock(lock_path)
+            if held is not None and held["text"] == owner:
+                os.remove(lock_path)
+
+    def unlock(self) -> bool:
+        """Remove the index lock whoever holds it; False if there was none."""
+        try:
+            os.remove(os.path.join(self.root, LOCK_NAME))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def read_index(self) -> Dict[str, dict]:
+        path = os.path.join(self.root, INDEX_NAME)
+        if not os.path.exists(path):
+            return self.scan_entries()
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def write_index(self, index: Dict[str, dict]) -> None:
+        path = os.path.join(self.root, INDEX_NAME)
+        write_json_atomic(path, index)
+
+    def scan_entries(self) -> Dict[str, dict]:
+        index = {}
+        for meta_path in glob.glob(os.path.join(self.root, "*", META_NAME)):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            # Skips half-written .tmp and half-deleted .trash directories
+            if os.path.basename(os.path.dirname(meta_path)) == meta["key"]:
+                index[meta["key"]] = meta
+        return index
+
+    def rebuild_index(self) -> None:
+        with self.locked():
+            self.write_index(self.scan_entries())
+
+    def store(
+        self,
+        key: str,
+        arrays: Dict[str, np.ndarray],
+        params: Optional[dict],
+        lengths: List[float],
+        extra: Optional[dict] = None
+    ) -> CacheEntry:
+        entry_dir = self.entry_dir(key)
+        tmp_dir = f"{entry_dir}.tmp{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        nbytes = 0
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array, dtype=np.float64)
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+            nbytes += array.nbytes
+
+        now = time.time()
+        meta = {
+            "key": key,
+            "params": params,
+            "lengths": [float(l) for l in lengths],
+            "arrays": sorted(arrays),
+            "nbytes": nbytes,
+            "created": now,
+            "last_access": now,
+            **(extra or {})
+        }
+        write_json_atomic(os.path.join(tmp_dir, META_NAME), meta)
+
+        with self.locked():
+            if os.path.exists(entry_dir) and not delete_dir(entry_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise OSError(f"Could not replace {entry_dir}, it is still in use")
+            os.replace(tmp_dir, entry_dir)
+            index = self.read_index()
+            index[key] = meta
+            self.write_index(index)
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes, keep=key)
+        return make_entry(meta, entry_dir)
+
+    def append(self, key: str, arrays: Dict[str, np.ndarray], extra: Optional[dict] = None) -> CacheEntry:
+        """Add new arrays to an existing entry without rewriting the ones it already holds."""
+        entry_dir = self.entry_dir(key)
+        with self.locked():
+            meta = self.meta(key)
+            clashing = sorted(set(arrays) & set(meta["arrays"]))
+            if clashing:
+                raise ValueError(f"Entry {key} already holds {', '.join(clashing)}")
+            # The arrays land before meta.json lists them, so a reader never sees a half-written one
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array, dtype=np.float64)
+                path = os.path.join(entry_dir, f"{name}.npy")
+                with open(f"{path}.tmp{os.getpid()}", "wb") as f:
+                    np.save(f, array)
+                os.replace(f"{path}.tmp{os.getpid()}", path)
+                meta["nbytes"] += array.nbytes
+            meta["arrays"] = sorted(meta["arrays"] + list(arrays))
+            meta.update(extra or {})
+            write_json_atomic(os.path.join(entry_dir, META_NAME), meta)
+            index = self.read_index()
+            index[key] = meta
+            self.write_index(index)
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes, keep=key)
+        return make_entry(meta, entry_dir)
+
+    def load(self, key: str, mmap: bool = True, touch: bool = True) -> dict:
+        return self.load_with_meta(key, mmap, touch)[0]
+
+    def load_with_meta(self, key: str, mmap: bool = True, touch: bool = True) -> Tuple[dict, dict]:
+        """The arrays together with the meta.json they were loaded by, read once."""
+        entry_dir = self.entry_dir(key)
+        with open(os.path.join(entry_dir, META_NAME), "r") as f:
+            meta = json.load(f)
+        data = {
+            name: np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in meta["arrays"]
+        }
+        data["lengths"] = np.array(meta["lengths"])
+        if touch:
+            self.touch(key)
+        return data, meta
+
+    def meta(self, key: str) -> dict:
+        with open(os.path.join(self.entry_dir(key), META_NAME), "r") as f:
+            return json.load(f)
+
+    def touch(self, key: str) -> None:
+        # No lock and no index write, so a read stays as cheap as the memory map it returns
+        try:
+            os.utime(os.path.join(self.entry_dir(key), META_NAME))
+        except OSError:
+            pass
+
+    def last_access(self, key: str, meta: dict) -> float:
+        try:
+            return max(meta["last_access"], os.path.getmtime(os.path.join(self.entry_dir(key), META_NAME)))
+        except OSError:
+            return meta["last_access"]
+
+    def query(self, predicate: Optional[Callable[[CacheEntry], bool]] = None) -> List[CacheEntry]:
+        entries = [
+            make_entry(dict(meta, last_access=self.last_access(key, meta)), self.entry_dir(key))
+            for key, meta in self.read_index().items()
+        ]
+        return [entry for entry in entries if predicate is None or predicate(entry)]
+
+    def total_bytes(self) -> int:
+        return sum(meta["nbytes"] for meta in self.read_index().values())
+
+    def remove(self, key: str) -> None:
+        with self.locked():
+            if not delete_dir(self.entry_dir(key)):
+                raise OSError(f"Could not remove {self.entry_dir(key)}, it is still in use")
+            index = self.read_index()
+            index.pop(key, None)
+            self.write_index(index)
+
+    def evict(self, max_bytes: int, keep: Optional[str] = None) -> List[str]:
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        removed = []
+        with self.locked():
+            for trash in glob.glob(os.path.join(self.root, f"*{TRASH_SUFFIX}*")):
+                shutil.rmtree(trash, ignore_errors=True)
+            index = self.read_index()
+            total = sum(meta["nbytes"] for meta in index.values())
+            for key, meta in sorted(index.items(), key=lambda item: self.last_access(*item)):
+                if total <= max_bytes:
+                    break
+                # Entries still memory-mapped somewhere can't be deleted on Windows, so they stay indexed
+                if key == keep or not delete_dir(self.entry_dir(key)):
+                    continue
+                del index[key]
+                total -= meta["nbytes"]
+                removed.append(key)
+            self.write_index(index)
+        return removed
+
+def read_lock(lock_path: str) -> Optional[dict]:
+    try:
+        with open(lock_path, "r") as f:
+            text = f.read()
+        mtime = os.path.getmtime(lock_path)
+    except OSError:
+        return None
+    try:
+        return dict(json.loads(text), text=text)
+    except ValueError:
+        # Created but not written yet, or written by an older version that left it empty
+        return {"time": mtime, "text": text}
+
+def lock_owner_alive(owner: dict) -> bool:
+    # Only a process on this machine can be checked, and on Windows os.kill would terminate it instead
+    if "pid" not in owner or owner.get("host") != socket.gethostname() or os.name == "nt":
+        return True
+    try:
+        os.kill(owner["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+def break_stale_lock(lock_path: str) -> bool:
+    """Remove a lock whose owner has died or that is older than LOCK_STALE; True if it was removed."""
+    owner = read_lock(lock_path)
+    if owner is None:
+        return True  # released in the meantime
+    if lock_owner_alive(owner) and time.time() - owner["time"] < LOCK_STALE:
+        return False
+    # Another process may break the same lock and take a new one in between, so the lock is moved
+    # aside first and only deleted if it's still the one that was found stale
+    stale_path = f"{lock_path}.stale{os.getpid()}"
+    try:
+        os.replace(lock_path, stale_path)
+    except OSError:
+        return False
+    moved = read_lock(stale_path)
+    if moved is not None and moved["text"] != owner["text"]:
+        if not os.path.exists(lock_path):
+            os.replace(stale_path, lock_path)
+        else:
+            os.remove(stale_path)
+        return False
+    os.remove(stale_path)
+    return True
+
+def delete_dir(path: str) -> bool:
+    """Delete a directory entirely or not at all; False if it couldn't be moved out of the way."""
+    if not os.path.exists(path):
+        return True
+    # Renaming fails as a whole while a file inside is open, unlike rmtree, which would leave half of it behind
+    trash = f"{path}{TRASH_SUFFIX}{os.getpid()}"
+    try:
+        os.replace(path, trash)
+    except OSError:
+        return False
+    shutil.rmtree(trash, ignore_errors=True)   # anything left is cleaned up by the next evict
+    return True
+
+def write_json_atomic(path: str, data: dict) -> None:
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def make_entry(meta: dict, path: str) -> CacheEntry:
+    return CacheEntry(
+        key=meta["key"],
+        params=meta["params"],
+        lengths=meta["lengths"],
+        nbytes=meta["nbytes"],
+        created=meta["created"],
+        last_access=meta["last_access"],
+        path=path
+    )
+
+def migrate_text_files(cache: SimulationCache, directory: str, remove: bool = False) -> List[str]:
+    """Import the old simulation_<sha256>.txt JSON dumps into the binary cache."""
+    migrated = []
+    pattern = re.compile(r"simulation_([0-9a-f]{64})\.txt$")
+    for path in sorted(glob.glob(os.path.join(directory, "simulation_*.txt"))):
+        match = pattern.search(os.path.basename(path))
+        if not match or match.group(1) in cache:
+            continue
+        with open(path, "r") as f:
+            data = json.load(f)
+        # The text format never recorded the full parameter set, only the arm lengths
+        cache.store(
+            match.group(1),
+            {"y": np.array(data["y"]), "t": np.array(data["t"])},
+            params=None,
+            lengths=data.get("lengths", []),
+            extra={"migrated_from": path}
+        )
+        if remove:
+            os.remove(path)
+        migrated.append(match.group(1))
+    return migrated
+
+def main():
+    import simulation
+
+    parser = argparse.ArgumentParser(description="Manage the binary simulation cache.")
+    parser.add_argument("command", choices=["list", "migrate", "evict", "reindex", "unlock"],
+                        help="unlock removes an index.lock left behind by a process that was killed while holding it")
+    parser.add_argument("--root", default=simulation.CONFIG["path_to_cache"])
+    parser.add_argument("--source", default=simulation.CONFIG["path_to_data"],
+                        help="directory holding simulation_<hash>.txt files (migrate)")
+    parser.add_argument("--remove-text", action="store_true", help="delete .txt files after migrating")
+    parser.add_argument("--max-bytes", type=int, default=simulation.CONFIG["cache_max_bytes"])
+    args = parser.parse_args()
+
+    cache = SimulationCache(args.root)
+    if args.command == "migrate":
+        migrated = migrate_text_files(cache, args.source, args.remove_text)
+        print(f"Migrated {len(migrated)} text file(s) into {args.root}")
+    elif args.command == "evict":
+        removed = cache.evict(args.max_bytes)
+        print(f"Evicted {len(removed)} entr{'y' if len(removed) == 1 else 'ies'}")
+    elif args.command == "reindex":
+        cache.rebuild_index()
+    elif args.command == "unlock":
+        print("Removed the index lock" if cache.unlock() else "The index wasn't locked")
+    else:
+        for entry in sorted(cache.query(), key=lambda e: e.last_access, reverse=True):
+            accessed = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.last_access))
+            print(f"{entry.key}  {entry.nbytes/1e6:8.2f} MB  last used {accessed}")
+        print(f"Total: {cache.total_bytes()/1e6:.2f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy.integrate import solve_ivp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, List, NamedTuple, Optional, Tuple
+import os
+import json
+
+import simulation
+from kernel import PendulumKernel
+from lyapunov import lyapunov_spectrum
+
+CONFIG = {
+    "title": "Flip Time Map",
+    "map_outpath": "./Simulations/sim_outfiles/",
+    "path_to_tiles": "C:\\Users\\adamf\\Downloads\\chaos_map\\",
+    "kind": "flip",                 # "flip", "divergence" or "lyapunov"
+    "theta1_range": (-np.pi, np.pi),
+    "theta2_range": (-np.pi, np.pi),
+    "resolution": (400, 400),       # (rows over theta2, columns over theta1)
+    "tile_size": 50,
+    "workers": os.cpu_count(),
+    "divergence": {
+        "perturbation": 1e-8,
+        "threshold": 1e-2
+    },
+    "lyapunov": {
+        "renorm_interval": 0.1
+    },
+    # Map cells are short, independent runs; an explicit method is far cheaper than Radau here.
+    "solver": {
+        "method": "DOP853",
+        "rtol": 1e-8,
+        "atol": 1e-9
+    }
+}
+
+class Tile(NamedTuple):
+    row: int
+    col: int
+    rows: slice
+    cols: slice
+
+def get_tile_dir() -> str:
+    return f"{CONFIG['path_to_tiles']}{CONFIG['kind']}_{CONFIG['resolution'][0]}x{CONFIG['resolution'][1]}"
+
+def get_tile_path(tile_dir: str, tile: Tile) -> str:
+    return os.path.join(tile_dir, f"tile_{tile.row:04d}_{tile.col:04d}.npy")
+
+def get_map_spec() -> dict:
+    spec = {
+        "kind": CONFIG["kind"],
+        "theta1_range": list(CONFIG["theta1_range"]),
+        "theta2_range": list(CONFIG["theta2_range"]),
+        "resolution": list(CONFIG["resolution"]),
+        "tile_size": CONFIG["tile_size"],
+        "divergence": CONFIG["divergence"],
+        "solver": CONFIG["solver"],
+        "params": json.loads(json.dumps(simulation.CONFIG["params"]))
+    }
+    # Only added for its own kind so older flip/divergence tile directories keep matching
+    if CONFIG["kind"] == "lyapunov":
+        spec["lyapunov"] = CONFIG["lyapunov"]
+    return spec
+
+def get_grid(spec: dict) -> Tuple[np.ndarray, np.ndarray]:
+    rows, cols = spec["resolution"]
+    theta1 = np.linspace(*spec["theta1_range"], cols)
+    theta2 = np.linspace(*spec["theta2_range"], rows)
+    return theta1, theta2
+
+def make_tiles(resolution: Tuple[int, int], tile_size: int) -> List[Tile]:
+    rows, cols = resolution
+    return [
+        Tile(r // tile_size, c // tile_size, slice(r, min(r + tile_size, rows)), slice(c, min(c + tile_size, cols)))
+        for r in range(0, rows, tile_size)
+        for c in range(0, cols, tile_size)
+    ]
+
+def prepare_tile_dir(spec: dict) -> str:
+    tile_dir = get_tile_dir()
+    os.makedirs(tile_dir, exist_ok=True)
+    spec_path = os.path.join(tile_dir, "spec.json")
+    if os.path.exists(spec_path):
+        with open(spec_path, "r") as f:
+            if json.load(f) != spec:
+                raise ValueError(f"Tiles in {tile_dir} were computed with a different map spec")
+    else:
+        with open(spec_path, "w") as f:
+            json.dump(spec, f, sort_keys=True)
+    return tile_dir
+
+def min_flip_energy(params: dict) -> float:
+    # Lowest potential energy with the lower arm inverted (theta1 = 0, theta2 = pi)
+    m1, m2 = params["masses"]
+    l1, l2 = params["lengths"]
+    g = params["gravity"]
+    return -0.5*(m1 + 2*m2)*g*l1 + 0.5*m2*g*l2
+
+def flip_event(t: float, y: np.ndarray) -> float:
+    return np.pi - abs(y[1])
+flip_event.terminal = True
+flip_event.direction = -1
+
+def make_divergence_event(threshold: float) -> Callable:
+    def divergence_event(t: float, y: np.ndarray) -> float:
+        return threshold - np.hypot(y[4] - y[0], y[5] - y[1])
+    divergence_event.terminal = True
+    divergence_event.direction = -1
+    return divergence_event
+
+def event_time(fun: Callable, y0: np.ndarray, event: Callable, t_span: Tuple[float, float], solver: dict) -> float:
+    sol = solve_ivp(fun=fun, t_span=t_span, y0=y0, events=event, **solver)
+    if sol.status == 1 and len(sol.t_events[0]):
+        return sol.t_events[0][0]
+    return np.nan
+
+def compute_cell(theta1: float, theta2: float, spec: dict, kernel: PendulumKernel) -> float:
+    params = spec["params"]
+    t_span = tuple(params["time_span"])
+    y0 = np.array([theta1, theta2, *params["initial_velocities"]])
+
+    if spec["kind"] == "flip":
+        if abs(theta2) >= np.pi:
+            return t_span[0]
+        if kernel.energy(y0) < min_flip_energy(params):
+            return np.nan
+        return event_time(kernel.rhs, y0, flip_event, t_span, spec["solver"])
+
+    if spec["kind"] == "divergence":
+        shadow = y0.copy()
+        shadow[:2] += spec["divergence"]["perturbation"]
+        event = make_divergence_event(spec["divergence"]["threshold"])
+        paired = lambda t, y: kernel.rhs_batch(t, y.reshape(2, 4).T).T.ravel()
+        return event_time(paired, np.concatenate([y0, shadow]), event, t_span, spec["solver"])
+
+    raise ValueError(f"Unknown map kind: {spec['kind']}")
+
+def compute_lyapunov_tile(theta1: np.ndarray, theta2: np.ndarray, spec: dict, kernel: PendulumKernel) -> np.ndarray:
+    # The whole tile goes through one batched tangent-space integration
+    params = spec["params"]
+    th1, th2 = np.meshgrid(theta1, theta2)
+    states = simulation.make_initial_states(np.column_stack([th1.ravel(), th2.ravel()]), params["initial_velocities"])
+    duration = params["time_span"][1] - params["time_span"][0]
+    result = lyapunov_spectrum(states, duration, 1, spec["lyapunov"]["renorm_interval"], kernel, spec["solver"])
+    return result.exponents[:, 0].reshape(th1.shape)
+
+def compute_tile(tile: Tile, spec: dict, tile_dir: str) -> Tile:
+    # Physical parameters come from the spec, not whatever CONFIG the worker was started with
+    kernel = PendulumKernel.from_params(spec["params"])
+    theta1, theta2 = get_grid(spec)
+    if spec["kind"] == "lyapunov":
+        values = compute_lyapunov_tile(theta1[tile.cols], theta2[tile.rows], spec, kernel)
+    else:
+        values = np.empty((tile.rows.stop - tile.rows.start, tile.cols.stop - tile.cols.start))
+        for i, th2 in enumerate(theta2[tile.rows]):
+            for j, th1 in enumerate(theta1[tile.cols]):
+                values[i, j] = compute_cell(th1, th2, spec, kernel)
+
+    # Write then rename so a killed run never leaves a half-written tile behind
+    path = get_tile_path(tile_dir, tile)
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, values)
+    os.replace(tmp_path, path)
+    return tile
+
+def assemble_map(tile_dir: str, tiles: List[Tile]) -> np.ndarray:
+    result = np.full(CONFIG["resolution"], np.nan)
+    for tile in tiles:
+        path = get_tile_path(tile_dir, tile)
+        if os.path.exists(path):
+            result[tile.rows, tile.cols] = np.load(path)
+    return result
+
+def compute_chaos_map(workers: Optional[int] = None) -> np.ndarray:
+    spec = get_map_spec()
+    tile_dir = prepare_tile_dir(spec)
+    tiles = make_tiles(CONFIG["resolution"], CONFIG["tile_size"])
+    pending = [tile for tile in tiles if not os.path.exists(get_tile_path(tile_dir, tile))]
+    print(f"{len(tiles) - len(pending)}/{len(tiles)} tiles already on disk in {tile_dir}")
+
+    with ProcessPoolExecutor(max_workers=workers or CONFIG["workers"]) as pool:
+        futures = [pool.submit(compute_tile, tile, spec, tile_dir) for tile in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            tile = future.result()
+            print(f"Tile ({tile.row}, {tile.col}) done [{done}/{len(pending)}]")
+
+    return assemble_map(tile_dir, tiles)
+
+def plot_chaos_map(values: np.ndarray) -> None:
+    label = {
+        "flip": "Time until lower arm flips (s)",
+        "divergence": "Time until divergence (s)",
+        "lyapunov": "Largest Lyapunov exponent (1/s)"
+    }[CONFIG["kind"]]
+    masked = np.ma.masked_invalid(values)
+
+    plt.figure(figsize=(10, 9))
+    plt.imshow(
+        masked,
+        origin="lower",
+        extent=(*CONFIG["theta1_range"], *CONFIG["theta2_range"]),
+        norm="log" if masked.count() and masked.min() > 0 else None,
+        cmap="viridis",
+        aspect="auto"
+    )
+    plt.colorbar(label=label)
+    plt.xlabel("Initial θ1 (radians)")
+    plt.ylabel("Initial θ2 (radians)")
+    plt.title(f"{CONFIG['title']} - {simulation.CONFIG['title']}")
+    os.makedirs(CONFIG["map_outpath"], exist_ok=True)
+    plt.savefig(f"{CONFIG['map_outpath']}{CONFIG['title']} - {simulation.CONFIG['title']}.png")
+    plt.show()
+
+def main():
+    values = compute_chaos_map()
+    plot_chaos_map(values)
+
+if __name__ == "__main__":
+    main()
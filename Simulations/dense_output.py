@@ -0,0 +1,126 @@
+import numpy as np
+from typing import Dict, List
+
+from kernel import PendulumKernel
+
+# Polynomial degree of each solve_ivp method's own interpolant. LSODA isn't listed: it switches between
+# Adams steps of up to order 12 and BDF steps of up to order 5, so its degree is read from the steps themselves.
+SOLVER_DEGREES = {"RK23": 3, "RK45": 4, "DOP853": 7, "Radau": 3, "BDF": 5}
+EVAL_CHUNK = 65536
+
+# Quintic Hermite basis in monomial form; rows act on (y0, h y0', h² y0'', y1, h y1', h² y1'')
+QUINTIC_HERMITE = np.array([
+    [1, 0, 0, -10, 15, -6],
+    [0, 1, 0, -6, 8, -3],
+    [0, 0, 0.5, -1.5, 1.5, -0.5],
+    [0, 0, 0, 10, -15, 6],
+    [0, 0, 0, -4, 7, -3],
+    [0, 0, 0, 0.5, -1, 0.5]
+])
+
+class DenseTrajectory:
+    """Piecewise polynomial trajectory, evaluated lazily at arbitrary times.
+
+    Segment i covers [ts[i], ts[i+1]] and holds monomial coefficients in the local
+    variable s = (t - ts[i]) / (ts[i+1] - ts[i]), so the whole thing is two arrays.
+    """
+
+    def __init__(self, ts: np.ndarray, coeffs: np.ndarray):
+        self.ts = np.asarray(ts, dtype=np.float64)
+        self.coeffs = np.asarray(coeffs, dtype=np.float64)  # (segments, 4, degree + 1)
+        if len(self.ts) != self.coeffs.shape[0] + 1:
+            raise ValueError("Need exactly one more breakpoint than segments")
+
+    @property
+    def t_min(self) -> float:
+        return self.ts[0]
+
+    @property
+    def t_max(self) -> float:
+        return self.ts[-1]
+
+    @classmethod
+    def from_ode_solution(cls, sol, method: str) -> "DenseTrajectory":
+        # Sampling each step's interpolant at degree + 1 interior Chebyshev nodes and solving
+        # the (shared) Vandermonde system recovers its coefficients exactly.
+        if method == "LSODA":
+            # Each LSODA interpolant is a polynomial in the powers 0..order it keeps in p
+            degree = max(len(interpolant.p) - 1 for interpolant in sol.interpolants)
+        else:
+            degree = SOLVER_DEGREES.get(method, 7)
+        ts = np.asarray(sol.ts)
+        if ts[0] > ts[-1]:
+            raise ValueError("Backward integrations are not supported")
+        nodes = 0.5 - 0.5*np.cos((2*np.arange(degree + 1) + 1) * np.pi / (2*(degree + 1)))
+        h = np.diff(ts)
+        t_nodes = ts[:-1, None] + h[:, None]*nodes[None, :]
+        values = sol(t_nodes.ravel()).reshape(4, len(h), degree + 1).transpose(1, 2, 0)
+        vandermonde = np.vander(nodes, degree + 1, increasing=True)
+        coeffs = np.linalg.solve(vandermonde, values)  # (segments, degree + 1, 4)
+        return cls(ts, coeffs.transpose(0, 2, 1))
+
+    @classmethod
+    def from_samples(cls, t: np.ndarray, y: np.ndarray, kernel: PendulumKernel) -> "DenseTrajectory":
+        # Quintic Hermite through stored samples, with y' = f(y) and y'' = J(y) f(y)
+        t = np.asarray(t, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        dy = kernel.rhs_batch(0.0, y)
+        d2y = np.einsum("nij,jn->in", kernel.jac_batch(0.0, y), dy)
+        h = np.diff(t)
+        node_data = np.stack([
+            y[:, :-1], h*dy[:, :-1], h*h*d2y[:, :-1],
+            y[:, 1:], h*dy[:, 1:], h*h*d2y[:, 1:]
+        ])  # (6, 4, segments)
+        coeffs = np.einsum("bk,bjs->sjk", QUINTIC_HERMITE, node_data)
+        return cls(t, coeffs)
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "DenseTrajectory":
+        return cls(arrays["dense_t"], arrays["dense_coeffs"])
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {"dense_t": self.ts, "dense_coeffs": self.coeffs}
+
+    def __call__(self, t: np.ndarray) -> np.ndarray:
+        t = np.asarray(t, dtype=np.float64)
+        flat = np.atleast_1d(t).ravel()
+        out = np.empty((4, len(flat)))
+        for start in range(0, len(flat), EVAL_CHUNK):
+            chunk = flat[start:start + EVAL_CHUNK]
+            i = np.clip(np.searchsorted(self.ts, chunk, side="right") - 1, 0, len(self.ts) - 2)
+            s = (chunk - self.ts[i]) / (self.ts[i+1] - self.ts[i])
+            c = self.coeffs[i]
+            result = c[:, :, -1].T.copy()
+            for k in range(c.shape[2] - 2, -1, -1):
+                result *= s
+                result += c[:, :, k].T
+            out[:, start:start + len(chunk)] = result
+        return out.reshape((4,) + t.shape)
+
+    def sample(self, num_points: int) -> Dict[str, np.ndarray]:
+        t = np.linspace(self.t_min, self.t_max, num_points)
+        return {"y": self(t), "t": t}
+
+    def restrict(self, t_end: float) -> "DenseTrajectory":
+        """Drop everything after t_end, shortening the last kept segment if needed."""
+        if t_end >= self.t_max:
+            return self
+        last = max(int(np.searchsorted(self.ts, t_end, side="left")), 1)
+        ts = self.ts[:last + 1].copy()
+        coeffs = self.coeffs[:last].copy()
+        scale = (t_end - ts[-2]) / (ts[-1] - ts[-2])
+        coeffs[-1] *= scale ** np.arange(coeffs.shape[2])
+        ts[-1] = t_end
+        return DenseTrajectory(ts, coeffs)
+
+def concatenate(parts: List[DenseTrajectory]) -> DenseTrajectory:
+    degree = max(part.coeffs.shape[2] for part in parts)
+    ts = [parts[0].ts]
+    coeffs = []
+    for part in parts:
+        coeffs.append(np.pad(part.coeffs, ((0, 0), (0, 0), (0, degree - part.coeffs.shape[2]))))
+        if part is not parts[0]:
+            if not np.isclose(part.t_min, ts[-1][-1]):
+                raise ValueError(f"Gap between dense segments at t = {ts[-1][-1]}")
+            ts.append(part.ts[1:])
+    return DenseTrajectory(np.concatenate(ts), np.concatenate(coeffs))
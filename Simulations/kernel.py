@@ -0,0 +1,249 @@
+import numpy as np
+from scipy.integrate import solve_ivp
+from typing import Tuple
+import math
+import time
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+StateVector = Tuple[float, float, float, float]
+
+# Constants vector layout shared by the scalar kernels below
+# (A, B, G1, K1, G2, K2, r, q) from the equations of motion:
+#   ddtheta1 = (-G1 sin θ1 - K1 ω1² sin 2Δ + G2 sin θ2 cos Δ - K2 ω2² sin Δ) / (A - B cos² Δ)
+#   ddtheta2 = -2r ddtheta1 cos Δ + 2r ω1² sin Δ - q sin θ2,   Δ = θ1 - θ2
+
+def bind_constants(masses: Tuple[float, float], lengths: Tuple[float, float], gravity: float) -> np.ndarray:
+    m1, m2 = masses
+    l1, l2 = lengths
+    g = gravity
+    return np.array([
+        l1*(m1 + 4*m2),
+        4*m2*l1,
+        6*(m1 + 2*m2)*g,
+        2*m2*l1,
+        12*m2*g,
+        2*m2*l2,
+        l1/l2,
+        6*g/l2
+    ])
+
+def rhs_kernel(y: np.ndarray, c: np.ndarray) -> np.ndarray:
+    theta1, theta2, omega1, omega2 = y[0], y[1], y[2], y[3]
+    A, B, G1, K1, G2, K2, r, q = c[0], c[1], c[2], c[3], c[4], c[5], c[6], c[7]
+    s1, s2 = math.sin(theta1), math.sin(theta2)
+    sd, cd = math.sin(theta1 - theta2), math.cos(theta1 - theta2)
+
+    ddtheta1 = (
+        -G1*s1 - 2*K1*omega1*omega1*sd*cd + G2*s2*cd - K2*omega2*omega2*sd
+    ) / (A - B*cd*cd)
+    ddtheta2 = -2*r*ddtheta1*cd + 2*r*omega1*omega1*sd - q*s2
+
+    out = np.empty(4)
+    out[0] = omega1
+    out[1] = omega2
+    out[2] = ddtheta1
+    out[3] = ddtheta2
+    return out
+
+def jacobian_kernel(y: np.ndarray, c: np.ndarray) -> np.ndarray:
+    theta1, theta2, omega1, omega2 = y[0], y[1], y[2], y[3]
+    A, B, G1, K1, G2, K2, r, q = c[0], c[1], c[2], c[3], c[4], c[5], c[6], c[7]
+    s1, c1 = math.sin(theta1), math.cos(theta1)
+    s2, c2 = math.sin(theta2), math.cos(theta2)
+    sd, cd = math.sin(theta1 - theta2), math.cos(theta1 - theta2)
+    s2d, c2d = 2*sd*cd, cd*cd - sd*sd
+    w1, w2 = omega1*omega1, omega2*omega2
+
+    den = A - B*cd*cd
+    num = -G1*s1 - K1*w1*s2d + G2*s2*cd - K2*w2*sd
+    a1 = num / den
+
+    # d(den)/dθ1 = B sin 2Δ = -d(den)/dθ2
+    da1_dth1 = (-G1*c1 - 2*K1*w1*c2d - G2*s2*sd - K2*w2*cd - a1*B*s2d) / den
+    da1_dth2 = (2*K1*w1*c2d + G2*(c2*cd + s2*sd) + K2*w2*cd + a1*B*s2d) / den
+    da1_dw1 = -2*K1*omega1*s2d / den
+    da1_dw2 = -2*K2*omega2*sd / den
+
+    jac = np.zeros((4, 4))
+    jac[0, 2] = 1.0
+    jac[1, 3] = 1.0
+    jac[2, 0] = da1_dth1
+    jac[2, 1] = da1_dth2
+    jac[2, 2] = da1_dw1
+    jac[2, 3] = da1_dw2
+    jac[3, 0] = -2*r*(da1_dth1*cd - a1*sd) + 2*r*w1*cd
+    jac[3, 1] = -2*r*(da1_dth2*cd + a1*sd) - 2*r*w1*cd - q*c2
+    jac[3, 2] = -2*r*da1_dw1*cd + 4*r*omega1*sd
+    jac[3, 3] = -2*r*da1_dw2*cd
+    return jac
+
+def constants_jacobian_kernel(y: np.ndarray, c: np.ndarray) -> np.ndarray:
+    # ∂f/∂c for the constants vector, used by the forward sensitivity equations
+    theta1, theta2, omega1, omega2 = y[0], y[1], y[2], y[3]
+    A, B, G1, K1, G2, K2, r, q = c[0], c[1], c[2], c[3], c[4], c[5], c[6], c[7]
+    s1, s2 = math.sin(theta1), math.sin(theta2)
+    sd, cd = math.sin(theta1 - theta2), math.cos(theta1 - theta2)
+    w1, w2 = omega1*omega1, omega2*omega2
+
+    den = A - B*cd*cd
+    a1 = (-G1*s1 - 2*K1*w1*sd*cd + G2*s2*cd - K2*w2*sd) / den
+
+    jac = np.zeros((4, 8))
+    jac[2, 0] = -a1 / den
+    jac[2, 1] = a1*cd*cd / den
+    jac[2, 2] = -s1 / den
+    jac[2, 3] = -2*w1*sd*cd / den
+    jac[2, 4] = s2*cd / den
+    jac[2, 5] = -w2*sd / den
+    for k in range(6):
+        jac[3, k] = -2*r*cd*jac[2, k]
+    jac[3, 6] = -2*a1*cd + 2*w1*sd
+    jac[3, 7] = -s2
+    return jac
+
+if HAS_NUMBA:
+    compiled_rhs_kernel = njit(cache=True)(rhs_kernel)
+    compiled_jacobian_kernel = njit(cache=True)(jacobian_kernel)
+    compiled_constants_jacobian_kernel = njit(cache=True)(constants_jacobian_kernel)
+
+class PendulumKernel:
+    def __init__(
+        self,
+        masses: Tuple[float, float],
+        lengths: Tuple[float, float],
+        gravity: float,
+        backend: str = "auto"
+    ):
+        self.masses = tuple(masses)
+        self.lengths = tuple(lengths)
+        self.gravity = gravity
+        self.constants = bind_constants(masses, lengths, gravity)
+
+        if backend == "auto":
+            backend = "numba" if HAS_NUMBA else "numpy"
+        if backend == "numba" and not HAS_NUMBA:
+            raise ImportError("The numba backend was requested but numba is not installed")
+        if backend not in ("numba", "numpy"):
+            raise ValueError(f"Unknown kernel backend: {backend}")
+        self.backend = backend
+        self.rhs_impl = compiled_rhs_kernel if backend == "numba" else rhs_kernel
+        self.jac_impl = compiled_jacobian_kernel if backend == "numba" else jacobian_kernel
+        self.constants_jac_impl = compiled_constants_jacobian_kernel if backend == "numba" else constants_jacobian_kernel
+
+    @classmethod
+    def from_params(cls, params: dict, backend: str = "auto") -> "PendulumKernel":
+        return cls(params["masses"], params["lengths"], params["gravity"], backend)
+
+    def rhs(self, t: float, y: StateVector) -> np.ndarray:
+        return self.rhs_impl(np.asarray(y, dtype=np.float64), self.constants)
+
+    def jac(self, t: float, y: StateVector) -> np.ndarray:
+        return self.jac_impl(np.asarray(y, dtype=np.float64), self.constants)
+
+    def constants_jac(self, t: float, y: StateVector) -> np.ndarray:
+        return self.constants_jac_impl(np.asarray(y, dtype=np.float64), self.constants)
+
+    def rhs_batch(self, t: float, states: np.ndarray) -> np.ndarray:
+        # states has shape (4, N)
+        A, B, G1, K1, G2, K2, r, q = self.constants
+        theta1, theta2, omega1, omega2 = states
+        s2 = np.sin(theta2)
+        delta = theta1 - theta2
+        sd, cd = np.sin(delta), np.cos(delta)
+
+        ddtheta1 = (
+            -G1*np.sin(theta1) - 2*K1*omega1**2*sd*cd + G2*s2*cd - K2*omega2**2*sd
+        ) / (A - B*cd**2)
+        ddtheta2 = -2*r*ddtheta1*cd + 2*r*omega1**2*sd - q*s2
+        return np.stack([omega1, omega2, ddtheta1, ddtheta2])
+
+    def jac_batch(self, t: float, states: np.ndarray) -> np.ndarray:
+        # states has shape (4, N); returns one 4x4 Jacobian per column, shape (N, 4, 4)
+        A, B, G1, K1, G2, K2, r, q = self.constants
+        theta1, theta2, omega1, omega2 = states
+        s1, c1 = np.sin(theta1), np.cos(theta1)
+        s2, c2 = np.sin(theta2), np.cos(theta2)
+        delta = theta1 - theta2
+        sd, cd = np.sin(delta), np.cos(delta)
+        s2d, c2d = 2*sd*cd, cd*cd - sd*sd
+        w1, w2 = omega1**2, omega2**2
+
+        den = A - B*cd**2
+        a1 = (-G1*s1 - K1*w1*s2d + G2*s2*cd - K2*w2*sd) / den
+        da1_dth1 = (-G1*c1 - 2*K1*w1*c2d - G2*s2*sd - K2*w2*cd - a1*B*s2d) / den
+        da1_dth2 = (2*K1*w1*c2d + G2*(c2*cd + s2*sd) + K2*w2*cd + a1*B*s2d) / den
+        da1_dw1 = -2*K1*omega1*s2d / den
+        da1_dw2 = -2*K2*omega2*sd / den
+
+        jac = np.zeros((np.shape(theta1)[0], 4, 4))
+        jac[:, 0, 2] = 1.0
+        jac[:, 1, 3] = 1.0
+        jac[:, 2, 0] = da1_dth1
+        jac[:, 2, 1] = da1_dth2
+        jac[:, 2, 2] = da1_dw1
+        jac[:, 2, 3] = da1_dw2
+        jac[:, 3, 0] = -2*r*(da1_dth1*cd - a1*sd) + 2*r*w1*cd
+        jac[:, 3, 1] = -2*r*(da1_dth2*cd + a1*sd) - 2*r*w1*cd - q*c2
+        jac[:, 3, 2] = -2*r*da1_dw1*cd + 4*r*omega1*sd
+        jac[:, 3, 3] = -2*r*da1_dw2*cd
+        return jac
+
+    def energy(self, states: np.ndarray) -> np.ndarray:
+        m1, m2 = self.masses
+        l1, l2 = self.lengths
+        g = self.gravity
+        theta1, theta2, omega1, omega2 = states
+        T = ((1/24)*(m1 + 4*m2)*(l1**2)*(omega1**2) +
+             (1/24)*m2*(l2**2)*(omega2**2) +
+             (1/6)*m2*l1*l2*omega1*omega2*np.cos(theta1 - theta2))
+        V = -((1/2)*(m1 + 2*m2)*g*l1*np.cos(theta1)) - (1/2)*m2*g*l2*np.cos(theta2)
+        return T + V
+
+def benchmark_kernel(time_span: Tuple[float, float] = (0.0, 10.0)) -> None:
+    import simulation
+
+    params = simulation.CONFIG["params"]
+    solver = simulation.get_solver_params()
+    y0 = (*params["initial_angles"], *params["initial_velocities"])
+    t_eval = np.linspace(*time_span, 1000)
+
+    runs = [("equations_of_motion", simulation.equations_of_motion, None)]
+    calls = {"rhs": 0, "jac": 0}
+
+    # solve_ivp's nfev leaves out the calls Radau makes for its finite-difference Jacobian
+    def counted(fun, key):
+        if fun is None:
+            return None
+        def wrapper(t, y):
+            calls[key] += 1
+            return fun(t, y)
+        return wrapper
+
+    for backend in ("numpy", "numba") if HAS_NUMBA else ("numpy",):
+        kernel = PendulumKernel.from_params(params, backend)
+        kernel.rhs(0.0, y0), kernel.jac(0.0, y0)  # trigger JIT compilation outside the timing
+        runs.append((f"PendulumKernel[{backend}] + jac", kernel.rhs, kernel.jac))
+
+    reference = None
+    print(f"{solver['method']} over t = {time_span}, rtol={solver.get('rtol')}, atol={solver.get('atol')}")
+    print(f"{'RHS':<34}{'wall (s)':>10}{'RHS calls':>11}{'jac calls':>11}{'nlu':>8}{'max |Δy|':>12}")
+    for name, fun, jac in runs:
+        calls.update(rhs=0, jac=0)
+        start = time.perf_counter()
+        sol = solve_ivp(
+            fun=counted(fun, "rhs"), t_span=time_span, y0=y0, t_eval=t_eval,
+            jac=counted(jac, "jac"), **solver
+        )
+        wall = time.perf_counter() - start
+        if reference is None:
+            reference = sol.y
+        deviation = np.max(np.abs(sol.y - reference))
+        print(f"{name:<34}{wall:>10.3f}{calls['rhs']:>11}{calls['jac']:>11}{sol.nlu:>8}{deviation:>12.2e}")
+
+if __name__ == "__main__":
+    benchmark_kernel()
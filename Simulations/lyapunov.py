@@ -0,0 +1,141 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy.integrate import solve_ivp
+from typing import Callable, NamedTuple, Optional
+import math
+import time
+
+import simulation
+from kernel import HAS_NUMBA, PendulumKernel, rhs_kernel, jacobian_kernel
+
+if HAS_NUMBA:
+    from numba import njit
+    from kernel import compiled_rhs_kernel as rhs_kernel, compiled_jacobian_kernel as jacobian_kernel
+
+# The tangent vectors grow like exp(λ1 t) between re-orthonormalizations; with λ1 of a few 1/s
+# an interval of 0.1 s keeps them far from overflow and from collapsing onto one direction.
+DEFAULT_RENORM_INTERVAL = 0.1
+
+class LyapunovResult(NamedTuple):
+    exponents: np.ndarray  # (N, k), largest first, in 1/s
+    times: np.ndarray      # (R,) times of each re-orthonormalization
+    history: np.ndarray    # (R, N, k) running estimates at those times
+    states: np.ndarray     # (N, 4) final states
+
+# Augmented system: N states stacked as (4, N) followed by N sets of k tangent vectors (N, 4, k),
+# with the tangent vectors following the variational equations dv/dt = J(y) v
+
+def tangent_kernel(z: np.ndarray, c: np.ndarray, n: int, k: int) -> np.ndarray:
+    out = np.empty_like(z)
+    y = np.empty(4)
+    for m in range(n):
+        for i in range(4):
+            y[i] = z[i*n + m]
+        dy = rhs_kernel(y, c)
+        jac = jacobian_kernel(y, c)
+        base = 4*n + 4*k*m
+        for i in range(4):
+            out[i*n + m] = dy[i]
+            for j in range(k):
+                acc = 0.0
+                for l in range(4):
+                    acc += jac[i, l]*z[base + l*k + j]
+                out[base + i*k + j] = acc
+    return out
+
+if HAS_NUMBA:
+    tangent_kernel = njit(cache=True)(tangent_kernel)
+
+def make_tangent_rhs(kernel: PendulumKernel, n: int, k: int) -> Callable:
+    if kernel.backend == "numba":
+        # One compiled call per step instead of a few dozen small numpy operations
+        return lambda t, z: tangent_kernel(z, kernel.constants, n, k)
+
+    def tangent_rhs(t: float, z: np.ndarray) -> np.ndarray:
+        states = z[:4*n].reshape(4, n)
+        tangents = z[4*n:].reshape(n, 4, k)
+        return np.concatenate([
+            kernel.rhs_batch(t, states).ravel(),
+            (kernel.jac_batch(t, states) @ tangents).ravel()
+        ])
+    return tangent_rhs
+
+def lyapunov_spectrum(
+    initial_states: np.ndarray,
+    duration: float,
+    num_exponents: int = 4,
+    renorm_interval: float = DEFAULT_RENORM_INTERVAL,
+    kernel: Optional[PendulumKernel] = None,
+    solver: Optional[dict] = None
+) -> LyapunovResult:
+    initial_states = np.atleast_2d(np.asarray(initial_states, dtype=np.float64))
+    n, k = initial_states.shape[0], num_exponents
+    if not 1 <= k <= 4:
+        raise ValueError("num_exponents must be between 1 and 4")
+    kernel = kernel or simulation.get_kernel()
+    solver = simulation.get_batch_solver_params((4 + 4*k) * n, solver)
+    tangent_rhs = make_tangent_rhs(kernel, n, k)
+
+    states = initial_states.T.copy()
+    tangents = np.broadcast_to(np.eye(4)[:, :k], (n, 4, k)).copy()
+    log_growth = np.zeros((n, k))
+    num_intervals = max(1, math.ceil(duration / renorm_interval - 1e-9))
+    times = np.minimum(np.arange(1, num_intervals + 1) * renorm_interval, duration)
+    history = np.empty((num_intervals, n, k))
+
+    t = 0.0
+    for i, t_next in enumerate(times):
+        sol = solve_ivp(tangent_rhs, (t, t_next), np.concatenate([states.ravel(), tangents.ravel()]), **solver)
+        if not sol.success:
+            raise RuntimeError(f"Tangent integration failed at t = {t}: {sol.message}")
+        z = sol.y[:, -1]
+        states = z[:4*n].reshape(4, n)
+        # Gram-Schmidt via QR: |R_jj| is how much the j-th direction grew on top of the ones before it
+        q, r = np.linalg.qr(z[4*n:].reshape(n, 4, k))
+        tangents = q
+        log_growth += np.log(np.abs(np.diagonal(r, axis1=1, axis2=2)))
+        history[i] = log_growth / t_next
+        t = t_next
+
+    return LyapunovResult(history[-1], times, history, states.T.copy())
+
+def max_lyapunov_exponent(
+    initial_state: np.ndarray,
+    duration: float,
+    renorm_interval: float = DEFAULT_RENORM_INTERVAL,
+    kernel: Optional[PendulumKernel] = None,
+    solver: Optional[dict] = None
+) -> float:
+    # A single tangent vector converges to the most unstable direction, so k = 1 is enough
+    result = lyapunov_spectrum(initial_state, duration, 1, renorm_interval, kernel, solver)
+    return result.exponents[0, 0]
+
+def plot_convergence(result: LyapunovResult) -> None:
+    plt.figure(figsize=(24, 6))
+    for j in range(result.history.shape[2]):
+        plt.plot(result.times, result.history[:, 0, j], label=f"λ{j + 1}")
+    plt.axhline(0.0, color="black", lw=0.8)
+    plt.xlabel("Time (seconds)")
+    plt.ylabel("Lyapunov exponent estimate (1/s)")
+    plt.title(f"Lyapunov Spectrum - {simulation.CONFIG['title']}")
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(f"{simulation.CONFIG['sim_outpath']}Lyapunov Spectrum - {simulation.CONFIG['title']}.png")
+    plt.show()
+
+def main():
+    params = simulation.CONFIG["params"]
+    y0 = np.array([*params["initial_angles"], *params["initial_velocities"]])
+    duration = params["time_span"][1] - params["time_span"][0]
+
+    start = time.perf_counter()
+    result = lyapunov_spectrum(y0, duration)
+    wall = time.perf_counter() - start
+    exponents = result.exponents[0]
+    print(f"Lyapunov spectrum over {duration:g} s ({wall:.2f} s wall): " + ", ".join(f"{e:+.4f}" for e in exponents))
+    # The flow conserves phase-space volume, so the exponents should come in ± pairs summing to zero
+    print(f"Sum of exponents: {exponents.sum():+.2e} 1/s")
+    plot_convergence(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import atexit
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+# Opt-in: set PENDULUM_PROFILE to an output path (or call enable) and every stage() block in the
+# scripts' main() functions is timed, counted and memory-traced. Otherwise stage() does nothing.
+ENV_VAR = "PENDULUM_PROFILE"
+
+output_path: Optional[str] = None
+stages: Dict[str, dict] = {}
+counters: Dict[str, dict] = {}
+stack: List[List[int]] = []   # running peak memory of each open stage
+started = 0.0
+
+def enable(path: str) -> None:
+    global output_path, started
+    if output_path is None:
+        atexit.register(write_report)
+        tracemalloc.start()
+        started = time.perf_counter()
+    output_path = path
+
+def is_enabled() -> bool:
+    return output_path is not None
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    if output_path is None:
+        yield
+        return
+
+    # tracemalloc only has one peak counter, so it is reset per stage and each stage's peak is
+    # folded into its parent when it finishes
+    _, outer_peak = tracemalloc.get_traced_memory()
+    if stack:
+        stack[-1][0] = max(stack[-1][0], outer_peak)
+    tracemalloc.reset_peak()
+    stack.append([0])
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start
+        peak = max(stack.pop()[0], tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1][0] = max(stack[-1][0], peak)
+        record = stages.setdefault(name, {"calls": 0, "wall_time": 0.0, "peak_memory_bytes": 0})
+        record["calls"] += 1
+        record["wall_time"] += wall
+        record["peak_memory_bytes"] = max(record["peak_memory_bytes"], peak)
+
+def add_counters(name: str, values: dict) -> None:
+    # Free-form numbers a stage wants in the report, like the video decoder's queue statistics
+    if output_path is not None:
+        counters[name] = dict(values)
+
+def get_report() -> dict:
+    return {
+        "script": os.path.basename(sys.argv[0]) if sys.argv else "",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "total_wall_time": time.perf_counter() - started,
+        "stages": stages,
+        "counters": counters
+    }
+
+def write_report() -> None:
+    if output_path is None:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(get_report(), f, indent=2)
+
+# Pool workers inherit the environment but must not overwrite the parent's report
+if os.environ.get(ENV_VAR) and multiprocessing.parent_process() is None:
+    enable(os.environ[ENV_VAR])
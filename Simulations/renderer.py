@@ -0,0 +1,174 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import suppress
+from PIL import Image
+from typing import Optional, Tuple
+import io
+import os
+import shutil
+import struct
+import subprocess
+
+# Frames are rendered as palette indices: 0 is the background, 1 the arms and joints
+PALETTE = np.array([
+    [255, 255, 255],
+    [31, 119, 180]   # matplotlib's default line colour
+], dtype=np.uint8)
+CHUNK_FRAMES = 32
+
+def decimate(solution: dict, fps: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # One sample per output frame, taken from the dense output when the run has one
+    t = np.asarray(solution["t"])
+    frame_t = np.arange(t[0], t[-1] + 1e-9, 1.0 / fps)
+    if "dense" in solution:
+        theta1, theta2 = solution["dense"](frame_t)[:2]
+    else:
+        theta1 = np.interp(frame_t, t, solution["y"][0])
+        theta2 = np.interp(frame_t, t, solution["y"][1])
+    return frame_t, theta1, theta2
+
+def get_pixel_coords(theta1: np.ndarray, theta2: np.ndarray, lengths: Tuple[float, float], size: int) -> np.ndarray:
+    # (frames, 3, 2) pixel positions of pivot, elbow and tip as (column, row), all frames at once
+    l1, l2 = lengths
+    scale = (size / 2) / (l1 + l2)
+    x1, y1 = l1*np.sin(theta1), -l1*np.cos(theta1)
+    x2, y2 = x1 + l2*np.sin(theta2), y1 - l2*np.cos(theta2)
+    x = np.stack([np.zeros_like(x1), x1, x2], axis=1)
+    y = np.stack([np.zeros_like(y1), y1, y2], axis=1)
+    return np.stack([size/2 + scale*x, size/2 - scale*y], axis=2)
+
+def draw_segment(frame: np.ndarray, a: np.ndarray, b: np.ndarray, radius: float, color: int) -> None:
+    # Colours every pixel within radius of segment ab (round caps), only looking at its bounding box
+    size = frame.shape[0]
+    (c0, r0) = np.clip(np.floor(np.minimum(a, b) - radius).astype(int), 0, size)
+    (c1, r1) = np.clip(np.ceil(np.maximum(a, b) + radius).astype(int) + 1, 0, size)
+    if c0 >= c1 or r0 >= r1:
+        return
+    cols = np.arange(c0, c1) + 0.5
+    rows = np.arange(r0, r1)[:, None] + 0.5
+    d = b - a
+    length2 = max(d @ d, 1e-12)
+    s = np.clip(((cols - a[0])*d[0] + (rows - a[1])*d[1]) / length2, 0.0, 1.0)
+    dist2 = (cols - a[0] - s*d[0])**2 + (rows - a[1] - s*d[1])**2
+    frame[r0:r1, c0:c1][dist2 <= radius*radius] = color
+
+def render_chunk(coords: np.ndarray, size: int) -> np.ndarray:
+    line_radius = max(1.0, size / 340)
+    marker_radius = max(2.0, size / 120)
+    frames = np.zeros((len(coords), size, size), dtype=np.uint8)
+    for frame, points in zip(frames, coords):
+        draw_segment(frame, points[0], points[1], line_radius, 1)
+        draw_segment(frame, points[1], points[2], line_radius, 1)
+        for point in points:
+            draw_segment(frame, point, point, marker_radius, 1)
+    return frames
+
+class FFmpegWriter:
+    """Pipes raw RGB frames into a local ffmpeg, so nothing is kept in memory."""
+
+    def __init__(self, path: str, fps: float, size: int, ffmpeg: str):
+        codec = [] if path.endswith(".gif") else ["-c:v", "libx264", "-pix_fmt", "yuv420p"]
+        self.process = subprocess.Popen(
+            [ffmpeg, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24",
+             "-s", f"{size}x{size}", "-r", f"{fps}", "-i", "-", *codec, path],
+            stdin=subprocess.PIPE
+        )
+
+    def write(self, frames: np.ndarray) -> None:
+        self.process.stdin.write(PALETTE[frames].tobytes())
+
+    def close(self) -> None:
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {self.process.returncode}")
+
+class PillowGifWriter:
+    """Fallback without ffmpeg. Pillow compresses each frame on its own and the frame goes straight to the file."""
+
+    def __init__(self, path: str, fps: float):
+        if not path.endswith(".gif"):
+            raise RuntimeError("Writing anything but a GIF needs ffmpeg on the PATH")
+        self.path = path
+        self.delay = max(1, round(100 / fps))  # GIF delays are in hundredths of a second
+        self.file = None
+
+    def write(self, frames: np.ndarray) -> None:
+        if self.file is None:
+            # Pillow only writes animations in one go, so the file's own header and loop block are written here
+            self.file = open(self.path, "wb")
+            height, width = frames.shape[1:]
+            self.file.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0, 0, 0))
+            self.file.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+        for frame in frames:
+            image = Image.fromarray(frame, mode="P")
+            image.putpalette(PALETTE.ravel().tolist())
+            self.file.write(gif_frame(image, self.delay))
+        self.file.flush()
+
+    def close(self) -> None:
+        if self.file is None:
+            return
+        self.file.write(b";")
+        self.file.close()
+        self.file = None
+
+def gif_frame(image: Image.Image, delay: int) -> bytes:
+    # Pillow's single-image GIF, cut down to its image block, with its colour table moved into the block
+    buffer = io.BytesIO()
+    image.save(buffer, format="GIF", optimize=False)
+    data = buffer.getvalue()
+    pos = 13
+    table, table_bits = b"", 0
+    if data[10] & 0x80:
+        table_bits = data[10] & 0x07
+        table = data[pos:pos + 3 * 2**(table_bits + 1)]
+        pos += len(table)
+    while data[pos] == 0x21:
+        # Extension blocks: introducer, label, then sub-blocks up to an empty one
+        pos += 2
+        while data[pos]:
+            pos += data[pos] + 1
+        pos += 1
+    if data[pos] != 0x2C:
+        raise ValueError("Unexpected block in Pillow's GIF output")
+    descriptor = bytearray(data[pos:pos + 10])
+    if not descriptor[9] & 0x80:
+        descriptor[9] |= 0x80 | table_bits
+    else:
+        table = b""
+    # Graphic control extension with the frame's delay
+    control = b"\x21\xf9\x04\x00" + struct.pack("<H", delay) + b"\x00\x00"
+    return control + bytes(descriptor) + table + data[pos + 10:-1]  # without the trailer
+
+def render_animation(
+    solution: dict,
+    lengths: Tuple[float, float],
+    path: str,
+    fps: float = 15,
+    size: int = 480,
+    workers: Optional[int] = None
+) -> int:
+    size += size % 2  # yuv420p needs even dimensions
+    _, theta1, theta2 = decimate(solution, fps)
+    coords = get_pixel_coords(theta1, theta2, lengths, size)
+    ffmpeg = shutil.which("ffmpeg")
+    writer = FFmpegWriter(path, fps, size, ffmpeg) if ffmpeg else PillowGifWriter(path, fps)
+
+    # Keep only a few chunks in flight so memory stays flat however long the run is
+    window = 2 * (workers or os.cpu_count() or 1)
+    chunks = [coords[i:i + CHUNK_FRAMES] for i in range(0, len(coords), CHUNK_FRAMES)]
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = [pool.submit(render_chunk, chunk, size) for chunk in chunks[:window]]
+            for i in range(len(chunks)):
+                frames = pending.pop(0).result()
+                if i + window < len(chunks):
+                    pending.append(pool.submit(render_chunk, chunks[i + window], size))
+                writer.write(frames)
+    except BaseException:
+        # Closing a half-written file can fail as well, which mustn't hide why rendering stopped
+        with suppress(Exception):
+            writer.close()
+        raise
+    writer.close()
+    return len(coords)
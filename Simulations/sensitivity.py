@@ -0,0 +1,104 @@
+import numpy as np
+from scipy.integrate import solve_ivp
+from typing import Callable, Sequence, Tuple
+
+import simulation
+from kernel import PendulumKernel, bind_constants
+
+# Parameters the forward sensitivities can be taken with respect to. The masses only enter the
+# equations of motion through m2/m1, so the ratio is the parameter and m1 stays as configured.
+PHYSICAL_PARAMETERS = ("mass_ratio", "l1", "l2", "gravity")
+INITIAL_PARAMETERS = ("theta1", "theta2", "omega1", "omega2")
+PARAMETERS = PHYSICAL_PARAMETERS + INITIAL_PARAMETERS
+COMPLEX_STEP = 1e-30
+
+def get_parameter_values(params: dict, names: Sequence[str]) -> np.ndarray:
+    m1, m2 = params["masses"]
+    values = {
+        "mass_ratio": m2 / m1,
+        "l1": params["lengths"][0],
+        "l2": params["lengths"][1],
+        "gravity": params["gravity"],
+        "theta1": params["initial_angles"][0],
+        "theta2": params["initial_angles"][1],
+        "omega1": params["initial_velocities"][0],
+        "omega2": params["initial_velocities"][1]
+    }
+    return np.array([values[name] for name in names], dtype=np.float64)
+
+def set_parameter_values(params: dict, names: Sequence[str], values: np.ndarray) -> dict:
+    values = dict(zip(names, (float(v) for v in values)))
+    m1, m2 = params["masses"]
+    l1, l2 = params["lengths"]
+    theta1, theta2 = params["initial_angles"]
+    omega1, omega2 = params["initial_velocities"]
+    return dict(
+        params,
+        masses=[m1, values.get("mass_ratio", m2 / m1) * m1],
+        lengths=[values.get("l1", l1), values.get("l2", l2)],
+        gravity=values.get("gravity", params["gravity"]),
+        initial_angles=[values.get("theta1", theta1), values.get("theta2", theta2)],
+        initial_velocities=[values.get("omega1", omega1), values.get("omega2", omega2)]
+    )
+
+def constants_derivatives(params: dict, names: Sequence[str]) -> np.ndarray:
+    # d(constants)/d(parameters), shape (8, P). bind_constants is plain arithmetic, so a complex
+    # step gives the exact derivative instead of a finite-difference estimate.
+    dcdp = np.zeros((8, len(names)))
+    m1, _ = params["masses"]
+    base = {
+        "mass_ratio": params["masses"][1] / m1,
+        "l1": params["lengths"][0],
+        "l2": params["lengths"][1],
+        "gravity": params["gravity"]
+    }
+    for j, name in enumerate(names):
+        if name not in PHYSICAL_PARAMETERS:
+            continue
+        shifted = dict(base, **{name: base[name] + 1j*COMPLEX_STEP})
+        c = bind_constants(
+            (m1, shifted["mass_ratio"] * m1),
+            (shifted["l1"], shifted["l2"]),
+            shifted["gravity"]
+        )
+        dcdp[:, j] = c.imag / COMPLEX_STEP
+    return dcdp
+
+def make_sensitivity_rhs(kernel: PendulumKernel, dcdp: np.ndarray) -> Callable:
+    # Augmented state: y (4) followed by S = dy/dp (4, P), with dS/dt = J_y S + (∂f/∂c)(dc/dp)
+    p = dcdp.shape[1]
+    def sensitivity_rhs(t: float, z: np.ndarray) -> np.ndarray:
+        y = z[:4]
+        s = z[4:].reshape(4, p)
+        ds = kernel.jac(t, y) @ s + kernel.constants_jac(t, y) @ dcdp
+        return np.concatenate([kernel.rhs(t, y), ds.ravel()])
+    return sensitivity_rhs
+
+def solve_sensitivities(
+    params: dict,
+    t_eval: np.ndarray,
+    names: Sequence[str] = PARAMETERS,
+    solver: dict = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Solve the run and its forward sensitivities; returns y (4, T) and dy/dp (4, P, T)."""
+    unknown = set(names) - set(PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown sensitivity parameters: {sorted(unknown)}")
+    p = len(names)
+    kernel = PendulumKernel.from_params(params)
+    y0 = np.array([*params["initial_angles"], *params["initial_velocities"]], dtype=np.float64)
+    s0 = np.zeros((4, p))
+    for j, name in enumerate(names):
+        if name in INITIAL_PARAMETERS:
+            s0[INITIAL_PARAMETERS.index(name), j] = 1.0
+
+    sol = solve_ivp(
+        make_sensitivity_rhs(kernel, constants_derivatives(params, names)),
+        (t_eval[0], t_eval[-1]),
+        np.concatenate([y0, s0.ravel()]),
+        t_eval=t_eval,
+        **simulation.get_batch_solver_params(4 + 4*p, solver or params["solver"])
+    )
+    if not sol.success:
+        raise RuntimeError(f"Sensitivity integration failed: {sol.message}")
+    return sol.y[:4], sol.y[4:].reshape(4, p, len(sol.t))
@@ -1,17 +1,33 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.integrate import solve_ivp
-from matplotlib.animation import FuncAnimation, PillowWriter
-from typing import NamedTuple, Tuple, List
-import math
+from typing import Optional, Tuple, List
 import os
 import json
 import hashlib
 
+from cache import SimulationCache
+from dense_output import DenseTrajectory, concatenate
+from kernel import PendulumKernel
+import profiling
+from renderer import render_animation
+from symplectic import SCHEMES, solve_symplectic
+from trajectory import Trajectory, arm_trajectories
+
 CONFIG = {
     "title": "Chaotic Double Pendulum",
     "sim_outpath": "./Simulations/sim_outfiles/",
     "path_to_data": "C:\\Users\\adamf\\Downloads\\",
+    "path_to_cache": "C:\\Users\\adamf\\Downloads\\simulation_cache\\",
+    "cache_max_bytes": 2 * 1024**3,
+    "checkpoint_interval": 5.0,
+    "show_plots": True,     # False saves the plots without opening a window
+    "animation": {
+        "fps": 15,
+        "size": 480,
+        "format": "gif",    # "mp4" needs ffmpeg on the PATH
+        "workers": None
+    },
     "params": {
         "masses": (1.137, 1.455),
         "lengths": (0.525, 0.473),
@@ -28,28 +44,37 @@ CONFIG = {
     }
 }
 
-class PendulumData(NamedTuple):
-    time: float
-    angle: float
-    position: Tuple[float, float]
-
 StateVector = Tuple[float, float, float, float]
-CartesianCoords = Tuple[float, float, float, float]
+
+IMPLICIT_METHODS = ("Radau", "BDF", "LSODA")
+
+def show_plot() -> None:
+    if CONFIG["show_plots"]:
+        plt.show()
+    else:
+        plt.close()
 
 def get_solver_params() -> dict:
     return CONFIG["params"]["solver"]
 
-def get_data_path() -> str:
+def get_kernel() -> PendulumKernel:
+    return PendulumKernel.from_params(CONFIG["params"])
+
+def get_hashable_params(params: dict = None) -> dict:
     # Convert tuples to lists for consistent hashing
-    params = CONFIG["params"].copy()
-    for key in ["masses", "lengths", "initial_angles", "initial_velocities"]:
+    params = (params or CONFIG["params"]).copy()
+    for key in ["masses", "lengths", "initial_angles", "initial_velocities", "time_span"]:
         if isinstance(params[key], tuple):
             params[key] = list(params[key])
-    
-    param_hash = hashlib.sha256(
-        json.dumps(params, sort_keys=True).encode()
+    return params
+
+def get_param_hash(params: dict = None) -> str:
+    return hashlib.sha256(
+        json.dumps(get_hashable_params(params), sort_keys=True).encode()
     ).hexdigest()
-    return f"{CONFIG['path_to_data']}simulation_{param_hash}.txt"
+
+def get_cache() -> SimulationCache:
+    return SimulationCache(CONFIG["path_to_cache"], CONFIG["cache_max_bytes"])
 
 def equations_of_motion(t: float, y: StateVector) -> List[float]:
     m1, m2 = CONFIG["params"]["masses"]
@@ -75,117 +100,289 @@ def equations_of_motion(t: float, y: StateVector) -> List[float]:
     return [omega1, omega2, ddtheta1, ddtheta2]
 
 def save_data(solution: dict, lengths: Tuple) -> None:
-    data = {
-        "y": solution["y"].tolist(),
-        "t": solution["t"].tolist(),
-        "lengths": list(lengths)
-    }
-    with open(get_data_path(), "w") as f:
-        json.dump(data, f)
+    dense = solution["dense"].to_arrays() if "dense" in solution else {}
+    get_cache().store(
+        get_param_hash(),
+        {"y": solution["y"], "t": solution["t"], **dense},
+        params=get_hashable_params(),
+        lengths=lengths
+    )
 
 def load_saved_data() -> dict:
-    with open(get_data_path(), "r") as f:
-        data = json.load(f)
-        return {
-            "y": np.array(data["y"]),
-            "t": np.array(data["t"])
-        }
+    data = load_run(get_cache(), get_param_hash())
+    data["dense"] = load_dense(data)
+    return data
 
-def solve_pendulum_ode() -> Tuple[dict, Tuple]:
-    t_span = CONFIG["params"]["time_span"]
-    t_eval = np.linspace(*t_span, CONFIG["params"]["num_points"])
-    y0 = (*CONFIG["params"]["initial_angles"], *CONFIG["params"]["initial_velocities"])
+def integrate_segment(y0: StateVector, t_eval: np.ndarray) -> Tuple[np.ndarray, DenseTrajectory, int]:
+    solver = get_solver_params()
+    kernel = get_kernel()
+    if solver["method"] in SCHEMES:
+        params = dict(CONFIG["params"], initial_angles=tuple(y0[:2]), initial_velocities=tuple(y0[2:]))
+        y, evals = solve_symplectic(params, t_eval, solver)
+        return y, DenseTrajectory.from_samples(t_eval, y, kernel), evals
+
+    # Implicit solvers otherwise estimate the Jacobian by finite differences
+    jac = {"jac": kernel.jac} if solver.get("method") in IMPLICIT_METHODS else {}
     
     sol = solve_ivp(
-        fun=equations_of_motion,
-        t_span=t_span,
+        fun=kernel.rhs,
+        t_span=(t_eval[0], t_eval[-1]),
         y0=y0,
         t_eval=t_eval,
-        **get_solver_params()
+        dense_output=True,
+        **jac,
+        **solver
     )
+    if not sol.success:
+        raise RuntimeError(f"Integration failed: {sol.message}")
+    return sol.y, DenseTrajectory.from_ode_solution(sol.sol, solver.get("method", "RK45")), sol.nfev
+
+def solve_pendulum_ode() -> Tuple[dict, Tuple]:
+    t_span = CONFIG["params"]["time_span"]
+    t_eval = np.linspace(*t_span, CONFIG["params"]["num_points"])
+    y0 = (*CONFIG["params"]["initial_angles"], *CONFIG["params"]["initial_velocities"])
+    y, dense, nfev = integrate_segment(y0, t_eval)
     return {
-        "y": sol.y,
-        "t": sol.t
+        "y": y,
+        "t": t_eval,
+        "dense": dense,
+        "nfev": nfev
     }, (CONFIG["params"]["lengths"])
 
-def get_cartesian_coords(theta1: float, theta2: float) -> CartesianCoords:
-    l1, l2 = CONFIG["params"]["lengths"]
-    x1 = l1 * np.sin(theta1)
-    y1 = -l1 * np.cos(theta1)
-    x2 = x1 + l2 * np.sin(theta2)
-    y2 = y1 - l2 * np.cos(theta2)
-    return x1, y1, x2, y2
+def get_family_hash(params: dict = None) -> str:
+    # Runs that differ only in end time or sample count share a family and can continue each other
+    params = get_hashable_params(params)
+    params.pop("num_points", None)
+    params["time_span"] = list(params["time_span"][:1])
+    return get_param_hash(params)
 
-def create_animation(solution: dict) -> FuncAnimation:
-    theta1 = solution["y"][0]
-    theta2 = solution["y"][1]
-    times = solution["t"]
-    
-    fig, ax = plt.subplots()
-    ax.set_xlim(-sum(CONFIG["params"]["lengths"]), sum(CONFIG["params"]["lengths"]))
-    ax.set_ylim(-sum(CONFIG["params"]["lengths"]), sum(CONFIG["params"]["lengths"]))
-    ax.set_aspect('equal')
-    line, = ax.plot([], [], 'o-', lw=2)
-    
-    def init():
-        line.set_data([], [])
-        return (line,) 
-    
-    def update(frame: int):
-        x1, y1, x2, y2 = get_cartesian_coords(theta1[frame], theta2[frame])
-        line.set_data([0, x1, x2], [0, y1, y2])
-        return (line,) 
-    
-    ani = FuncAnimation(
-        fig, 
-        update, 
-        frames=len(times),
-        init_func=init, 
-        blit=True, 
-        interval=20
+def is_cached(key: str, cache: SimulationCache) -> bool:
+    return key in cache and cache.meta(key).get("complete", True)
+
+def find_continuation_base(cache: SimulationCache) -> Optional[str]:
+    family = get_family_hash()
+    best_key, best_end = None, -np.inf
+    for entry in cache.query(lambda e: e.params is not None and "time_span" in e.params):
+        if get_family_hash(entry.params) != family:
+            continue
+        end = cache.meta(entry.key).get("t_end", entry.params["time_span"][1])
+        if end > best_end:
+            best_key, best_end = entry.key, end
+    return best_key
+
+def load_dense(data: dict) -> DenseTrajectory:
+    if "dense_t" in data:
+        return DenseTrajectory.from_arrays(data)
+    # Entries written before dense output was stored only have their samples
+    return DenseTrajectory.from_samples(data["t"], data["y"], get_kernel())
+
+def store_progress(cache: SimulationCache, key: str, segment: int, t: np.ndarray, y: np.ndarray,
+                   checkpoints: List[np.ndarray], dense_parts: List[DenseTrajectory]) -> None:
+    # Each checkpoint only writes what was integrated since the previous one, as a numbered segment
+    # next to the earlier ones, so saving progress doesn't get slower as the run gets longer
+    arrays = {"t": t, "y": y, "checkpoints": np.array(checkpoints), **concatenate(dense_parts).to_arrays()}
+    arrays = {f"{name}.{segment}": array for name, array in arrays.items()}
+    extra = {"t_end": float(t[-1]), "complete": False, "segments": segment + 1}
+    if segment == 0:
+        cache.store(key, arrays, params=get_hashable_params(), lengths=CONFIG["params"]["lengths"], extra=extra)
+    else:
+        cache.append(key, arrays, extra=extra)
+
+def store_run(cache: SimulationCache, key: str, t_eval: np.ndarray, y: np.ndarray,
+              checkpoints: List[np.ndarray], dense: DenseTrajectory) -> None:
+    cache.store(
+        key,
+        {"y": y, "t": t_eval, "checkpoints": np.array(checkpoints), **dense.to_arrays()},
+        params=get_hashable_params(),
+        lengths=CONFIG["params"]["lengths"],
+        extra={"t_end": float(t_eval[-1]), "complete": True}
     )
-    
-    os.makedirs(CONFIG["sim_outpath"], exist_ok=True)
-    ani.save(f"{CONFIG['sim_outpath']}{CONFIG['title']}.gif", 
-            writer=PillowWriter(fps=15, bitrate=1800))
-    plt.show()
-    return ani
 
-def process_pendulum_data(solution: dict) -> Tuple[List[PendulumData], List[PendulumData]]:
-    theta1 = solution["y"][0]
-    theta2 = solution["y"][1]
-    times = solution["t"]
-    
-    arm1_data = []
-    arm2_data = []
-    
-    # Iterate through each time step's angles
-    for t, th1, th2 in zip(times, theta1, theta2):
-        # Get coordinates for both masses
-        x1, y1, x2, y2 = get_cartesian_coords(th1, th2)
-        
-        # Arm 1: Angle is relative to the origin (0,0)
-        angle1 = math.atan2(x1, -y1)
-        arm1_data.append(PendulumData(t, angle1, (x1, y1)))
-        
-        # Arm 2: Angle is relative to the end of Arm 1 (x1, y1)
-        dx = x2 - x1  # Horizontal displacement from Arm 1's end
-        dy = y2 - y1  # Vertical displacement from Arm 1's end
-        angle2 = math.atan2(dx, -dy)  # Negative because positive y is downward
-        arm2_data.append(PendulumData(t, angle2, (x2, y2)))
-    
-    return arm1_data, arm2_data
+def join_segments(data: dict, segments: int) -> dict:
+    """Put the segments of a run that was stopped before finishing back together as one run."""
+    parts = range(segments)
+    dense = concatenate([
+        DenseTrajectory(data[f"dense_t.{i}"], data[f"dense_coeffs.{i}"]) for i in parts
+    ])
+    return {
+        "y": np.concatenate([data[f"y.{i}"] for i in parts], axis=1),
+        "t": np.concatenate([data[f"t.{i}"] for i in parts]),
+        "checkpoints": np.concatenate([data[f"checkpoints.{i}"] for i in parts]),
+        **dense.to_arrays(),
+        "lengths": data["lengths"]
+    }
 
-def plot_angle_comparison(arm1: List[PendulumData], arm2: List[PendulumData]) -> None:
-    plt.figure(figsize=(30, 8))
-    plt.plot(
-        [d.time for d in arm1], [math.degrees(d.angle) for d in arm1], 
-        label="Arm 1", color='b'
+def load_run(cache: SimulationCache, key: str, mmap: bool = True) -> dict:
+    # The segment count has to come from the same meta.json the arrays were loaded by, since another
+    # process may append a checkpoint in between
+    data, meta = cache.load_with_meta(key, mmap=mmap)
+    segments = meta.get("segments")
+    return join_segments(data, segments) if segments else data
+
+def solve_with_continuation() -> Tuple[dict, Tuple]:
+    """Solve the configured run, reusing the longest cached run from the same family."""
+    cache = get_cache()
+    key = get_param_hash()
+    t_eval = np.linspace(*CONFIG["params"]["time_span"], CONFIG["params"]["num_points"])
+    y = np.empty((4, len(t_eval)))
+    y0 = np.array([*CONFIG["params"]["initial_angles"], *CONFIG["params"]["initial_velocities"]])
+    checkpoints = [np.concatenate([[t_eval[0]], y0])]
+    dense_parts = []
+    filled = 1
+    nfev = 0
+    # What the cache already holds of this run: samples, checkpoints, dense parts and segments
+    saved_samples = saved_checkpoints = saved_parts = segments = 0
+    y[:, 0] = y0
+
+    base_key = find_continuation_base(cache)
+    if base_key is not None:
+        # Read into memory, since storing this run may replace the directory the base was loaded from
+        base = load_run(cache, base_key, mmap=False)
+        base_dense = load_dense(base).restrict(t_eval[-1])
+        filled = int(np.searchsorted(t_eval, base_dense.t_max, side="right"))
+        y[:, :filled] = base_dense(t_eval[:filled])
+        dense_parts.append(base_dense)
+        if "checkpoints" in base:
+            checkpoints = [c for c in np.array(base["checkpoints"]) if c[0] <= base_dense.t_max]
+        # Integration resumes from the end of the reused run
+        last = np.concatenate([[base_dense.t_max], base_dense(base_dense.t_max)])
+        if checkpoints[-1][0] < last[0]:
+            checkpoints.append(last)
+
+    sample_dt = (t_eval[-1] - t_eval[0]) / max(len(t_eval) - 1, 1)
+    samples_per_checkpoint = max(1, int(round(CONFIG["checkpoint_interval"] / sample_dt)))
+    while filled < len(t_eval):
+        t_start, y_start = checkpoints[-1][0], checkpoints[-1][1:]
+        chunk = t_eval[filled:filled + samples_per_checkpoint]
+        segment, dense, evals = integrate_segment(y_start, np.concatenate([[t_start], chunk]))
+        nfev += evals
+        y[:, filled:filled + len(chunk)] = segment[:, 1:]
+        dense_parts.append(dense)
+        filled += len(chunk)
+        checkpoints.append(np.concatenate([[chunk[-1]], segment[:, -1]]))
+        store_progress(cache, key, segments, t_eval[saved_samples:filled], y[:, saved_samples:filled],
+                       checkpoints[saved_checkpoints:], dense_parts[saved_parts:])
+        saved_samples, saved_checkpoints, saved_parts = filled, len(checkpoints), len(dense_parts)
+        segments += 1
+
+    # The segments are joined once, now that the run is finished
+    dense = concatenate(dense_parts)
+    if segments or not is_cached(key, cache):
+        store_run(cache, key, t_eval, y, checkpoints, dense)
+    return {
+        "y": y,
+        "t": t_eval,
+        "dense": dense,
+        "nfev": nfev
+    }, (CONFIG["params"]["lengths"])
+
+def make_initial_states(angles: np.ndarray, velocities: np.ndarray = None) -> np.ndarray:
+    angles = np.atleast_2d(np.asarray(angles, dtype=float))
+    if velocities is None:
+        velocities = np.zeros_like(angles)
+    velocities = np.broadcast_to(np.asarray(velocities, dtype=float), angles.shape)
+    return np.hstack([angles, velocities])
+
+def get_batch_solver_params(num_components: int, solver: dict = None) -> dict:
+    solver = dict(solver or get_solver_params())
+    # Implicit methods would build a dense (n, n) Jacobian, so batched systems run explicit.
+    # The fixed-step symplectic schemes are single-trajectory only and fall back the same way.
+    if solver.get("method", "RK45") in IMPLICIT_METHODS or solver.get("method") in SCHEMES:
+        solver["method"] = "DOP853"
+    solver.pop("dt", None)
+    # solve_ivp controls the RMS error over all components; shrink the tolerances by
+    # sqrt(n) so every member individually stays within the configured rtol/atol.
+    scale = np.sqrt(num_components)
+    for key in ("rtol", "atol"):
+        if key in solver:
+            solver[key] = max(solver[key] / scale, 1e-14)
+    return solver
+
+def integrate_ensemble_adaptive(initial_states: np.ndarray, t_eval: np.ndarray) -> np.ndarray:
+    n = initial_states.shape[0]
+    kernel = get_kernel()
+    solver = get_batch_solver_params(4 * n)
+
+    sol = solve_ivp(
+        fun=lambda t, y: kernel.rhs_batch(t, y.reshape(4, n)).ravel(),
+        t_span=(t_eval[0], t_eval[-1]),
+        y0=initial_states.T.ravel(),
+        t_eval=t_eval,
+        **solver
     )
-    plt.plot(
-        [d.time for d in arm2], [math.degrees(d.angle) for d in arm2], 
-        label="Arm 2", color='r'
+    if not sol.success:
+        raise RuntimeError(f"Ensemble integration failed: {sol.message}")
+    return sol.y.reshape(4, n, -1).transpose(1, 0, 2)
+
+def integrate_ensemble_fixed(
+    initial_states: np.ndarray,
+    t_eval: np.ndarray,
+    steps_per_sample: int = 32
+) -> np.ndarray:
+    n = initial_states.shape[0]
+    rhs = get_kernel().rhs_batch
+    out = np.empty((n, 4, len(t_eval)))
+    y = initial_states.T.copy()
+    out[:, :, 0] = y.T
+
+    for i in range(1, len(t_eval)):
+        t = t_eval[i-1]
+        h = (t_eval[i] - t) / steps_per_sample
+        for _ in range(steps_per_sample):
+            k1 = rhs(t, y)
+            k2 = rhs(t + h/2, y + h/2*k1)
+            k3 = rhs(t + h/2, y + h/2*k2)
+            k4 = rhs(t + h, y + h*k3)
+            y += h/6*(k1 + 2*k2 + 2*k3 + k4)
+            t += h
+        out[:, :, i] = y.T
+    return out
+
+def solve_pendulum_ensemble(
+    initial_states: np.ndarray,
+    mode: str = "adaptive",
+    steps_per_sample: int = 32
+) -> Tuple[dict, Tuple]:
+    initial_states = np.atleast_2d(np.asarray(initial_states, dtype=float))
+    if initial_states.ndim != 2 or initial_states.shape[1] != 4:
+        raise ValueError(f"Expected initial states of shape (N, 4), got {initial_states.shape}")
+
+    t_span = CONFIG["params"]["time_span"]
+    t_eval = np.linspace(*t_span, CONFIG["params"]["num_points"])
+
+    if mode == "adaptive":
+        y = integrate_ensemble_adaptive(initial_states, t_eval)
+    elif mode == "fixed":
+        y = integrate_ensemble_fixed(initial_states, t_eval, steps_per_sample)
+    else:
+        raise ValueError(f"Unknown ensemble mode: {mode}")
+
+    return {
+        "y": y,
+        "t": t_eval
+    }, (CONFIG["params"]["lengths"])
+
+def create_animation(solution: dict) -> str:
+    settings = CONFIG["animation"]
+    os.makedirs(CONFIG["sim_outpath"], exist_ok=True)
+    path = f"{CONFIG['sim_outpath']}{CONFIG['title']}.{settings['format']}"
+    render_animation(
+        solution,
+        CONFIG["params"]["lengths"],
+        path,
+        fps=settings["fps"],
+        size=settings["size"],
+        workers=settings["workers"]
     )
+    return path
+
+def process_pendulum_data(solution: dict) -> Tuple[Trajectory, Trajectory]:
+    return arm_trajectories(solution["t"], solution["y"][0], solution["y"][1], CONFIG["params"]["lengths"])
+
+def plot_angle_comparison(arm1: Trajectory, arm2: Trajectory) -> None:
+    plt.figure(figsize=(30, 8))
+    plt.plot(arm1.time, np.degrees(arm1.angle), label="Arm 1", color='b')
+    plt.plot(arm2.time, np.degrees(arm2.angle), label="Arm 2", color='r')
 
     plt.xlabel("Time (seconds)", fontsize=24)
     plt.ylabel("Angle (degrees)", fontsize=24)
@@ -195,27 +392,15 @@ def plot_angle_comparison(arm1: List[PendulumData], arm2: List[PendulumData]) ->
     plt.yticks(fontsize=20)
     plt.grid(True)
     plt.savefig(f"{CONFIG['sim_outpath']}Angle Comparison - {CONFIG['title']}.png")
-    plt.show()
+    show_plot()
 
-def plot_3d_trajectory(arm1: List[PendulumData], arm2: List[PendulumData]) -> None:
+def plot_3d_trajectory(arm1: Trajectory, arm2: Trajectory) -> None:
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
     
-    ax.plot(0, [d.time for d in arm1], 0, label="Pivot", color="g")
-
-    ax.plot(
-        [d.position[0] for d in arm1],
-        [d.time for d in arm1],
-        [d.position[1] for d in arm1],
-        label="Arm 1", color='b'
-    )
-    
-    ax.plot(
-        [d.position[0] for d in arm2],
-        [d.time for d in arm2],
-        [d.position[1] for d in arm2],
-        label="Arm 2", color='r'
-    )
+    ax.plot(0, arm1.time, 0, label="Pivot", color="g")
+    ax.plot(arm1.x, arm1.time, arm1.y, label="Arm 1", color='b')
+    ax.plot(arm2.x, arm2.time, arm2.y, label="Arm 2", color='r')
     
     ax.set_xlabel("X Position")
     ax.set_ylabel("Time")
@@ -223,7 +408,7 @@ def plot_3d_trajectory(arm1: List[PendulumData], arm2: List[PendulumData]) -> No
     ax.legend()
     ax.set_box_aspect((3, 7, 2))
     plt.savefig(f"{CONFIG['sim_outpath']}3D Trajectory - {CONFIG['title']}.png")
-    plt.show()
+    show_plot()
 
 def compute_energy(solution: dict):
     theta1 = solution["y"][0]
@@ -258,23 +443,26 @@ def plot_energy(solution: dict):
     plt.legend()
     plt.grid(True)
     plt.savefig(f"{CONFIG['sim_outpath']}Energy Analysis - {CONFIG['title']}.png")
-    plt.show()
+    show_plot()
 
 def main():
-    data_path = get_data_path()
-    
-    if os.path.exists(data_path):
-        solution = load_saved_data()
-        arm1_data, arm2_data = process_pendulum_data(solution)
+    if is_cached(get_param_hash(), get_cache()):
+        with profiling.stage("load"):
+            solution = load_saved_data()
+        with profiling.stage("process"):
+            arm1_data, arm2_data = process_pendulum_data(solution)
     else:
-        solution, lengths = solve_pendulum_ode()
-        arm1_data, arm2_data = process_pendulum_data(solution)
-        save_data(solution, lengths)
-        create_animation(solution)
+        with profiling.stage("solve"):
+            solution, lengths = solve_with_continuation()
+        with profiling.stage("process"):
+            arm1_data, arm2_data = process_pendulum_data(solution)
+        with profiling.stage("animation"):
+            create_animation(solution)
     
-    plot_angle_comparison(arm1_data, arm2_data)
-    plot_3d_trajectory(arm1_data, arm2_data)
-    plot_energy(solution)
+    with profiling.stage("plots"):
+        plot_angle_comparison(arm1_data, arm2_data)
+        plot_3d_trajectory(arm1_data, arm2_data)
+        plot_energy(solution)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
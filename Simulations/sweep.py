@@ -0,0 +1,159 @@
+import matplotlib
+matplotlib.use("Agg")  # before simulation imports pyplot, in the parent and in every worker
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+import argparse
+import copy
+import csv
+import itertools
+import json
+import os
+import time
+
+import simulation
+from symplectic import relative_energy_drift
+
+CONFIG = {
+    "manifest": "./Simulations/sweep.json",
+    "summary_path": "./Simulations/sim_outfiles/sweep_summary.csv",
+    "workers": os.cpu_count(),
+    "save_plots": False
+}
+
+SUMMARY_FIELDS = [
+    "key", "status", "method", "masses", "lengths", "gravity", "initial_angles",
+    "initial_velocities", "time_span", "num_points", "energy_drift", "wall_time", "nfev", "error"
+]
+BASE_TITLE = simulation.CONFIG["title"]
+
+def set_param(params: dict, path: str, value) -> None:
+    # "solver.rtol" addresses params["solver"]["rtol"]
+    *parents, name = path.split(".")
+    for parent in parents:
+        params = params[parent]
+    params[name] = value
+
+def expand_values(values) -> list:
+    if isinstance(values, dict) and "linspace" in values:
+        return np.linspace(*values["linspace"]).tolist()
+    return list(values)
+
+def expand_manifest(manifest: dict) -> List[dict]:
+    """Every run override combined with every point of the grid, on top of base and CONFIG params."""
+    base = copy.deepcopy(simulation.get_hashable_params())
+    for path, value in manifest.get("base", {}).items():
+        set_param(base, path, value)
+
+    grid = manifest.get("grid", {})
+    axes = [expand_values(values) for values in grid.values()]
+    configurations = []
+    for run in manifest.get("runs", [{}]):
+        for point in itertools.product(*axes):
+            params = copy.deepcopy(base)
+            for path, value in itertools.chain(run.items(), zip(grid, point)):
+                set_param(params, path, value)
+            configurations.append(params)
+    return configurations
+
+def make_row(params: dict, key: str, status: str, **metrics) -> Dict[str, str]:
+    row = {field: "" for field in SUMMARY_FIELDS}
+    row.update(key=key, status=status, method=params["solver"]["method"])
+    for field in ("masses", "lengths", "gravity", "initial_angles", "initial_velocities", "time_span", "num_points"):
+        row[field] = json.dumps(params[field])
+    row.update({name: str(value) for name, value in metrics.items()})
+    return row
+
+def read_summary(path: str) -> Dict[str, Dict[str, str]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", newline="") as f:
+        return {row["key"]: row for row in csv.DictReader(f)}
+
+def write_summary(path: str, rows: Dict[str, Dict[str, str]]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows.values())
+    os.replace(tmp_path, path)
+
+def save_plots(solution: dict, key: str) -> None:
+    simulation.CONFIG["title"] = f"{BASE_TITLE} {key[:12]}"
+    arm1, arm2 = simulation.process_pendulum_data(solution)
+    simulation.plot_angle_comparison(arm1, arm2)
+    simulation.plot_energy(solution)
+
+def run_configuration(params: dict, plots: bool) -> Dict[str, str]:
+    # Runs in a worker process, which owns its copy of simulation.CONFIG
+    simulation.CONFIG["params"] = params
+    simulation.CONFIG["show_plots"] = False
+    key = simulation.get_param_hash()
+    try:
+        start = time.perf_counter()
+        solution, _ = simulation.solve_with_continuation()
+        wall = time.perf_counter() - start
+        drift = relative_energy_drift(simulation.get_kernel(), solution["y"])
+        if plots:
+            save_plots(solution, key)
+        return make_row(params, key, "solved", energy_drift=f"{drift:.3e}", wall_time=f"{wall:.3f}", nfev=solution["nfev"])
+    except Exception as e:
+        # One bad configuration shouldn't end an overnight sweep
+        return make_row(params, key, "failed", error=f"{type(e).__name__}: {e}")
+
+def cached_row(params: dict, key: str, previous: Optional[Dict[str, str]]) -> Dict[str, str]:
+    if previous is not None and previous["status"] in ("solved", "cached"):
+        return dict(previous, status="cached")
+    # Solved outside a sweep: only the energy drift can be recovered from the stored samples
+    y = simulation.get_cache().load(key, touch=False)["y"]
+    drift = relative_energy_drift(simulation.get_kernel(), y)
+    return make_row(params, key, "cached", energy_drift=f"{drift:.3e}")
+
+def run_sweep(configurations: List[dict], summary_path: str, workers: Optional[int] = None,
+              plots: bool = False) -> Dict[str, Dict[str, str]]:
+    previous = read_summary(summary_path)
+    cache = simulation.get_cache()
+    rows, pending = {}, {}
+    for params in configurations:
+        key = simulation.get_param_hash(params)
+        if key in rows or key in pending:
+            continue
+        if simulation.is_cached(key, cache):
+            rows[key] = cached_row(params, key, previous.get(key))
+        else:
+            pending[key] = params
+    print(f"{len(rows) + len(pending)} configurations: {len(rows)} cached, {len(pending)} to run")
+    write_summary(summary_path, rows)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_configuration, params, plots) for params in pending.values()]
+        for done, future in enumerate(as_completed(futures), 1):
+            row = future.result()
+            rows[row["key"]] = row
+            write_summary(summary_path, rows)  # rewritten every time so a killed sweep keeps its results
+            print(f"[{done}/{len(pending)}] {row['key'][:12]} {row['status']} {row['wall_time']}")
+    return rows
+
+def print_summary(rows: Dict[str, Dict[str, str]]) -> None:
+    print(f"{'key':<14}{'status':<9}{'method':<18}{'max |ΔE|/|E0|':>16}{'wall (s)':>10}{'nfev':>10}")
+    for row in rows.values():
+        print(f"{row['key'][:12]:<14}{row['status']:<9}{row['method']:<18}{row['energy_drift']:>16}"
+              f"{row['wall_time']:>10}{row['nfev']:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a sweep of simulation configurations without a GUI.")
+    parser.add_argument("--manifest", default=CONFIG["manifest"])
+    parser.add_argument("--summary", default=CONFIG["summary_path"])
+    parser.add_argument("--workers", type=int, default=CONFIG["workers"])
+    parser.add_argument("--save-plots", action="store_true", default=CONFIG["save_plots"])
+    args = parser.parse_args()
+
+    with open(args.manifest, "r") as f:
+        configurations = expand_manifest(json.load(f))
+    rows = run_sweep(configurations, args.summary, args.workers, args.save_plots)
+    print_summary(rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import numpy as np
+from scipy.integrate import solve_ivp
+from typing import Tuple
+import math
+import time
+
+from kernel import HAS_NUMBA, PendulumKernel
+
+if HAS_NUMBA:
+    from numba import njit
+
+# Hamiltonian form of the model in equations_of_motion, with q = (θ1, θ2) and p = M(q) ω:
+#   M = [[M11, k cos Δ], [k cos Δ, M22]],   V = -V1 cos θ1 - V2 cos θ2,   Δ = θ1 - θ2
+#   H = ½ pᵀ M⁻¹ p + V
+SCHEMES = {"Verlet": 0, "ImplicitMidpoint": 1, "Yoshida4": 2}
+FIXED_POINT_TOL = 1e-14
+FIXED_POINT_MAX_ITER = 100
+DEFAULT_DT = 2.5e-4
+
+# Triple-jump weights lifting a symmetric 2nd order step to 4th order
+YOSHIDA_W1 = 1.0 / (2.0 - 2.0**(1.0/3.0))
+YOSHIDA_W0 = 1.0 - 2.0*YOSHIDA_W1
+
+def hamiltonian_constants(masses: Tuple[float, float], lengths: Tuple[float, float], gravity: float) -> np.ndarray:
+    m1, m2 = masses
+    l1, l2 = lengths
+    g = gravity
+    return np.array([
+        (1/12)*(m1 + 4*m2)*l1**2,
+        (1/12)*m2*l2**2,
+        (1/6)*m2*l1*l2,
+        (1/2)*(m1 + 2*m2)*g*l1,
+        (1/2)*m2*g*l2
+    ])
+
+def velocities(q1: float, q2: float, p1: float, p2: float, c: np.ndarray) -> Tuple[float, float]:
+    m12 = c[2]*math.cos(q1 - q2)
+    det = c[0]*c[1] - m12*m12
+    return (c[1]*p1 - m12*p2) / det, (c[0]*p2 - m12*p1) / det
+
+def momenta(q1: float, q2: float, w1: float, w2: float, c: np.ndarray) -> Tuple[float, float]:
+    m12 = c[2]*math.cos(q1 - q2)
+    return c[0]*w1 + m12*w2, m12*w1 + c[1]*w2
+
+def forces(q1: float, q2: float, w1: float, w2: float, c: np.ndarray) -> Tuple[float, float]:
+    # -∂H/∂q written in terms of ω = M⁻¹p
+    coupling = c[2]*math.sin(q1 - q2)*w1*w2
+    return -coupling - c[3]*math.sin(q1), coupling - c[4]*math.sin(q2)
+
+def hamiltonian(q1: float, q2: float, p1: float, p2: float, c: np.ndarray) -> float:
+    w1, w2 = velocities(q1, q2, p1, p2, c)
+    return 0.5*(p1*w1 + p2*w2) - c[3]*math.cos(q1) - c[4]*math.cos(q2)
+
+def verlet_step(q1: float, q2: float, p1: float, p2: float, h: float, c: np.ndarray) -> Tuple[float, float, float, float, int, bool]:
+    # Generalized Störmer-Verlet for non-separable H: implicit half kick, implicit drift, explicit half kick.
+    # The last value is False when either fixed-point iteration ran out of iterations without converging,
+    # or blew up; the step then stops there, before math.sin/cos get an infinite angle.
+    evals = 0
+    kicked = False
+    ph1, ph2 = p1, p2
+    for _ in range(FIXED_POINT_MAX_ITER):
+        w1, w2 = velocities(q1, q2, ph1, ph2, c)
+        f1, f2 = forces(q1, q2, w1, w2, c)
+        evals += 1
+        new1, new2 = p1 + 0.5*h*f1, p2 + 0.5*h*f2
+        if not (math.isfinite(new1) and math.isfinite(new2)):
+            return q1, q2, new1, new2, evals, False
+        kicked = abs(new1 - ph1) + abs(new2 - ph2) <= FIXED_POINT_TOL*(1.0 + abs(new1) + abs(new2))
+        ph1, ph2 = new1, new2
+        if kicked:
+            break
+    if not kicked:
+        return q1, q2, ph1, ph2, evals, False
+
+    drifted = False
+    v1, v2 = velocities(q1, q2, ph1, ph2, c)
+    n1, n2 = q1 + h*v1, q2 + h*v2
+    for _ in range(FIXED_POINT_MAX_ITER):
+        if not (math.isfinite(n1) and math.isfinite(n2)):
+            return n1, n2, ph1, ph2, evals, False
+        u1, u2 = velocities(n1, n2, ph1, ph2, c)
+        evals += 1
+        new1, new2 = q1 + 0.5*h*(v1 + u1), q2 + 0.5*h*(v2 + u2)
+        drifted = abs(new1 - n1) + abs(new2 - n2) <= FIXED_POINT_TOL*(1.0 + abs(new1) + abs(new2))
+        n1, n2 = new1, new2
+        if drifted:
+            break
+    if not (drifted and math.isfinite(n1) and math.isfinite(n2)):
+        return n1, n2, ph1, ph2, evals, False
+
+    u1, u2 = velocities(n1, n2, ph1, ph2, c)
+    f1, f2 = forces(n1, n2, u1, u2, c)
+    return n1, n2, ph1 + 0.5*h*f1, ph2 + 0.5*h*f2, evals + 1, True
+
+def midpoint_step(q1: float, q2: float, p1: float, p2: float, h: float, c: np.ndarray) -> Tuple[float, float, float, float, int, bool]:
+    evals = 0
+    converged = False
+    w1, w2 = velocities(q1, q2, p1, p2, c)
+    f1, f2 = forces(q1, q2, w1, w2, c)
+    n1, n2, r1, r2 = q1 + h*w1, q2 + h*w2, p1 + h*f1, p2 + h*f2
+    for _ in range(FIXED_POINT_MAX_ITER):
+        # An iterate that blew up would make math.cos raise without numba, and give NaN with it
+        if not (math.isfinite(n1) and math.isfinite(n2) and math.isfinite(r1) and math.isfinite(r2)):
+            return n1, n2, r1, r2, evals + 1, False
+        m1, m2 = 0.5*(q1 + n1), 0.5*(q2 + n2)
+        w1, w2 = velocities(m1, m2, 0.5*(p1 + r1), 0.5*(p2 + r2), c)
+        f1, f2 = forces(m1, m2, w1, w2, c)
+        evals += 1
+        a1, a2, b1, b2 = q1 + h*w1, q2 + h*w2, p1 + h*f1, p2 + h*f2
+        change = abs(a1 - n1) + abs(a2 - n2) + abs(b1 - r1) + abs(b2 - r2)
+        n1, n2, r1, r2 = a1, a2, b1, b2
+        converged = change <= FIXED_POINT_TOL*(1.0 + abs(a1) + abs(a2) + abs(b1) + abs(b2))
+        if converged:
+            break
+    finite = math.isfinite(n1) and math.isfinite(n2) and math.isfinite(r1) and math.isfinite(r2)
+    return n1, n2, r1, r2, evals + 1, converged and finite
+
+def scheme_step(scheme: int, q1: float, q2: float, p1: float, p2: float, h: float, c: np.ndarray) -> Tuple[float, float, float, float, int, bool]:
+    if scheme == 0:
+        return verlet_step(q1, q2, p1, p2, h, c)
+    if scheme == 1:
+        return midpoint_step(q1, q2, p1, p2, h, c)
+    q1, q2, p1, p2, e1, ok = verlet_step(q1, q2, p1, p2, YOSHIDA_W1*h, c)
+    if not ok:
+        return q1, q2, p1, p2, e1, False
+    q1, q2, p1, p2, e2, ok = verlet_step(q1, q2, p1, p2, YOSHIDA_W0*h, c)
+    if not ok:
+        return q1, q2, p1, p2, e1 + e2, False
+    q1, q2, p1, p2, e3, ok = verlet_step(q1, q2, p1, p2, YOSHIDA_W1*h, c)
+    return q1, q2, p1, p2, e1 + e2 + e3, ok
+
+def integrate_samples(
+    y0: np.ndarray,
+    t_eval: np.ndarray,
+    steps_per_sample: int,
+    scheme: int,
+    c: np.ndarray
+) -> Tuple[np.ndarray, int, int]:
+    # Stops at the first step whose fixed-point iteration didn't converge and returns the sample it was
+    # heading for, or -1 when every step converged
+    out = np.empty((4, len(t_eval)))
+    q1, q2 = y0[0], y0[1]
+    p1, p2 = momenta(q1, q2, y0[2], y0[3], c)
+    out[0, 0], out[1, 0], out[2, 0], out[3, 0] = y0[0], y0[1], y0[2], y0[3]
+    evals = 0
+
+    for i in range(1, len(t_eval)):
+        h = (t_eval[i] - t_eval[i-1]) / steps_per_sample
+        for _ in range(steps_per_sample):
+            q1, q2, p1, p2, n, converged = scheme_step(scheme, q1, q2, p1, p2, h, c)
+            evals += n
+            if not converged:
+                return out, evals, i
+        w1, w2 = velocities(q1, q2, p1, p2, c)
+        out[0, i], out[1, i], out[2, i], out[3, i] = q1, q2, w1, w2
+    return out, evals, -1
+
+if HAS_NUMBA:
+    # Rebinding in dependency order lets each compiled function call the compiled versions of the others
+    velocities = njit(cache=True)(velocities)
+    momenta = njit(cache=True)(momenta)
+    forces = njit(cache=True)(forces)
+    hamiltonian = njit(cache=True)(hamiltonian)
+    verlet_step = njit(cache=True)(verlet_step)
+    midpoint_step = njit(cache=True)(midpoint_step)
+    scheme_step = njit(cache=True)(scheme_step)
+    integrate_samples = njit(cache=True)(integrate_samples)
+
+def solve_symplectic(params: dict, t_eval: np.ndarray, solver: dict) -> Tuple[np.ndarray, int]:
+    if solver["method"] not in SCHEMES:
+        raise ValueError(f"Unknown symplectic method: {solver['method']}")
+    c = hamiltonian_constants(params["masses"], params["lengths"], params["gravity"])
+    y0 = np.array([*params["initial_angles"], *params["initial_velocities"]], dtype=np.float64)
+    sample_dt = (t_eval[-1] - t_eval[0]) / max(len(t_eval) - 1, 1)
+    steps_per_sample = max(1, math.ceil(sample_dt / solver.get("dt", DEFAULT_DT) - 1e-9))
+    t_eval = np.asarray(t_eval, dtype=np.float64)
+    y, evals, failed = integrate_samples(y0, t_eval, steps_per_sample, SCHEMES[solver["method"]], c)
+    if failed >= 0:
+        h = (t_eval[failed] - t_eval[failed - 1]) / steps_per_sample
+        raise RuntimeError(
+            f"{solver['method']} fixed-point iteration did not converge within {FIXED_POINT_MAX_ITER} iterations "
+            f"between t = {t_eval[failed - 1]:g} and {t_eval[failed]:g} (step {h:g}); use a smaller dt"
+        )
+    return y, evals
+
+def relative_energy_drift(kernel: PendulumKernel, y: np.ndarray) -> float:
+    energy = kernel.energy(y)
+    return np.max(np.abs(energy - energy[0])) / abs(energy[0])
+
+def drift_report(time_span: Tuple[float, float] = (0.0, 60.0), num_points: int = 1500) -> None:
+    import simulation
+
+    params = dict(simulation.CONFIG["params"], time_span=time_span, num_points=num_points)
+    kernel = PendulumKernel.from_params(params)
+    t_eval = np.linspace(*time_span, num_points)
+    y0 = (*params["initial_angles"], *params["initial_velocities"])
+
+    runs = [
+        {"method": "Verlet", "dt": 1e-3},
+        {"method": "Verlet", "dt": 2.5e-4},
+        {"method": "ImplicitMidpoint", "dt": 1e-3},
+        {"method": "Yoshida4", "dt": 2e-3},
+        {"method": "Yoshida4", "dt": 5e-4},
+        {"method": "Yoshida4", "dt": 2.5e-4},
+        {"method": "DOP853", "rtol": 1e-9, "atol": 1e-10},
+        {"method": "DOP853", "rtol": 1e-12, "atol": 1e-13},
+        {"method": "Radau", "rtol": 1e-9, "atol": 1e-10}
+    ]
+    if HAS_NUMBA:
+        solve_symplectic(params, t_eval[:2], {"method": "Yoshida4", "dt": 1.0})  # compile outside the timing
+        solve_symplectic(params, t_eval[:2], {"method": "ImplicitMidpoint", "dt": 1.0})
+
+    print(f"Energy drift over t = {time_span} ({'numba' if HAS_NUMBA else 'pure Python'} symplectic kernels)")
+    print(f"{'method':<18}{'setting':<24}{'wall (s)':>10}{'evaluations':>13}{'max |ΔE|/|E0|':>16}")
+    for solver in runs:
+        start = time.perf_counter()
+        if solver["method"] in SCHEMES:
+            y, evals = solve_symplectic(params, t_eval, solver)
+            setting = f"dt={solver['dt']:g}"
+        else:
+            options = {k: v for k, v in solver.items()}
+            if options["method"] == "Radau":
+                options["jac"] = kernel.jac
+            sol = solve_ivp(kernel.rhs, time_span, y0, t_eval=t_eval, **options)
+            y, evals = sol.y, sol.nfev
+            setting = f"rtol={solver['rtol']:g}"
+        wall = time.perf_counter() - start
+        print(f"{solver['method']:<18}{setting:<24}{wall:>10.3f}{evals:>13}{relative_energy_drift(kernel, y):>16.2e}")
+
+if __name__ == "__main__":
+    drift_report()
@@ -0,0 +1,87 @@
+import numpy as np
+from typing import List, Optional, Sequence, Tuple
+
+# (time, angle, (x, y)) per sample, the layout of the firstLED/secondLED lines in the video data files
+Record = Tuple[float, float, Tuple[float, float]]
+
+class Trajectory:
+    """Time series of one arm or LED, stored as a single (4, N) float64 block.
+
+    Rows are time, angle, x and y, so every column accessor is a contiguous view, and
+    indexing with a slice returns another Trajectory sharing the same memory. Tracked
+    LEDs can also carry flags, one uint8 per sample saying how its position was
+    obtained (0 for measured; see the video processing for the other codes).
+    """
+
+    __slots__ = ("data", "flags")
+
+    def __init__(self, data: np.ndarray, flags: Optional[np.ndarray] = None):
+        self.data = np.asarray(data, dtype=np.float64)
+        if self.data.ndim != 2 or self.data.shape[0] != 4:
+            raise ValueError(f"Trajectory data must have shape (4, N), got {self.data.shape}")
+        self.flags = None if flags is None else np.asarray(flags, dtype=np.uint8)
+        if self.flags is not None and self.flags.shape != (self.data.shape[1],):
+            raise ValueError(f"Trajectory flags must have shape ({self.data.shape[1]},), got {self.flags.shape}")
+
+    @classmethod
+    def from_columns(cls, time: np.ndarray, angle: np.ndarray, x: np.ndarray, y: np.ndarray,
+                     flags: Optional[np.ndarray] = None) -> "Trajectory":
+        return cls(np.stack(np.broadcast_arrays(time, angle, x, y)).astype(np.float64), flags)
+
+    @classmethod
+    def from_records(cls, records: Sequence[Record], flags: Optional[Sequence[int]] = None) -> "Trajectory":
+        if not len(records):
+            return cls(np.empty((4, 0)), flags)
+        time, angle, position = zip(*records)
+        x, y = np.asarray(position, dtype=np.float64).T
+        return cls.from_columns(time, angle, x, y, flags)
+
+    def to_records(self) -> List[Record]:
+        return [(t, a, (x, y)) for t, a, x, y in self.data.T.tolist()]
+
+    @property
+    def time(self) -> np.ndarray:
+        return self.data[0]
+
+    @property
+    def angle(self) -> np.ndarray:
+        return self.data[1]
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.data[2]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.data[3]
+
+    @property
+    def position(self) -> np.ndarray:
+        # (N, 2) view
+        return self.data[2:].T
+
+    def __len__(self) -> int:
+        return self.data.shape[1]
+
+    def __getitem__(self, key) -> "Trajectory":
+        # Slices give views; boolean masks and index arrays copy, as they do in NumPy
+        if isinstance(key, (int, np.integer)):
+            key = slice(key, key + 1 or None)
+        return Trajectory(self.data[:, key], None if self.flags is None else self.flags[key])
+
+    def __repr__(self) -> str:
+        span = f"t = {self.time[0]:g}..{self.time[-1]:g}" if len(self) else "empty"
+        return f"Trajectory({len(self)} samples, {span})"
+
+def arm_trajectories(t: np.ndarray, theta1: np.ndarray, theta2: np.ndarray,
+                     lengths: Tuple[float, float]) -> Tuple[Trajectory, Trajectory]:
+    """Both arms from the generalized coordinates, with each angle measured from its own joint."""
+    l1, l2 = lengths
+    x1 = l1 * np.sin(theta1)
+    y1 = -l1 * np.cos(theta1)
+    x2 = x1 + l2 * np.sin(theta2)
+    y2 = y1 - l2 * np.cos(theta2)
+    # atan2 wraps the unbounded solver angles into (-π, π], matching what the video tracker measures
+    angle1 = np.arctan2(x1, -y1)
+    angle2 = np.arctan2(x2 - x1, -(y2 - y1))
+    return Trajectory.from_columns(t, angle1, x1, y1), Trajectory.from_columns(t, angle2, x2, y2)
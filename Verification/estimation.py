@@ -0,0 +1,180 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from scipy.optimize import least_squares
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Simulations"))
+import simulation
+from sensitivity import get_parameter_values, set_parameter_values, solve_sensitivities
+from trajectory import Trajectory
+import verificiation
+
+CONFIG = {
+    "title": "Parameter Estimation",
+    "ver_outpath": "./Verification/ver_outfiles/",
+    # mass_ratio is m2/m1: scaling both masses together doesn't change the motion
+    "fit_parameters": ["mass_ratio", "l1", "l2", "theta1", "theta2", "omega1", "omega2"],
+    # The motion is chaotic, so each start is fitted on a growing window (seconds after motion start)
+    "windows": [1.0, 2.0, 4.0],
+    "starts": 16,
+    "start_spread": {
+        "mass_ratio": 0.3, "l1": 0.05, "l2": 0.05, "gravity": 0.1,
+        "theta1": 0.1, "theta2": 0.1, "omega1": 0.5, "omega2": 0.5
+    },
+    "seed": 0,
+    "workers": os.cpu_count(),
+    "solver": {
+        "method": "DOP853",
+        "rtol": 1e-8,
+        "atol": 1e-9
+    }
+}
+
+LOWER_BOUNDS = {"mass_ratio": 1e-3, "l1": 1e-3, "l2": 1e-3, "gravity": 1e-3}
+
+class FitTarget(NamedTuple):
+    time: np.ndarray
+    angle1: np.ndarray
+    angle2: np.ndarray
+
+class FitResult(NamedTuple):
+    start: int
+    cost: float
+    values: np.ndarray
+    solves: int
+    wall_time: float
+
+def wrap_angle(angle: np.ndarray) -> np.ndarray:
+    """Wrap angles into [-π, π)."""
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+def get_fit_target(first_led: Trajectory, second_led: Trajectory) -> FitTarget:
+    """Trim both LED tracks to the detected motion start and shift time to start at zero."""
+    start = verificiation.find_motion_start(np.degrees(first_led.angle))
+    track1, track2 = first_led[start:], second_led[start:]
+    return FitTarget(track1.time - track1.time[0], track1.angle, track2.angle)
+
+def guess_initial_state(target: FitTarget, frames: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+    """Estimate the initial angles and angular velocities from the first few tracked frames."""
+    angles = np.unwrap(np.stack([target.angle1[:frames], target.angle2[:frames]]), axis=1)
+    velocities = np.polyfit(target.time[:frames], angles.T, 1)[0]
+    return angles[:, 0], velocities
+
+def restrict_target(target: FitTarget, window: float) -> FitTarget:
+    """Keep only the samples in the first window seconds."""
+    mask = target.time <= window
+    return FitTarget(target.time[mask], target.angle1[mask], target.angle2[mask])
+
+class ForwardModel:
+    """Residuals and Jacobian of the angle misfit, sharing one sensitivity solve per parameter vector."""
+
+    def __init__(self, params: dict, names: Sequence[str], target: FitTarget, solver: dict):
+        self.params = params
+        self.names = list(names)
+        self.target = target
+        self.solver = solver
+        self.solves: Dict[bytes, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def solve(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        key = np.asarray(values, dtype=np.float64).tobytes()
+        if key not in self.solves:
+            params = set_parameter_values(self.params, self.names, values)
+            y, s = solve_sensitivities(params, self.target.time, self.names, self.solver)
+            residuals = np.concatenate([
+                wrap_angle(y[0] - self.target.angle1),
+                wrap_angle(y[1] - self.target.angle2)
+            ])
+            jacobian = np.concatenate([s[0].T, s[1].T])
+            self.solves[key] = (residuals, jacobian)
+        return self.solves[key]
+
+    def residuals(self, values: np.ndarray) -> np.ndarray:
+        return self.solve(values)[0]
+
+    def jacobian(self, values: np.ndarray) -> np.ndarray:
+        return self.solve(values)[1]
+
+def fit_from_start(start: int, params: dict, names: Sequence[str], target: FitTarget,
+                   values: np.ndarray, windows: Sequence[float], solver: dict) -> FitResult:
+    """Run one trust-region least-squares fit through every window, starting from values."""
+    begin = time.perf_counter()
+    lower = np.array([LOWER_BOUNDS.get(name, -np.inf) for name in names])
+    values = np.maximum(values, lower)
+    solves, cost = 0, np.inf
+    for window in windows:
+        model = ForwardModel(params, names, restrict_target(target, window), solver)
+        try:
+            result = least_squares(
+                model.residuals, values, jac=model.jacobian,
+                bounds=(lower, np.inf), x_scale="jac", method="trf"
+            )
+        except RuntimeError:
+            break  # a start that wanders into a diverging integration is simply dropped
+        solves += len(model.solves)
+        values, cost = result.x, result.cost
+    return FitResult(start, cost, values, solves, time.perf_counter() - begin)
+
+def make_starts(values: np.ndarray, names: Sequence[str], count: int, seed: int) -> List[np.ndarray]:
+    """The initial guess itself followed by randomly perturbed copies of it."""
+    rng = np.random.default_rng(seed)
+    spread = np.array([CONFIG["start_spread"][name] for name in names])
+    return [values] + [values + spread * rng.uniform(-1, 1, len(values)) for _ in range(count - 1)]
+
+def estimate_parameters(first_led: Trajectory, second_led: Trajectory,
+                        workers: Optional[int] = None) -> Tuple[dict, List[FitResult], FitTarget]:
+    """Fit the configured parameters to the tracked LEDs with parallel multi-start least squares."""
+    names = CONFIG["fit_parameters"]
+    target = restrict_target(get_fit_target(first_led, second_led), max(CONFIG["windows"]))
+    angles, velocities = guess_initial_state(target)
+    params = dict(
+        simulation.get_hashable_params(),
+        initial_angles=angles.tolist(),
+        initial_velocities=velocities.tolist()
+    )
+    starts = make_starts(get_parameter_values(params, names), names, CONFIG["starts"], CONFIG["seed"])
+
+    with ProcessPoolExecutor(max_workers=workers or CONFIG["workers"]) as pool:
+        futures = [
+            pool.submit(fit_from_start, i, params, names, target, values, CONFIG["windows"], CONFIG["solver"])
+            for i, values in enumerate(starts)
+        ]
+        results = sorted((future.result() for future in futures), key=lambda r: r.cost)
+    return set_parameter_values(params, names, results[0].values), results, target
+
+def plot_fit(params: dict, target: FitTarget) -> None:
+    """Plot the tracked angles against the best fit."""
+    y, _ = solve_sensitivities(params, target.time, [], CONFIG["solver"])
+    fig, axes = plt.subplots(2, 1, figsize=(30, 16), sharex=True)
+    for ax, video, sim, arm in zip(axes, (target.angle1, target.angle2), y[:2], (1, 2)):
+        ax.scatter(target.time, np.degrees(video), s=10, color='blue', alpha=0.5, label='Video Data')
+        ax.plot(target.time, np.degrees(wrap_angle(sim)), 'r-', lw=2, label='Fitted Simulation')
+        ax.set_ylabel(f"Arm {arm} Angle (degrees)", fontsize=24)
+        ax.legend(fontsize=22)
+        ax.tick_params(axis='both', labelsize=20)
+        ax.grid(True)
+    axes[-1].set_xlabel("Time from Motion Start (seconds)", fontsize=24)
+    plt.suptitle(CONFIG["title"], fontsize=28)
+    plt.tight_layout()
+    plt.savefig(f"{CONFIG['ver_outpath']}{CONFIG['title']}.png")
+    plt.show()
+
+def main():
+    _, first_led, second_led = verificiation.load_saved_vid_data()
+    params, results, target = estimate_parameters(first_led, second_led)
+
+    print(f"{'start':>5}{'cost':>14}{'solves':>8}{'wall (s)':>10}")
+    for result in results:
+        print(f"{result.start:>5}{result.cost:>14.6g}{result.solves:>8}{result.wall_time:>10.2f}")
+    print("Best fit, as simulation params (initial state is at the detected motion start):")
+    for key in ("masses", "lengths", "gravity", "initial_angles", "initial_velocities"):
+        print(f'    "{key}": {json.dumps(params[key])},')
+    plot_fit(params, target)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import matplotlib.pyplot as plt
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import NamedTuple, Optional, Tuple
+from scipy.signal import savgol_filter
+import argparse
+import copy
+import csv
+import os
+import sys
+import time
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Simulations"))
+import simulation
+from estimation import wrap_angle
+from trajectory import Trajectory
+import verificiation
+
+CONFIG = {
+    "title": "Predictability Horizon",
+    "ver_outpath": "./Verification/ver_outfiles/",
+    "start_step": 0.05,         # seconds of video between restarts
+    "max_horizon": 3.0,         # seconds each restart is simulated for
+    "tolerance": 10.0,          # degrees either arm may be off before a restart counts as diverged
+    # Savitzky-Golay fit giving a first guess of the angles and angular velocities each restart starts from
+    "velocity_window": 5,       # frames, odd
+    "velocity_order": 3,
+    # Gauss-Newton refinement of that guess against the next few frames, through the equations of motion
+    "fit_frames": 6,
+    "fit_iterations": 4,
+    "mode": "fixed",            # "fixed" (batched RK4) or "adaptive", as in simulation.solve_pendulum_ensemble
+    "steps_per_sample": 32,
+    "workers": os.cpu_count()
+}
+
+REPORT_FIELDS = ["start_time", "horizon", "censored", "theta1", "theta2", "omega1", "omega2"]
+
+class ObservedStates(NamedTuple):
+    time: np.ndarray     # uniform grid at the video frame rate
+    angles: np.ndarray   # (2, N) unwrapped tracked angles
+    states: np.ndarray   # (N, 4) smoothed angles and angular velocities at each frame
+    usable: np.ndarray   # (N,) False where a restart would start from occluded or interpolated frames
+
+class HorizonResult(NamedTuple):
+    start_time: np.ndarray
+    horizon: np.ndarray
+    censored: np.ndarray  # the restart never diverged before max_horizon or the end of the video
+    states: np.ndarray
+
+def estimate_states(first_led: Trajectory, second_led: Trajectory, window: int = 5, order: int = 3) -> ObservedStates:
+    """Tracked angles on a uniform frame grid, with the angular velocities from a Savitzky-Golay derivative."""
+    dt = float(np.median(np.diff(first_led.time)))
+    count = int(np.floor((first_led.time[-1] - first_led.time[0]) / dt)) + 1
+    angles = np.unwrap(np.stack([first_led.angle, second_led.angle]), axis=1)
+    angles = verificiation.interpolate_uniform(first_led.time, angles, first_led.time[0], dt, count)
+    smoothed = savgol_filter(angles, window, order, axis=1)
+    velocities = savgol_filter(angles, window, order, deriv=1, delta=dt, axis=1)
+
+    flagged = np.zeros(len(first_led), dtype=bool)
+    for led in (first_led, second_led):
+        if led.flags is not None:
+            flagged |= led.flags != 0
+    flagged = verificiation.interpolate_uniform(first_led.time, flagged[None].astype(float), first_led.time[0], dt, count)[0] > 0
+    # A restart is only as good as the frames its velocity was fitted on
+    usable = np.convolve(flagged, np.ones(window), mode="same") == 0
+    usable[:window // 2] = usable[len(usable) - window // 2:] = False
+    time_grid = first_led.time[0] + dt * np.arange(count)
+    return ObservedStates(time_grid, angles, np.concatenate([smoothed, velocities]).T, usable)
+
+def refine_states(states: np.ndarray, observed: np.ndarray, dt: float, iterations: int,
+                  steps_per_sample: int) -> np.ndarray:
+    """Gauss-Newton fit of each state (N, 4) to the angles (N, 2, frames) it should go through, all in one ensemble."""
+    # Differentiating noisy angles is badly off whenever the arms whip around between frames. The
+    # motion itself pins down the velocities much better: the Jacobian of the simulated angles comes
+    # from forward differences, with the base and the 4 perturbed copies of every state integrated together.
+    n, frames = len(states), observed.shape[2]
+    t_eval = dt * np.arange(frames)
+    for _ in range(iterations):
+        steps = 1e-6 * np.maximum(1.0, np.abs(states))
+        batch = np.concatenate([states] + [states + np.eye(4)[i] * steps[:, i:i + 1] for i in range(4)])
+        angles = simulation.integrate_ensemble_fixed(batch, t_eval, steps_per_sample)[:, :2].reshape(5, n, 2 * frames)
+        residuals = wrap_angle(angles[0] - observed.reshape(n, -1))
+        jacobian = ((angles[1:] - angles[0]) / steps.T[:, :, None]).transpose(1, 2, 0)
+        normal = np.einsum("nki,nkj->nij", jacobian, jacobian) + 1e-9 * np.eye(4)
+        states = states - np.linalg.solve(normal, np.einsum("nki,nk->ni", jacobian, residuals)[..., None])[..., 0]
+    return states
+
+def simulate_restarts(params: dict, states: np.ndarray, observed: np.ndarray, samples: int, dt: float,
+                      mode: str, steps_per_sample: int, iterations: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Refined states and angles (N, 2, samples) of every restart, one frame apart, integrated together as one ensemble."""
+    # Runs in a worker process, which owns its copy of simulation.CONFIG
+    simulation.CONFIG["params"] = dict(params, time_span=[0.0, (samples - 1) * dt], num_points=samples)
+    states = refine_states(states, observed, dt, iterations, steps_per_sample)
+    solution, _ = simulation.solve_pendulum_ensemble(states, mode, steps_per_sample)
+    return states, solution["y"][:, :2]
+
+def divergence_times(simulated: np.ndarray, observed: np.ndarray, starts: np.ndarray, dt: float,
+                     tolerance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Time until each restart first differs from the video by more than tolerance degrees, and whether it never did."""
+    samples = simulated.shape[2]
+    frames = starts[:, None] + np.arange(samples)[None, :]
+    inside = frames < observed.shape[1]
+    video = observed[:, np.minimum(frames, observed.shape[1] - 1)].transpose(1, 0, 2)
+    deviation = np.degrees(np.max(np.abs(wrap_angle(simulated - video)), axis=1))
+    diverged = (deviation > tolerance) & inside
+    first = np.where(diverged.any(axis=1), np.argmax(diverged, axis=1), np.sum(inside, axis=1) - 1)
+    return first * dt, ~diverged.any(axis=1)
+
+def find_horizons(first_led: Trajectory, second_led: Trajectory, params: dict,
+                  workers: Optional[int] = None) -> HorizonResult:
+    """Restart the simulation from the tracked state every start_step seconds and time how long each one keeps up."""
+    observed = estimate_states(first_led, second_led, CONFIG["velocity_window"], CONFIG["velocity_order"])
+    dt = observed.time[1] - observed.time[0]
+    stride = max(1, int(round(CONFIG["start_step"] / dt)))
+    starts = np.flatnonzero(observed.usable)
+    # The refinement fits the frames after each start, so those have to exist
+    starts = starts[starts + CONFIG["fit_frames"] <= len(observed.time)]
+    starts = starts[(starts - starts[0]) % stride == 0] if len(starts) else starts
+    if not len(starts):
+        raise ValueError("No usable frames to restart from")
+    samples = int(round(CONFIG["max_horizon"] / dt)) + 1
+
+    # One batched ensemble per group, since a bigger batch amortizes the per-step overhead
+    workers = workers or 1
+    groups = [group for group in np.array_split(starts, workers) if len(group)]
+    horizons, censored = np.empty(len(starts)), np.empty(len(starts), dtype=bool)
+    states = np.empty((len(starts), 4))
+    fit = np.arange(CONFIG["fit_frames"])
+    offsets = np.cumsum([0] + [len(group) for group in groups])
+    begin = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(simulate_restarts, params, observed.states[group],
+                        observed.angles[:, group[:, None] + fit].transpose(1, 0, 2), samples, dt,
+                        CONFIG["mode"], CONFIG["steps_per_sample"], CONFIG["fit_iterations"]): i
+            for i, group in enumerate(groups)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            span = slice(offsets[i], offsets[i + 1])
+            states[span], simulated = future.result()
+            horizons[span], censored[span] = divergence_times(simulated, observed.angles, groups[i], dt, CONFIG["tolerance"])
+            print(f"[{done}/{len(groups)}] {len(groups[i])} restarts ({time.perf_counter() - begin:.1f} s)")
+    return HorizonResult(observed.time[starts], horizons, censored, states)
+
+def write_report(path: str, result: HorizonResult) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_FIELDS)
+        for start, horizon, censored, state in zip(result.start_time, result.horizon, result.censored, result.states):
+            writer.writerow([f"{start:.4f}", f"{horizon:.4f}", int(censored), *(f"{x:.6f}" for x in state)])
+
+def plot_horizons(first_led: Trajectory, second_led: Trajectory, result: HorizonResult) -> None:
+    """Plot the tracked angles above the horizon of the restart from each moment."""
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(30, 16), sharex=True)
+    ax1.plot(first_led.time, np.degrees(first_led.angle), color='blue', alpha=0.7, label='Arm 1')
+    ax1.plot(second_led.time, np.degrees(second_led.angle), color='red', alpha=0.7, label='Arm 2')
+    ax1.set_ylabel("Tracked Angle (degrees)", fontsize=24)
+    ax1.legend(fontsize=22)
+    ax1.tick_params(axis='both', labelsize=20)
+    ax1.grid(True)
+
+    ax2.plot(result.start_time, result.horizon, 'k-', lw=1, alpha=0.5)
+    ax2.scatter(result.start_time[~result.censored], result.horizon[~result.censored], s=10, color='green',
+                label=f'Diverged by {CONFIG["tolerance"]:g}°')
+    ax2.scatter(result.start_time[result.censored], result.horizon[result.censored], s=10, color='gray',
+                label='Never diverged')
+    ax2.set_xlabel("Video Time (seconds)", fontsize=24)
+    ax2.set_ylabel("Horizon (seconds)", fontsize=24)
+    ax2.legend(fontsize=22)
+    ax2.tick_params(axis='both', labelsize=20)
+    ax2.grid(True)
+
+    plt.suptitle(CONFIG["title"], fontsize=28)
+    plt.tight_layout()
+    plt.savefig(f"{CONFIG['ver_outpath']}{CONFIG['title']}.png")
+    plt.show()
+
+def main():
+    parser = argparse.ArgumentParser(description="How long the simulation keeps up with the video when restarted from it.")
+    parser.add_argument("--video", help="track log or text file, instead of the one in verificiation.CONFIG")
+    parser.add_argument("--workers", type=int, default=CONFIG["workers"])
+    args = parser.parse_args()
+
+    _, first_led, second_led = verificiation.load_saved_vid_data(Path(args.video) if args.video else None)
+    params = copy.deepcopy(simulation.get_hashable_params())
+    result = find_horizons(first_led, second_led, params, args.workers)
+    write_report(f"{CONFIG['ver_outpath']}horizon.csv", result)
+    diverged = result.horizon[~result.censored]
+    print(f"{len(result.horizon)} restarts, median horizon {np.median(result.horizon):.2f} s, "
+          f"{np.count_nonzero(result.censored)} never diverged" +
+          (f", shortest {diverged.min():.2f} s" if len(diverged) else ""))
+    plot_horizons(first_led, second_led, result)
+
+if __name__ == "__main__":
+    main()
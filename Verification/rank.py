@@ -0,0 +1,239 @@
+import matplotlib
+matplotlib.use("Agg")  # before verificiation imports pyplot, in the parent and in every worker
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import time
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Simulations"))
+import simulation
+from cache import CacheEntry, SimulationCache
+from estimation import wrap_angle
+from trajectory import Trajectory
+import verificiation
+
+CONFIG = {
+    "cache_path": simulation.CONFIG["path_to_cache"],
+    # {"lengths.0": [0.5, 0.55], "gravity": 9.81, ...}: [low, high] ranges or exact values, by params path
+    "ranges": {},
+    "report_path": "./Verification/ver_outfiles/ranking.csv",
+    "score_window": 4.0,    # seconds after the aligned start that are scored; chaos makes later differences meaningless
+    "tolerance": 10.0,      # degrees either arm may be off before a simulation stops counting as agreeing
+    "start_search": 0.1,    # seconds each candidate's start may move from the shared alignment
+    "workers": os.cpu_count(),
+    "top": 20
+}
+
+REPORT_FIELDS = [
+    "rank", "key", "masses", "lengths", "gravity", "initial_angles", "initial_velocities", "time_span",
+    "rms", "rms1", "rms2", "max_deviation", "agreement_time", "shift", "coverage", "error"
+]
+PARAM_FIELDS = ("masses", "lengths", "gravity", "initial_angles", "initial_velocities", "time_span")
+
+class ScoreTarget(NamedTuple):
+    time: np.ndarray    # video times in simulation seconds, from the alignment
+    angle1: np.ndarray
+    angle2: np.ndarray
+
+def get_param(params: dict, path: str):
+    # "lengths.0" addresses params["lengths"][0], like the paths in a sweep manifest
+    value = params
+    for part in path.split("."):
+        value = value[int(part)] if isinstance(value, list) else value[part]
+    return value
+
+def parse_range(text: str) -> Tuple[str, object]:
+    # "lengths.0=0.5:0.55" is a range, "gravity=9.81" an exact value
+    path, value = text.split("=", 1)
+    if ":" in value:
+        return path, [float(bound) for bound in value.split(":", 1)]
+    return path, json.loads(value)
+
+def in_ranges(params: Optional[dict], ranges: dict) -> bool:
+    if not ranges:
+        return True
+    if params is None:
+        return False  # migrated text files only kept their lengths
+    for path, allowed in ranges.items():
+        try:
+            value = get_param(params, path)
+        except (KeyError, IndexError, TypeError, ValueError):
+            return False
+        if isinstance(allowed, list) and len(allowed) == 2 and not isinstance(value, list):
+            if not allowed[0] <= value <= allowed[1]:
+                return False
+        elif value != allowed:
+            return False
+    return True
+
+def find_candidates(cache: SimulationCache, ranges: dict) -> List[CacheEntry]:
+    """Complete cache entries whose parameters fall inside every range."""
+    entries = cache.query(lambda entry: in_ranges(entry.params, ranges))
+    return sorted((entry for entry in entries if simulation.is_cached(entry.key, cache)), key=lambda entry: entry.key)
+
+def get_reference(candidates: List[CacheEntry], key: Optional[str]) -> CacheEntry:
+    # The alignment is found once, against the configured simulation if it's a candidate
+    key = key or simulation.get_param_hash()
+    return next((entry for entry in candidates if entry.key == key), candidates[0])
+
+def load_arms(entry: CacheEntry, dt: float) -> Tuple[Trajectory, Trajectory]:
+    data = verificiation.load_saved_data(Path(entry.path))
+    if "dense" in data:
+        data = verificiation.resample_simulation(data, dt)
+    return verificiation.process_pendulum_data(data)
+
+def get_score_target(first_led: Trajectory, second_led: Trajectory, alignment: verificiation.Alignment,
+                     window: float) -> ScoreTarget:
+    """The tracked angles on the simulation's clock, restricted to the scored window."""
+    t = (first_led.time - alignment.offset) / alignment.scale
+    mask = (t >= 0) & (t <= window)
+    return ScoreTarget(t[mask], first_led.angle[mask], second_led.angle[mask])
+
+def simulated_angles(data: dict, t: np.ndarray) -> np.ndarray:
+    # The solver's angles aren't wrapped, so plain interpolation is fine without dense output
+    if "dense" in data:
+        return data["dense"](t)[:2]
+    return np.stack([np.interp(t, data["t"], data["y"][i]) for i in range(2)])
+
+def angle_deviation(data: dict, target: ScoreTarget, t: np.ndarray, shift: np.ndarray) -> np.ndarray:
+    """Absolute angle differences in degrees (2, shifts, samples), with the simulation started shift seconds later."""
+    # Before its start the simulated pendulum is still being held at its initial angles
+    times = np.clip(t[None, :] - shift[:, None], 0.0, data["t"][-1])
+    angles = simulated_angles(data, times.ravel()).reshape(2, len(shift), len(t))
+    return np.degrees(np.abs(np.stack([
+        wrap_angle(angles[0] - target.angle1[:len(t)]),
+        wrap_angle(angles[1] - target.angle2[:len(t)])
+    ])))
+
+def score_candidate(entry: CacheEntry, target: ScoreTarget, tolerance: float, search: float) -> Dict[str, str]:
+    data = verificiation.load_saved_data(Path(entry.path))
+    t = target.time[:np.searchsorted(target.time, data["t"][-1], side="right")]
+    if len(t) < 2:
+        return make_row(entry, error="simulation ends before the scored window starts")
+    # Different parameters release at slightly different moments than the simulation the video was aligned
+    # with, so each candidate gets the start within search seconds of the shared alignment that fits it best
+    step = np.median(np.diff(t)) / 4
+    shifts = np.linspace(-search, search, 2 * int(round(search / step)) + 1)
+    cost = np.mean(angle_deviation(data, target, t, shifts)**2, axis=(0, 2))
+    best, fraction, _ = verificiation.refine_peak(-cost)
+    shift = shifts[best] + fraction * (shifts[1] - shifts[0]) if len(shifts) > 1 else 0.0
+    deviation = angle_deviation(data, target, t, np.array([shift]))[:, 0]
+
+    rms1, rms2 = np.sqrt(np.mean(deviation**2, axis=1))
+    worst = np.max(deviation, axis=0)
+    beyond = np.flatnonzero(worst > tolerance)
+    return make_row(
+        entry,
+        rms=f"{math.hypot(rms1, rms2) / math.sqrt(2):.4f}",
+        rms1=f"{rms1:.4f}",
+        rms2=f"{rms2:.4f}",
+        max_deviation=f"{worst.max():.4f}",
+        agreement_time=f"{t[beyond[0]] if len(beyond) else t[-1]:.3f}",
+        shift=f"{shift:.4f}",
+        coverage=f"{t[-1]:.3f}"
+    )
+
+def score_candidates(entries: List[CacheEntry], target: ScoreTarget, tolerance: float,
+                     search: float) -> List[Dict[str, str]]:
+    # Runs in a worker process; the target is sent once per group of candidates instead of once per candidate
+    rows = []
+    for entry in entries:
+        try:
+            rows.append(score_candidate(entry, target, tolerance, search))
+        except Exception as e:
+            rows.append(make_row(entry, error=f"{type(e).__name__}: {e}"))
+    return rows
+
+def make_row(entry: CacheEntry, **metrics) -> Dict[str, str]:
+    row = {field: "" for field in REPORT_FIELDS}
+    row["key"] = entry.key
+    for field in PARAM_FIELDS:
+        if entry.params is not None and field in entry.params:
+            row[field] = json.dumps(entry.params[field])
+    if entry.params is None:
+        row["lengths"] = json.dumps(entry.lengths)
+    row.update({name: str(value) for name, value in metrics.items()})
+    return row
+
+def write_report(path: str, rows: List[Dict[str, str]]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, path)
+
+def rank_simulations(first_led: Trajectory, second_led: Trajectory, cache: SimulationCache, ranges: dict,
+                     reference: Optional[str] = None, workers: Optional[int] = None) -> List[Dict[str, str]]:
+    """Score every cached simulation inside the ranges against the tracked LEDs, best first."""
+    candidates = find_candidates(cache, ranges)
+    if not candidates:
+        raise ValueError(f"No complete simulations in {cache.root} match {ranges}")
+    entry = get_reference(candidates, reference)
+    arm1, arm2 = load_arms(entry, float(np.median(np.diff(first_led.time))))
+    print(f"{len(candidates)} candidates, aligning against {entry.key[:12]}")
+    alignment = verificiation.get_alignment(first_led, second_led, arm1, arm2)
+    if alignment is None:
+        # The motion start detector gives the same kind of offset, with the simulation starting right then
+        start = verificiation.find_motion_start(np.degrees(first_led.angle))
+        alignment = verificiation.Alignment(float(first_led.time[start]), 1.0, float("nan"))
+    target = get_score_target(first_led, second_led, alignment, CONFIG["score_window"])
+
+    workers = workers or 1
+    groups = [group for group in np.array_split(np.arange(len(candidates)), 4 * workers) if len(group)]
+    rows = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(score_candidates, [candidates[i] for i in group], target, CONFIG["tolerance"],
+                        CONFIG["start_search"])
+            for group in groups
+        ]
+        for future in as_completed(futures):
+            rows += future.result()
+            print(f"[{len(rows)}/{len(candidates)}] scored ({time.perf_counter() - start:.1f} s)")
+
+    rows.sort(key=lambda row: float(row["rms"]) if row["rms"] else math.inf)
+    for rank, row in enumerate(rows, 1):
+        row["rank"] = str(rank) if row["rms"] else ""
+    return rows
+
+def print_ranking(rows: List[Dict[str, str]], top: int) -> None:
+    print(f"{'rank':>4}  {'key':<14}{'rms (°)':>9}{'arm 1':>9}{'arm 2':>9}{'max (°)':>9}{'agrees (s)':>12}  lengths")
+    for row in rows[:top]:
+        print(f"{row['rank']:>4}  {row['key'][:12]:<14}{row['rms']:>9}{row['rms1']:>9}{row['rms2']:>9}"
+              f"{row['max_deviation']:>9}{row['agreement_time']:>12}  {row['lengths']}")
+        if row["error"]:
+            print(f"    {row['error']}")
+    if rows and rows[0]["rank"]:
+        print(f'Best match: set "sim_data_name" to "{os.path.join("simulation_cache", rows[0]["key"])}"')
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank cached simulations by how closely they follow a tracked video.")
+    parser.add_argument("--video", help="track log or text file, instead of the one in verificiation.CONFIG")
+    parser.add_argument("--range", action="append", default=[], metavar="PATH=LOW:HIGH",
+                        help='parameter range or exact value, e.g. "lengths.0=0.5:0.55" or "gravity=9.81"')
+    parser.add_argument("--cache", default=CONFIG["cache_path"])
+    parser.add_argument("--reference", help="key of the simulation to align the video with")
+    parser.add_argument("--report", default=CONFIG["report_path"])
+    parser.add_argument("--workers", type=int, default=CONFIG["workers"])
+    parser.add_argument("--top", type=int, default=CONFIG["top"])
+    args = parser.parse_args()
+
+    ranges = dict(CONFIG["ranges"], **dict(parse_range(text) for text in args.range))
+    _, first_led, second_led = verificiation.load_saved_vid_data(Path(args.video) if args.video else None)
+    rows = rank_simulations(first_led, second_led, SimulationCache(args.cache), ranges, args.reference, args.workers)
+    write_report(args.report, rows)
+    print_ranking(rows, args.top)
+
+if __name__ == "__main__":
+    main()
@@ -2,26 +2,50 @@ import matplotlib.pyplot as plt
 import numpy as np
 import math
 import json
+import sys
 from pathlib import Path
-from typing import Tuple, List, NamedTuple, Dict, Any
-from scipy.optimize import curve_fit
+from typing import Tuple, Dict, Any, NamedTuple, Optional
+from scipy.fft import next_fast_len
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Simulations"))
+sys.path.append(str(Path(__file__).resolve().parent.parent / "VideoProcessing"))
+from dense_output import DenseTrajectory
+import profiling
+from tracklog import TrackLog, load_text_data
+from trajectory import Trajectory, arm_trajectories
 
 CONFIG = {
     "title": "Fourier-based Deviation of the Simulation with Respect to Real Life",
     "path_to_data": "C:\\Users\\adamf\\Downloads\\",
+    # Either a legacy "simulation_<hash>.txt" file or a "simulation_cache/<hash>" cache entry directory
     "sim_data_name": "simulation_45df02e102a7b311c45a387d97d3856f720a1adcfb1d30d1a41ff66d88e170a0.txt",
+    # Either a "DSC_XXXX.track" track log directory or a legacy "DSC_XXXX.txt" text file
     "vid_data_name": "DSC_0058.txt",
+    # Ridge penalty on the harmonic coefficients of every Fourier fit; 0 is plain least squares
+    "fourier_regularization": 0.0,
+    # How the video is lined up with the simulation: "xcorr" cross-correlates the two, "motion_start"
+    # uses the old threshold on the video's angle changes and assumes the simulation starts right then
+    "alignment": "xcorr",
+    "alignment_window": 4.0,            # seconds of simulation to match; it drifts from the real pendulum later on
+    "alignment_lead": 1.0,              # seconds of the pendulum held still before release put in front of it
+    "alignment_max_scale": 0.0,         # largest video clock rate error searched, e.g. 0.002 for ±0.2%
+    "alignment_scale_steps": 9,
+    "alignment_min_overlap": 0.5,       # fraction of the matched simulation that must land inside the video
+    "alignment_min_confidence": 0.7,    # correlations below this get a warning
     "ver_outpath": "./Verification/ver_outfiles/"
 }
 
-class PendulumData(NamedTuple):
-    time: float
-    angle: float
-    position: Tuple[float, float]
-
 Point = Tuple[int, int]
-LEDData = List[Tuple[float, float, Point]]
-CartesianCoords = Tuple[float, float, float, float]
+
+# split_harmonics of recently evaluated time grids, least recently used first
+FOURIER_CACHE_BYTES = 64 * 2**20
+FOURIER_BLOCK_BYTES = 8 * 2**20
+harmonics_cache: Dict[Tuple[int, int, float, int], Tuple[np.ndarray, ...]] = {}
+
+class Alignment(NamedTuple):
+    offset: float      # video time of the simulation's t = 0
+    scale: float       # video seconds per simulation second
+    confidence: float  # correlation of the aligned angles, 1 for a perfect match
 
 def get_vid_data_path() -> Path:
     """Return the full path to the video data file."""
@@ -31,23 +55,29 @@ def get_data_sim_path() -> Path:
     """Return the full path to the simulation data file."""
     return Path(CONFIG['path_to_data']) / CONFIG['sim_data_name']
 
-def load_saved_vid_data() -> Tuple[Point, LEDData, LEDData]:
-    """Load and parse video data from the configured file."""
-    pivot, first_led, second_led = None, [], []
-    with open(get_vid_data_path(), "r") as f:
-        for line in f:
-            key, value = line.split(":", 1)
-            if key == "Pivot":
-                pivot = json.loads(value)
-            elif key == "firstLED":
-                first_led = json.loads(value)
-            elif key == "secondLED":
-                second_led = json.loads(value)
-    return pivot, first_led, second_led
-
-def load_saved_data() -> Dict[str, Any]:
-    """Load simulation data from the configured JSON file."""
-    with open(get_data_sim_path(), "r") as f:
+def load_saved_vid_data(path: Optional[Path] = None) -> Tuple[Point, Trajectory, Trajectory]:
+    """Load the tracked LEDs from a track log or text file, the configured one by default."""
+    path = path or get_vid_data_path()
+    if path.is_dir():
+        log = TrackLog.open(str(path))
+        return (tuple(log.header["pivot"]), *log.trajectories())
+    return load_text_data(str(path))
+
+def load_saved_data(path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load simulation data from a binary cache entry or a legacy JSON text file, the configured one by default."""
+    path = path or get_data_sim_path()
+    if path.is_dir():
+        with open(path / "meta.json", "r") as f:
+            meta = json.load(f)
+        data = {
+            "y": np.load(path / "y.npy", mmap_mode="r"),
+            "t": np.load(path / "t.npy", mmap_mode="r"),
+            "lengths": np.array(meta["lengths"])
+        }
+        if (path / "dense_t.npy").exists():
+            data["dense"] = DenseTrajectory(np.load(path / "dense_t.npy"), np.load(path / "dense_coeffs.npy"))
+        return data
+    with open(path, "r") as f:
         data = json.load(f)
     return {
         "y": np.array(data["y"]),
@@ -55,40 +85,16 @@ def load_saved_data() -> Dict[str, Any]:
         "lengths": np.array(data["lengths"])
     }
 
-def get_cartesian_coords(theta1: np.ndarray, theta2: np.ndarray, lengths: Tuple[float, float]) -> CartesianCoords:
-    """Calculate Cartesian coordinates for both pendulum masses using vectorized operations."""
-    l1, l2 = lengths
-    x1 = l1 * np.sin(theta1)
-    y1 = -l1 * np.cos(theta1)
-    x2 = x1 + l2 * np.sin(theta2)
-    y2 = y1 - l2 * np.cos(theta2)
-    return x1, y1, x2, y2
-
-def process_pendulum_data(solution: Dict[str, Any]) -> Tuple[List[PendulumData], List[PendulumData]]:
-    """Process simulation data to generate pendulum trajectories using vectorized operations."""
-    theta1 = solution["y"][0]
-    theta2 = solution["y"][1]
-    times = solution["t"]
-    lengths = (solution["lengths"][0], solution["lengths"][1])
+def resample_simulation(sim_data: Dict[str, Any], dt: float) -> Dict[str, Any]:
+    """Sample the simulation's dense output on a uniform grid with spacing dt."""
+    dense = sim_data["dense"]
+    t = np.arange(dense.t_min, dense.t_max, dt)
+    return {"y": dense(t), "t": t, "lengths": sim_data["lengths"]}
 
-    x1, y1, x2, y2 = get_cartesian_coords(theta1, theta2, lengths)
-    
-    # Calculate angles using vectorized operations
-    angle1 = np.arctan2(x1, -y1)
-    dx = x2 - x1
-    dy = y2 - y1
-    angle2 = np.arctan2(dx, -dy)
-    
-    # Create pendulum data lists
-    arm1_data = [
-        PendulumData(t, a1, (x, y))
-        for t, a1, x, y in zip(times, angle1, x1, y1)
-    ]
-    arm2_data = [
-        PendulumData(t, a2, (x, y))
-        for t, a2, x, y in zip(times, angle2, x2, y2)
-    ]
-    return arm1_data, arm2_data
+def process_pendulum_data(solution: Dict[str, Any]) -> Tuple[Trajectory, Trajectory]:
+    """Convert simulation angles into per-arm trajectories measured the same way as the video."""
+    lengths = (solution["lengths"][0], solution["lengths"][1])
+    return arm_trajectories(solution["t"], solution["y"][0], solution["y"][1], lengths)
 
 def find_motion_start(angles: np.ndarray, window_size: int = 5, threshold: float = 1.0) -> int:
     """Detect the start of motion using moving average of angular differences."""
@@ -104,33 +110,132 @@ def find_motion_start(angles: np.ndarray, window_size: int = 5, threshold: float
     start_idx = np.argmax(above_threshold) + window_size
     return min(start_idx, len(angles) - 1)
 
-def process_arm(vid_data: LEDData, sim_data: List[PendulumData]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+def interpolate_uniform(t: np.ndarray, values: np.ndarray, start: float, dt: float, count: int) -> np.ndarray:
+    """Linearly interpolate the rows of values (C, N) at start + k*dt for k < count, holding the end values outside t."""
+    grid = start + dt * np.arange(count)
+    right = np.clip(np.searchsorted(t, grid), 1, len(t) - 1)
+    weight = np.clip((grid - t[right - 1]) / (t[right] - t[right - 1]), 0.0, 1.0)
+    return values[:, right - 1] + weight * (values[:, right] - values[:, right - 1])
+
+def angle_channels(angle1: np.ndarray, angle2: np.ndarray) -> np.ndarray:
+    """cos and sin of both arm angles, which unlike the angles themselves don't jump when an arm goes over the top."""
+    return np.stack([np.cos(angle1), np.sin(angle1), np.cos(angle2), np.sin(angle2)])
+
+def sliding_correlation(signal: np.ndarray, template: np.ndarray, min_overlap: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Pearson correlation of template (C, m) against signal (C, n) at every lag overlapping by min_overlap samples."""
+    # Lag L puts template sample j on signal sample j + L. The cross products of every lag come from one
+    # FFT product and the means and variances of each overlap from prefix sums, so this is O((n + m) log(n + m)).
+    n, m = signal.shape[1], template.shape[1]
+    size = next_fast_len(n + m - 1, real=True)
+    products = np.sum(np.fft.rfft(signal, size) * np.conj(np.fft.rfft(template, size)), axis=0)
+    circular = np.fft.irfft(products, size)
+    lags = np.arange(min_overlap - m, n - min_overlap + 1)
+    cross = circular[lags % size]
+
+    # Overlap of lag L: template[lo:hi] against signal[lo + L:hi + L]
+    lo, hi = np.maximum(0, -lags), np.minimum(m, n - lags)
+    count = hi - lo
+    template_sums, template_squares = overlap_sums(template, lo, hi)
+    signal_sums, signal_squares = overlap_sums(signal, lo + lags, hi + lags)
+
+    covariance = cross - np.sum(template_sums * signal_sums, axis=0) / count
+    template_variance = template_squares - np.sum(template_sums**2, axis=0) / count
+    signal_variance = signal_squares - np.sum(signal_sums**2, axis=0) / count
+    norm = np.sqrt(np.maximum(template_variance * signal_variance, 0.0))
+    correlation = np.divide(covariance, norm, out=np.zeros(len(lags)), where=norm > 1e-12 * count)
+    return lags, correlation
+
+def overlap_sums(x: np.ndarray, first: np.ndarray, last: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-channel sums of x (C, N) and sums of squares over all channels, over columns first:last for each pair."""
+    sums = np.concatenate([np.zeros((x.shape[0], 1)), np.cumsum(x, axis=1)], axis=1)
+    squares = np.concatenate([np.zeros(1), np.cumsum(np.sum(x * x, axis=0))])
+    return sums[:, last] - sums[:, first], squares[last] - squares[first]
+
+def refine_peak(values: np.ndarray) -> Tuple[int, float, float]:
+    """Index of the largest value, with the sub-sample offset and height of the parabola through it and its neighbours."""
+    peak = int(np.argmax(values))
+    if peak == 0 or peak == len(values) - 1:
+        return peak, 0.0, float(values[peak])
+    left, centre, right = values[peak - 1:peak + 2]
+    curvature = left - 2 * centre + right
+    if curvature >= 0:
+        return peak, 0.0, float(centre)
+    shift = 0.5 * (left - right) / curvature
+    return peak, shift, float(centre - 0.25 * (left - right) * shift)
+
+def align_trajectories(vid1: Trajectory, vid2: Trajectory, sim1: Trajectory, sim2: Trajectory,
+                       window: float = 4.0, lead: float = 1.0, max_scale: float = 0.0, scale_steps: int = 9,
+                       min_overlap: float = 0.5) -> Alignment:
+    """Find the offset (and clock rate) that best lines the simulated arm angles up with the tracked ones."""
+    dt = float(np.median(np.diff(vid1.time)))
+    count = int(np.floor((vid1.time[-1] - vid1.time[0]) / dt)) + 1
+    video = angle_channels(*interpolate_uniform(vid1.time, np.stack([vid1.angle, vid2.angle]), vid1.time[0], dt, count))
+    sim_angles = np.stack([sim1.angle, sim2.angle])
+    duration = min(window, sim1.time[-1] - sim1.time[0])
+
+    def correlate(scale: float) -> Tuple[float, float]:
+        # The template is sampled on the video's grid: simulation time k*dt/scale lands on video time k*dt.
+        # It starts with the pendulum held still at its initial angles, so the release itself is matched.
+        held = int(np.ceil(lead / dt))
+        length = held + int(np.floor(duration * scale / dt)) + 1
+        start = sim1.time[0] - held * dt / scale
+        template = angle_channels(*interpolate_uniform(sim1.time, sim_angles, start, dt / scale, length))
+        lags, correlation = sliding_correlation(video, template, max(2, int(np.ceil(min_overlap * min(length, count)))))
+        peak, shift, height = refine_peak(correlation)
+        return lags[peak] + shift + held, height
+
+    scales = 1.0 + np.linspace(-max_scale, max_scale, scale_steps) if max_scale > 0 else np.ones(1)
+    peaks = [correlate(scale) for scale in scales]
+    best, shift, _ = refine_peak(np.array([height for _, height in peaks]))
+    scale = float(scales[best] + shift * (scales[1] - scales[0])) if len(scales) > 1 else 1.0
+    lag, confidence = correlate(scale) if shift else peaks[best]
+    offset = vid1.time[0] + lag * dt - sim1.time[0] * scale
+    return Alignment(float(offset), scale, float(np.clip(confidence, -1.0, 1.0)))
+
+def get_alignment(vid1: Trajectory, vid2: Trajectory, sim1: Trajectory, sim2: Trajectory) -> Optional[Alignment]:
+    """The configured alignment of the video to the simulation, or None to fall back on the motion start detector."""
+    if CONFIG["alignment"] != "xcorr":
+        return None
+    alignment = align_trajectories(
+        vid1, vid2, sim1, sim2, CONFIG["alignment_window"], CONFIG["alignment_lead"], CONFIG["alignment_max_scale"],
+        CONFIG["alignment_scale_steps"], CONFIG["alignment_min_overlap"]
+    )
+    print(f"Simulation starts at {alignment.offset:.3f} s of the video, clock scale {alignment.scale:.5f}, "
+          f"confidence {alignment.confidence:.3f}")
+    if alignment.confidence < CONFIG["alignment_min_confidence"]:
+        print(f"Warning: alignment confidence {alignment.confidence:.3f} is below "
+              f"{CONFIG['alignment_min_confidence']}, the comparison may be misaligned")
+    return alignment
+
+def process_arm(vid_data: Trajectory, sim_data: Trajectory,
+                alignment: Optional[Alignment] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """Process and align video/simulation data for a single pendulum arm."""
-    vid_t = np.array([d[0] for d in vid_data])
-    angles_rad = np.array([d[1] for d in vid_data])
-    vid_angles = np.degrees(angles_rad)
-    
-    start_idx = find_motion_start(vid_angles)
-    vid_t_trimmed = vid_t[start_idx:] - vid_t[start_idx]
-    vid_angles_trimmed = vid_angles[start_idx:]
+    vid_angles = np.degrees(vid_data.angle)
+
+    if alignment is not None:
+        # Video times in simulation seconds, keeping only what the simulation covers
+        vid_t = (vid_data.time - alignment.offset) / alignment.scale
+        vid_mask = (vid_t >= 0) & (vid_t <= sim_data.time[-1])
+        vid_t_trimmed, vid_angles_trimmed = vid_t[vid_mask], vid_angles[vid_mask]
+    else:
+        start_idx = find_motion_start(vid_angles)
+        vid_t_trimmed = vid_data.time[start_idx:] - vid_data.time[start_idx]
+        vid_angles_trimmed = vid_angles[start_idx:]
     max_time = vid_t_trimmed[-1] if len(vid_t_trimmed) > 0 else 0.0
 
-    sim_t = np.array([d.time for d in sim_data])
-    sim_angles_rad = np.array([d.angle for d in sim_data])
-    sim_angles = np.degrees(sim_angles_rad)
-    sim_mask = sim_t <= max_time
-    return (vid_t_trimmed, vid_angles_trimmed, sim_t[sim_mask], sim_angles[sim_mask])
+    sim_mask = sim_data.time <= max_time
+    return (vid_t_trimmed, vid_angles_trimmed, sim_data.time[sim_mask], np.degrees(sim_data.angle[sim_mask]))
 
-def plot_deviation(arm1: List[PendulumData], arm2: List[PendulumData], 
-                  data1: LEDData, data2: LEDData) -> None:
+def plot_deviation(arm1: Trajectory, arm2: Trajectory, 
+                  data1: Trajectory, data2: Trajectory, alignment: Optional[Alignment] = None) -> None:
     """Plot angle deviation between video and simulation data using Fourier approximations."""
-    vid_t1, vid_ang1, sim_t1, sim_ang1 = process_arm(data1, arm1)
-    vid_t2, vid_ang2, sim_t2, sim_ang2 = process_arm(data2, arm2)
+    vid_t1, vid_ang1, sim_t1, sim_ang1 = process_arm(data1, arm1, alignment)
+    vid_t2, vid_ang2, sim_t2, sim_ang2 = process_arm(data2, arm2, alignment)
 
     def fit_and_extend(t: np.ndarray, y: np.ndarray, evaluation_t: np.ndarray) -> np.ndarray:
         if len(t) < 2:
             return np.zeros_like(evaluation_t)
-        coeffs, _ = fit_fourier(t, y)
+        coeffs, _ = fit_fourier(t, y, regularization=CONFIG["fourier_regularization"])
         T = t[-1] if len(t) > 0 else 1.0
         return fourier_series(evaluation_t, T, *coeffs)
 
@@ -159,30 +264,134 @@ def plot_deviation(arm1: List[PendulumData], arm2: List[PendulumData],
 def fourier_series(t: np.ndarray, T: float, *coefficients) -> np.ndarray:
     """Evaluate Fourier series with given coefficients and period T at times t."""
     T = max(T, 1e-6)  # Prevent division by zero
-    result = coefficients[0] * np.ones_like(t) if coefficients else np.zeros_like(t)
-    n_terms = len(coefficients) // 2
-    for n in range(1, n_terms + 1):
-        a = coefficients[2*n-1] if (2*n-1) < len(coefficients) else 0.0
-        b = coefficients[2*n] if 2*n < len(coefficients) else 0.0
-        result += a * np.cos(2 * n * np.pi * t / T) + b * np.sin(2 * n * np.pi * t / T)
+    t = np.asarray(t, dtype=np.float64)
+    if not coefficients:
+        return np.zeros_like(t)
+    coeffs = np.asarray(coefficients, dtype=np.float64)
+    if len(coeffs) % 2 == 0:
+        coeffs = np.append(coeffs, 0.0)  # a missing last bₙ is 0
+    num_terms = len(coeffs) // 2
+    if is_uniform_period(t, T, num_terms):
+        return evaluate_fourier_fft(coeffs, len(t) - 1)
+    return evaluate_fourier_blocked(t, T, coeffs)
+
+def evaluate_fourier_fft(coeffs: np.ndarray, m: int) -> np.ndarray:
+    """The series at k*T/M for k = 0..M, by one inverse real FFT."""
+    num_terms = len(coeffs) // 2
+    spectrum = np.zeros(m // 2 + 1, dtype=np.complex128)
+    spectrum[0] = coeffs[0] * m
+    spectrum[1:num_terms + 1] = (coeffs[1::2] - 1j*coeffs[2::2]) * (m / 2)
+    values = np.fft.irfft(spectrum, m)
+    return np.append(values, values[0])  # t = T is a whole period after t = 0
+
+def evaluate_fourier_blocked(t: np.ndarray, T: float, coeffs: np.ndarray) -> np.ndarray:
+    """The series at arbitrary times, as small matrix products over blocks of samples."""
+    num_terms = len(coeffs) // 2
+    width = split_width(num_terms)
+    a, b = np.zeros(width * width), np.zeros(width * width)
+    a[0], a[1:num_terms + 1], b[1:num_terms + 1] = coeffs[0], coeffs[1::2], coeffs[2::2]
+    a, b = a.reshape(width, width).T, b.reshape(width, width).T    # [r, q] is harmonic q*width + r
+    factors = cached_harmonics(t, T, width)
+    if factors is not None:
+        return combine_harmonics(factors, a, b)
+    # Too long to keep: go through blocks of samples so memory stays bounded whatever the length
+    block = max(1, FOURIER_BLOCK_BYTES // (8 * 4 * width))
+    result = np.empty(len(t))
+    for start in range(0, len(t), block):
+        factors = split_harmonics((2 * np.pi / T) * t[start:start + block], width)
+        result[start:start + block] = combine_harmonics(factors, a, b)
     return result
 
-def fit_fourier(t: np.ndarray, y: np.ndarray, num_terms: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+def combine_harmonics(factors: Tuple[np.ndarray, ...], a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # Σ aₙcos(nθ) + bₙsin(nθ) = Σ_q cos(qwθ)·(Σ_r a cos(rθ) + b sin(rθ)) + sin(qwθ)·(Σ_r b cos(rθ) - a sin(rθ))
+    c, s, C, S = factors
+    return np.einsum("ij,ij->i", C, c @ a + s @ b) + np.einsum("ij,ij->i", S, c @ b - s @ a)
+
+def split_width(num_terms: int) -> int:
+    return int(np.ceil(np.sqrt(num_terms + 1)))
+
+def split_harmonics(theta: np.ndarray, width: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """cos and sin of r*theta and of q*width*theta for r, q < width, which make up every harmonic below width²."""
+    # cos(nθ) = cos(qwθ)cos(rθ) - sin(qwθ)sin(rθ) and sin(nθ) = sin(qwθ)cos(rθ) + cos(qwθ)sin(rθ) for n = qw + r,
+    # so about 2√n cos and sin calls per sample cover n harmonics and the rest is products
+    inner = np.outer(theta, np.arange(width))
+    outer = np.outer(theta, np.arange(width) * width)
+    return np.cos(inner), np.sin(inner), np.cos(outer), np.sin(outer)
+
+def cached_harmonics(t: np.ndarray, T: float, width: int) -> Optional[Tuple[np.ndarray, ...]]:
+    """split_harmonics of t, kept for the next evaluation on the same grid; None when t is too long to keep."""
+    nbytes = 8 * 4 * width * len(t)
+    if nbytes > FOURIER_CACHE_BYTES:
+        return None
+    key = (hash(t.tobytes()), len(t), float(T), width)
+    if key in harmonics_cache:
+        harmonics_cache[key] = harmonics_cache.pop(key)  # most recently used goes last
+        return harmonics_cache[key]
+    while harmonics_cache and nbytes + sum(8 * f[0].size * 4 for f in harmonics_cache.values()) > FOURIER_CACHE_BYTES:
+        harmonics_cache.pop(next(iter(harmonics_cache)))
+    harmonics_cache[key] = split_harmonics((2 * np.pi / T) * t, width)
+    return harmonics_cache[key]
+
+def fourier_basis(t: np.ndarray, T: float, num_terms: int) -> np.ndarray:
+    """Design matrix of the series, columns in the coefficient order [1, cos 1, sin 1, cos 2, sin 2, ...]."""
+    T = max(T, 1e-6)
+    c, s, C, S = split_harmonics((2 * np.pi / T) * np.asarray(t), split_width(num_terms))
+    basis = np.empty((len(t), 2*num_terms + 1))
+    basis[:, 0] = 1.0
+    basis[:, 1::2] = (C[:, :, None]*c[:, None, :] - S[:, :, None]*s[:, None, :]).reshape(len(t), -1)[:, 1:num_terms + 1]
+    basis[:, 2::2] = (S[:, :, None]*c[:, None, :] + C[:, :, None]*s[:, None, :]).reshape(len(t), -1)[:, 1:num_terms + 1]
+    return basis
+
+def is_uniform_period(t: np.ndarray, T: float, num_terms: int) -> bool:
+    """Whether t is k*T/M for k = 0..M with every harmonic below the Nyquist frequency, so the FFT path applies."""
+    m = len(t) - 1
+    if m < 2 or 2*num_terms >= m or t[0] != 0 or T <= 0:
+        return False
+    return np.allclose(np.diff(t), T / m, rtol=1e-6, atol=0)
+
+def fit_fourier_fft(y: np.ndarray, num_terms: int, regularization: float = 0.0) -> np.ndarray:
+    """Exact least-squares coefficients for uniform samples spanning one period, from a single real FFT."""
+    # The first M samples are one full period, where the basis columns are orthogonal and A^T A is diagonal.
+    # The last sample repeats the phase of the first and adds the rank-one term v v^T, v = [1, 1, 0, 1, 0, ...],
+    # which Sherman-Morrison solves in closed form.
+    m = len(y) - 1
+    spectrum = np.fft.rfft(y[:m])[:num_terms + 1]
+    rhs = np.empty(2*num_terms + 1)
+    rhs[0] = spectrum[0].real + y[-1]
+    rhs[1::2] = spectrum[1:].real + y[-1]
+    rhs[2::2] = -spectrum[1:].imag
+    diag = np.full(2*num_terms + 1, m / 2 + regularization)
+    diag[0] = m
+    v = np.zeros(2*num_terms + 1)
+    v[0] = 1.0
+    v[1::2] = 1.0
+    coeffs, w = rhs / diag, v / diag
+    return coeffs - w * (v @ coeffs) / (1.0 + v @ w)
+
+def fit_fourier(t: np.ndarray, y: np.ndarray, num_terms: int = 10,
+                regularization: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
     """Fit Fourier series to data and return coefficients and fitted values."""
+    # The series is linear in its coefficients, so this is one linear least-squares solve
     T = t[-1] if len(t) > 0 else 1.0
-    initial_guess = [np.mean(y)] + [0.0] * (2 * num_terms)
-    popt, _ = curve_fit(
-        lambda t_, *coeffs: fourier_series(t_, T, *coeffs),
-        t, y, p0=initial_guess, maxfev=10000
-    )
-    return popt, fourier_series(t, T, *popt)
+    y = np.asarray(y, dtype=np.float64)
+    if is_uniform_period(t, T, num_terms):
+        coeffs = fit_fourier_fft(y, num_terms, regularization)
+    else:
+        basis = fourier_basis(t, T, num_terms)
+        if regularization > 0:
+            # Ridge rows for every coefficient but the mean
+            basis = np.vstack([basis, np.sqrt(regularization) * np.eye(2*num_terms + 1)[1:]])
+            y = np.concatenate([y, np.zeros(2*num_terms)])
+        # With fewer samples than coefficients this is the minimum-norm solution
+        coeffs = np.linalg.lstsq(basis, y, rcond=None)[0]
+    return coeffs, fourier_series(t, T, *coeffs)
 
-def plot_fourier_comparison(vid_data: LEDData, sim_data: List[PendulumData], 
-                            arm_num: int, num_terms: int = 499) -> None:
+def plot_fourier_comparison(vid_data: Trajectory, sim_data: Trajectory, 
+                            arm_num: int, num_terms: int = 499, alignment: Optional[Alignment] = None) -> None:
     """Plot Fourier series comparison between video and simulation data for a single arm."""
-    vid_t, vid_ang, sim_t, sim_ang = process_arm(vid_data, sim_data)
-    vid_coeffs, vid_fit = fit_fourier(vid_t, vid_ang, num_terms)
-    sim_coeffs, sim_fit = fit_fourier(sim_t, sim_ang, num_terms)
+    vid_t, vid_ang, sim_t, sim_ang = process_arm(vid_data, sim_data, alignment)
+    vid_coeffs, vid_fit = fit_fourier(vid_t, vid_ang, num_terms, CONFIG["fourier_regularization"])
+    sim_coeffs, sim_fit = fit_fourier(sim_t, sim_ang, num_terms, CONFIG["fourier_regularization"])
 
     fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(30, 16), sharex=True)
     ax1.scatter(vid_t, vid_ang, s=10, color='blue', alpha=0.5, label='Video Data')
@@ -208,13 +417,22 @@ def plot_fourier_comparison(vid_data: LEDData, sim_data: List[PendulumData],
     plt.show()
 
 def main():
-    sim_data = load_saved_data()
-    arm1, arm2 = process_pendulum_data(sim_data)
-    pivot, first_led, second_led = load_saved_vid_data()
+    with profiling.stage("load"):
+        sim_data = load_saved_data()
+        pivot, first_led, second_led = load_saved_vid_data()
+    with profiling.stage("process"):
+        if "dense" in sim_data:
+            # Put the simulation on the video's frame rate instead of its own num_points grid
+            sim_data = resample_simulation(sim_data, np.median(np.diff(first_led.time)))
+        arm1, arm2 = process_pendulum_data(sim_data)
+    with profiling.stage("align"):
+        alignment = get_alignment(first_led, second_led, arm1, arm2)
 
-    plot_fourier_comparison(first_led, arm1, arm_num=1)
-    plot_fourier_comparison(second_led, arm2, arm_num=2)
-    plot_deviation(arm1, arm2, first_led, second_led)
+    with profiling.stage("fourier_comparison"):
+        plot_fourier_comparison(first_led, arm1, arm_num=1, alignment=alignment)
+        plot_fourier_comparison(second_led, arm2, arm_num=2, alignment=alignment)
+    with profiling.stage("deviation"):
+        plot_deviation(arm1, arm2, first_led, second_led, alignment)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
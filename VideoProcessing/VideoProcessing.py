@@ -2,9 +2,19 @@ import cv2
 import math
 import matplotlib.pyplot as plt
 import os
-import json
+import queue
+import sys
+import threading
 import numpy as np
-from typing import Tuple, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from scipy.interpolate import CubicSpline
+from typing import Iterable, Iterator, List, Tuple, Optional
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Simulations"))
+import profiling
+from tracklog import TrackLog, load_text_data
+from trajectory import Trajectory
 
 CONFIG = {
     "video_name": "DSC_0058",
@@ -13,18 +23,69 @@ CONFIG = {
     "path_to_videos": "C:\\Users\\adamf\\OneDrive\\Desktop\\IPL\\Double Pendulum\\Videos\\",
     "path_to_data": "C:\\Users\\adamf\\Downloads\\",
     "proc_outpath": "./VideoProcessing/processing_outfiles/",
-    "video_extension": ".AVI"
+    "video_extension": ".AVI",
+    # Split the video into frame ranges tracked by a process pool instead of one frame at a time
+    # (no preview window). Needs a format that seeks exactly, like the camera's MJPEG AVIs.
+    "parallel": False,
+    "workers": os.cpu_count(),
+    "chunk_overlap": 30,    # frames each chunk re-tracks from the end of the one before it
+    # Only look for LEDs within reach of the pivot, and first in a window around each LED's last position
+    "roi": True,
+    "search_window": 0.5,   # half-width of those windows as a fraction of the first arm's length, 0 to skip them
+                            # ("predictive" sizes them from its gates instead, so only 0 or not matters there)
+    # Headless runs make no GUI calls at all, so the points can't be clicked and must be set in "points"
+    "headless": False,
+    "points": None,         # ((pivot x, y), (LED 1 x, y), (LED 2 x, y)) to skip selecting them on the first frame
+    "preview_every": 1,     # show every Nth frame while tracking, 0 for never
+    "save_annotated": False,    # write the frames with the LED overlays to "<video_name> - Annotated.avi"
+    "writer_queue": 64,     # annotated frames the writer thread may fall behind before tracking waits for it
+    "prefetch": 8,          # frames a decoder thread may read ahead of the tracking, 0 to decode on the tracking thread
+    "decode_gray": False,   # convert to grayscale on the decoder thread too (annotated frames are then gray)
+    # "predictive" only looks for each LED near where its motion says it should be; "proximity" is the
+    # original rule of a ±20 px band around the first arm's length plus the closest previous position
+    "tracker": "predictive",
+    "motion_model": "pendulum",     # or "constant_velocity"
+    "gate": 0.3,            # radius around each prediction that detections are accepted in, as a fraction of the first
+                            # arm's length, plus however far the LED moved in the last frame
+    "subpixel": True,       # intensity-weighted centroids instead of whole-pixel contour centres
+    "log_batch": 256        # frames tracked between commits to the track log, so at most this many are lost in a crash
 }
 
+# Settings that change the tracked positions, passed to workers and keyed on by the results cache
+TRACKING_SETTINGS = ("brightness_value", "roi", "search_window", "tracker", "motion_model", "gate", "subpixel")
+
 Point = Tuple[int, int]
-LEDData = List[Tuple[float, float, Point]]
+Rect = Tuple[int, int, int, int]    # x0, y0, x1, y1 with the ends excluded
+ROI_MARGIN = 20
+LED_MARGIN = 10     # added to a gate so a LED whose centre is inside it isn't cut off by the search window
+MISS_COST = 2.0     # association cost of not finding a LED; a detection on the edge of its gate costs 1
+LENGTH_TOLERANCE = 0.1  # typical error of a measured arm length, as a fraction of the first arm's length
+# Per-frame flags of each LED's position
+MEASURED, OCCLUDED, INTERPOLATED = 0, 1, 2
+# Frame indices, the (N, 2, 2) LED positions tracked in them and the (N, 2) flags of those positions
+Chunk = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+def get_tracking_settings() -> dict:
+    return {key: CONFIG[key] for key in TRACKING_SETTINGS}
 
 def get_data_path() -> str:
     return f"{CONFIG['path_to_data']}{CONFIG['video_name']}.txt"
 
+def get_log_path() -> str:
+    return f"{CONFIG['path_to_data']}{CONFIG['video_name']}.track"
+
 def get_video_path() -> str:
     return f"{CONFIG['path_to_videos']}{CONFIG['video_name']}{CONFIG['video_extension']}"
 
+def get_annotated_path() -> str:
+    return f"{CONFIG['proc_outpath']}{CONFIG['video_name']} - Annotated.avi"
+
+def show_plot() -> None:
+    if CONFIG["headless"]:
+        plt.close()
+    else:
+        plt.show()
+
 def select_point(image: np.ndarray, window_title: str) -> Optional[Point]:
     selected_point = None
     def callback(event, x, y, *args):
@@ -39,57 +100,162 @@ def select_point(image: np.ndarray, window_title: str) -> Optional[Point]:
     cv2.destroyAllWindows()
     return selected_point
 
-def load_saved_data() -> Tuple[Point, LEDData, LEDData]:
-    with open(get_data_path(), "r") as f:
-        pivot, first_led, second_led = None, [], []
-        for line in f:
-            key, value = line.split(":", 1)
-            if key == "Pivot":
-                pivot = json.loads(value)
-            elif key == "firstLED":
-                first_led = json.loads(value)
-            elif key == "secondLED":
-                second_led = json.loads(value)
-        return pivot, first_led, second_led
-
-def save_data(pivot: Point, first_led: LEDData, second_led: LEDData) -> None:
-    with open(get_data_path(), "w") as f:
-        f.write(f"Pivot:{json.dumps(pivot)}\n")
-        f.write(f"firstLED:{json.dumps(first_led)}\n")
-        f.write(f"secondLED:{json.dumps(second_led)}\n")
+def get_points(frame: np.ndarray) -> Tuple[Point, Point, Point]:
+    if CONFIG["points"] is not None:
+        return tuple(tuple(point) for point in CONFIG["points"])
+    if CONFIG["headless"]:
+        raise ValueError("Headless tracking needs the pivot and LED positions in CONFIG['points']")
+    return (
+        select_point(frame, "Select Pivot Point"),
+        select_point(frame, "Select first LED"),
+        select_point(frame, "Select second LED")
+    )
+
+def load_saved_data() -> Tuple[Point, Trajectory, Trajectory]:
+    if TrackLog.exists(get_log_path()):
+        log = TrackLog.open(get_log_path())
+        return (tuple(log.header["pivot"]), *log.trajectories())
+    # Text files written before the track log
+    return load_text_data(get_data_path())
+
+def led_contours(contours: List[np.ndarray]) -> Iterator[Tuple[np.ndarray, Point]]:
+    for cnt in filter(lambda c: 5 < cv2.contourArea(c) < 500, contours):
+        M = cv2.moments(cnt)
+        if M["m00"] == 0:
+            continue
+        yield cnt, (int(M["m10"]/M["m00"]), int(M["m01"]/M["m00"]))
+
+def find_leds(frame: np.ndarray, brightness: int) -> Iterator[Tuple[np.ndarray, Point]]:
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    _, thresh = cv2.threshold(gray, brightness, 255, cv2.THRESH_BINARY)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return led_contours(contours)
+
+def clip_rect(rect: Rect, bounds: Rect) -> Rect:
+    return (max(rect[0], bounds[0]), max(rect[1], bounds[1]), min(rect[2], bounds[2]), min(rect[3], bounds[3]))
+
+class LedDetector:
+    # find_leds restricted to a region of interest, reusing the same grayscale and binary images every frame.
+    # Both LEDs stay within two first-arm lengths of the pivot, so nothing outside that square is converted
+    # or thresholded. With a search window, only the area around each LED's last position is searched, and
+    # the whole region (then the whole frame) only when that doesn't turn up both LEDs.
+    def __init__(self, shape: Tuple[int, ...], reference: Point, arm_length: float, brightness: int,
+                 roi: bool = True, search_window: float = 0.0, subpixel: bool = False):
+        height, width = shape[:2]
+        self.frame_rect = (0, 0, width, height)
+        reach = int(2 * arm_length) + ROI_MARGIN
+        self.roi = clip_rect(
+            (reference[0] - reach, reference[1] - reach, reference[0] + reach + 1, reference[1] + reach + 1),
+            self.frame_rect
+        ) if roi else self.frame_rect
+        self.window = int(search_window * arm_length)
+        self.brightness = brightness
+        self.subpixel = subpixel
+        # Every search region works in the top-left corner of these
+        self.gray = np.empty((height, width), dtype=np.uint8)
+        self.thresh = np.empty((height, width), dtype=np.uint8)
+
+    def find(self, frame: np.ndarray, rect: Rect, whole: bool = False) -> List[Tuple[np.ndarray, Point]]:
+        x0, y0, x1, y1 = rect
+        thresh = self.thresh[:y1-y0, :x1-x0]
+        if frame.ndim == 3:
+            gray = self.gray[:y1-y0, :x1-x0]
+            cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY, dst=gray)
+        else:
+            gray = frame[y0:y1, x0:x1]
+        cv2.threshold(gray, self.brightness, 255, cv2.THRESH_BINARY, dst=thresh)
+        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0))
+        leds = led_contours(contours)
+        if whole:
+            # A LED cut off by the edge of a search window would have its centroid pulled inwards
+            leds = filter(lambda led: not self.touches_edge(led[0], rect), leds)
+        if self.subpixel:
+            leds = ((cnt, weighted_centroid(cnt, gray, thresh, (x0, y0))) for cnt, _ in leds)
+        return list(leds)
+
+    def touches_edge(self, contour: np.ndarray, rect: Rect) -> bool:
+        x, y, w, h = cv2.boundingRect(contour)
+        return ((x <= rect[0] and rect[0] > 0) or (y <= rect[1] and rect[1] > 0)
+                or (x + w >= rect[2] and rect[2] < self.frame_rect[2])
+                or (y + h >= rect[3] and rect[3] < self.frame_rect[3]))
+
+    def search_windows(self, around: Tuple[Point, Point], w: int) -> List[Rect]:
+        rects = [clip_rect((int(x) - w, int(y) - w, int(x) + w + 1, int(y) + w + 1), self.roi) for x, y in around]
+        # A prediction outside the region of interest leaves an empty window
+        rects = [rect for rect in rects if rect[0] < rect[2] and rect[1] < rect[3]]
+        if len(rects) < 2:
+            return rects
+        a, b = rects
+        if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+            # Overlapping windows are searched as one, so no LED is found twice
+            return [(min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))]
+        return rects
+
+    def detect(self, frame: np.ndarray, around: Optional[Tuple[Point, Point]] = None,
+               window: Optional[int] = None) -> List[Tuple[np.ndarray, Point]]:
+        window = self.window if window is None else window
+        if window > 0 and around is not None:
+            leds = [led for rect in self.search_windows(around, window) for led in self.find(frame, rect, whole=True)]
+            if len(leds) >= 2:
+                return leds
+        leds = self.find(frame, self.roi)
+        if len(leds) < 2 and self.roi != self.frame_rect:
+            leds = self.find(frame, self.frame_rect)
+        return leds
+
+def weighted_centroid(contour: np.ndarray, gray: np.ndarray, thresh: np.ndarray, origin: Tuple[int, int]) -> Tuple[float, float]:
+    # Brightness-weighted mean of the thresholded pixels in the contour's bounding box. gray and thresh
+    # cover the search region, whose top-left corner is origin in frame coordinates.
+    x, y, w, h = cv2.boundingRect(contour)
+    rows = slice(y - origin[1], y - origin[1] + h)
+    cols = slice(x - origin[0], x - origin[0] + w)
+    weights = np.where(thresh[rows, cols] > 0, gray[rows, cols], 0).astype(np.float32)
+    M = cv2.moments(weights)
+    return x + M["m10"]/M["m00"], y + M["m01"]/M["m00"]
+
+def make_detector(shape: Tuple[int, ...], reference: Point, arm_length: float, settings: Optional[dict] = None) -> LedDetector:
+    settings = settings or get_tracking_settings()
+    return LedDetector(shape, reference, arm_length, settings["brightness_value"], settings["roi"],
+                       settings["search_window"], settings["subpixel"])
 
 def process_frame(
     frame: np.ndarray,
     reference: Point,
     prev_pos: Tuple[Point, Point],
     brightness: int,
-    arm_length: float
+    arm_length: float,
+    annotate: bool = False,
+    detector: Optional[LedDetector] = None
 ) -> Tuple[np.ndarray, Tuple[Point, Point]]:
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    _, thresh = cv2.threshold(gray, brightness, 255, cv2.THRESH_BINARY)
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
+    leds = find_leds(frame, brightness) if detector is None else detector.detect(frame, prev_pos)
+    current = assign_leds(frame, leds, reference, prev_pos, arm_length, annotate)
+    current = [prev if curr is None else curr for curr, prev in zip(current, prev_pos)]
+    return frame, current
+
+def assign_leds(
+    frame: np.ndarray,
+    leds: Iterable[Tuple[np.ndarray, Point]],
+    reference: Point,
+    prev_pos: Tuple[Point, Point],
+    arm_length: float,
+    annotate: bool = False
+) -> List[Optional[Point]]:
     current = [None, None]
-    for cnt in filter(lambda c: 5 < cv2.contourArea(c) < 500, contours):
-        M = cv2.moments(cnt)
-        if M["m00"] == 0:
-            continue
-        cX, cY = int(M["m10"]/M["m00"]), int(M["m01"]/M["m00"])
-        
+    for cnt, (cX, cY) in leds:
         dist_pivot = math.hypot(cX - reference[0], cY - reference[1])
         dist_prev = [math.hypot(cX - p[0], cY - p[1]) for p in prev_pos]
         
         if (arm_length-20 <= dist_pivot <= arm_length+20) and (dist_prev[0] < dist_prev[1] + 20):
             current[0] = (cX, cY)
-            put_text_outline(frame, "LED1", (100, 100), (255, 255, 255), (0, 0, 0))
-            put_box_outline(frame, cnt, (255, 255, 255), (0, 0, 0))
+            if annotate:
+                put_text_outline(frame, "LED1", (100, 100), (255, 255, 255), (0, 0, 0))
+                put_box_outline(frame, cnt, (255, 255, 255), (0, 0, 0))
         else:
             current[1] = (cX, cY)
-            put_text_outline(frame, "LED2", (100, 120), (0, 0, 0), (255, 255, 255))
-            put_box_outline(frame, cnt, (0, 0, 0), (255, 255, 255))
-
-    current = [prev if curr is None else curr for curr, prev in zip(current, prev_pos)]
-    return frame, current
+            if annotate:
+                put_text_outline(frame, "LED2", (100, 120), (0, 0, 0), (255, 255, 255))
+                put_box_outline(frame, cnt, (0, 0, 0), (255, 255, 255))
+    return current
 
 def put_text_outline(
     img: np.ndarray,
@@ -111,62 +277,532 @@ def put_box_outline(
     cv2.rectangle(img, (x, y), (x+w+8, y+h+8), bg, 5)
     cv2.rectangle(img, (x, y), (x+w+8, y+h+8), fg, 2)
 
-def process_video() -> Tuple[Point, LEDData, LEDData]:
-    cap = cv2.VideoCapture(get_video_path())
-    ret, frame = cap.read()
-    if not ret:
-        raise ValueError("Failed to read video")
+class AnnotatedVideoWriter:
+    # Encodes on a background thread so tracking only waits when the bounded queue is full
+    def __init__(self, path: str, fps: float, size: Tuple[int, int], max_queue: int):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, size)
+        if not self.writer.isOpened():
+            raise RuntimeError(f"Could not open {path} for writing")
+        self.frames = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
 
-    reference = select_point(frame, "Select Pivot Point")
-    first_point = select_point(frame, "Select first LED")
-    second_point = select_point(frame, "Select second LED")
-    arm_length = math.hypot(first_point[0]-reference[0], first_point[1]-reference[1])
+    def run(self) -> None:
+        while (frame := self.frames.get()) is not None:
+            self.writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR) if frame.ndim == 2 else frame)
+        self.writer.release()
 
-    prev_pos = [first_point, second_point]
-    first_led, second_led = [], []
-    fps = cap.get(cv2.CAP_PROP_FPS)
+    def write(self, frame: np.ndarray) -> None:
+        self.frames.put(frame)
+
+    def close(self) -> None:
+        self.frames.put(None)
+        self.thread.join()
+
+class FramePrefetcher:
+    # Decodes on a background thread into a fixed ring of frame buffers while the caller tracks. Iterating
+    # gives (frame index, frame); a frame's buffer is handed back to the decoder on the next iteration,
+    # so anything kept longer than that has to be copied. OpenCV releases the GIL while decoding, so the
+    # two really do overlap.
+    def __init__(self, cap: cv2.VideoCapture, shape: Tuple[int, ...], first_index: int,
+                 stop: Optional[int] = None, depth: int = 8, gray: bool = False):
+        self.cap = cap
+        self.first_index = first_index
+        self.stop = stop
+        self.gray = gray
+        self.shape = shape
+        self.buffers = [np.empty(shape[:2] if gray else shape, dtype=np.uint8) for _ in range(depth)]
+        self.free = queue.Queue()
+        for slot in range(depth):
+            self.free.put(slot)
+        self.filled = queue.Queue()
+        self.current = None
+        # decode_stalls: the decoder found every buffer still in use, so tracking is the bottleneck.
+        # track_stalls: the tracker found no decoded frame waiting, so decoding is.
+        self.frames = 0
+        self.queue_depth_total = 0
+        self.decode_stalls = 0
+        self.track_stalls = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        scratch = np.empty(self.shape, dtype=np.uint8) if self.gray else None
+        index = self.first_index
+        while self.stop is None or index < self.stop:
+            if self.free.empty():
+                self.decode_stalls += 1
+            slot = self.free.get()
+            if slot is None:
+                break
+            ret, _ = self.cap.read(scratch if self.gray else self.buffers[slot])
+            if not ret:
+                break
+            if self.gray:
+                cv2.cvtColor(scratch, cv2.COLOR_BGR2GRAY, dst=self.buffers[slot])
+            self.filled.put((index, slot))
+            index += 1
+        self.filled.put(None)
+
+    def __iter__(self) -> "FramePrefetcher":
+        return self
+
+    def __next__(self) -> Tuple[int, np.ndarray]:
+        if self.current is not None:
+            self.free.put(self.current)
+            self.current = None
+        self.queue_depth_total += self.filled.qsize()
+        if self.filled.empty():
+            self.track_stalls += 1
+        item = self.filled.get()
+        if item is None:
+            self.filled.put(None)   # stay exhausted
+            raise StopIteration
+        index, self.current = item
+        self.frames += 1
+        return index, self.buffers[self.current]
 
-    while cap.isOpened():
+    def close(self) -> None:
+        self.free.put(None)
+        self.thread.join()
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "buffers": len(self.buffers),
+            "mean_queue_depth": self.queue_depth_total / max(self.frames, 1),
+            "decode_stalls": self.decode_stalls,
+            "track_stalls": self.track_stalls
+        }
+
+def read_frames(cap: cv2.VideoCapture, first_index: int, stop: Optional[int] = None) -> Iterator[Tuple[int, np.ndarray]]:
+    index = first_index
+    while stop is None or index < stop:
         ret, frame = cap.read()
         if not ret:
             break
+        yield index, frame
+        index += 1
 
-        frame, current = process_frame(frame, reference, prev_pos, CONFIG["brightness_value"], arm_length)
-        time_val = cap.get(cv2.CAP_PROP_POS_FRAMES) / fps
-        
-        theta1 = math.atan2(current[0][0]-reference[0], current[0][1]-reference[1])
-        theta2 = math.atan2(current[1][0]-current[0][0], current[1][1]-current[0][1])
-        
-        first_led.append((time_val, theta1, current[0]))
-        second_led.append((time_val, theta2, current[1]))
-        prev_pos = current
+def open_frames(cap: cv2.VideoCapture, first_index: int, stop: Optional[int] = None,
+                prefetch: int = 0, gray: bool = False) -> Iterable[Tuple[int, np.ndarray]]:
+    if prefetch <= 0:
+        return read_frames(cap, first_index, stop)
+    shape = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+    return FramePrefetcher(cap, shape, first_index, stop, prefetch, gray)
 
-        cv2.imshow("Processing", frame)
-        if cv2.waitKey(30) == 27:
-            break
+def close_frames(frames: Iterable[Tuple[int, np.ndarray]]) -> None:
+    if isinstance(frames, FramePrefetcher):
+        frames.close()
+        print("Prefetch: " + ", ".join(f"{key} {value:.3g}" for key, value in frames.stats().items()))
+        profiling.add_counters("prefetch", frames.stats())
+
+class ProximityTracker:
+    # The original assignment of process_frame; a LED that isn't found keeps its previous position
+    def __init__(self, reference: Point, start_pos: Tuple[Point, Point], arm_length: float, detector: LedDetector):
+        self.reference = reference
+        self.positions = list(start_pos)
+        self.arm_length = arm_length
+        self.detector = detector
+
+    def update(self, frame: np.ndarray, annotate: bool = False) -> Tuple[List[Point], List[int]]:
+        leds = self.detector.detect(frame, self.positions)
+        current = assign_leds(frame, leds, self.reference, self.positions, self.arm_length, annotate)
+        flags = [OCCLUDED if curr is None else MEASURED for curr in current]
+        self.positions = [prev if curr is None else curr for curr, prev in zip(current, self.positions)]
+        return self.positions, flags
+
+    def restore(self, positions: np.ndarray, flags: np.ndarray) -> None:
+        # Only the last positions carry over from one frame to the next
+        if len(positions):
+            self.positions = [tuple(point) for point in positions[-1].tolist()]
+
+class PredictiveTracker:
+    # Predicts where each LED will be from its last two positions and only accepts a detection within
+    # a gate around that prediction. The "pendulum" model carries both arm angles forward at their
+    # current angular velocities, so predictions follow the arcs; "constant_velocity" extrapolates in
+    # pixels. Of the detections in the gates, the pair closest to the predictions that also keeps both
+    # arms at their measured lengths is taken. A LED with no detection in its gate is coasted along its
+    # prediction and flagged OCCLUDED, and its gate widens every frame it stays missing.
+    def __init__(self, reference: Point, start_pos: Tuple[Point, Point], arm_length: float, detector: LedDetector,
+                 motion_model: str = "pendulum", gate: float = 0.3):
+        if motion_model not in ("pendulum", "constant_velocity"):
+            raise ValueError(f"Unknown motion model: {motion_model}")
+        self.reference = np.array(reference, dtype=np.float64)
+        self.positions = np.array(start_pos, dtype=np.float64)
+        self.previous = None
+        self.arm_length = arm_length
+        self.detector = detector
+        self.motion_model = motion_model
+        self.gate = gate * arm_length
+        self.length_tolerance = LENGTH_TOLERANCE * arm_length
+        self.missed = np.zeros(2, dtype=np.int64)
+        self.lengths = self.arm_lengths(self.positions)
+
+    def joints(self, positions: np.ndarray) -> np.ndarray:
+        return np.stack([self.reference, positions[0]])
+
+    def arm_lengths(self, positions: np.ndarray) -> np.ndarray:
+        return np.linalg.norm(positions - self.joints(positions), axis=1)
+
+    def arm_angles(self, positions: np.ndarray) -> np.ndarray:
+        # Same convention as the saved angles: 0 hanging straight down, measured from each arm's own joint
+        d = positions - self.joints(positions)
+        return np.arctan2(d[:, 0], d[:, 1])
+
+    def predict(self) -> np.ndarray:
+        if self.previous is None:
+            return self.positions.copy()
+        if self.motion_model == "constant_velocity":
+            return 2*self.positions - self.previous
+        theta = self.arm_angles(self.positions)
+        omega = (theta - self.arm_angles(self.previous) + np.pi) % (2*np.pi) - np.pi
+        theta = theta + omega
+        first = self.reference + self.lengths[0] * np.array([np.sin(theta[0]), np.cos(theta[0])])
+        second = first + self.lengths[1] * np.array([np.sin(theta[1]), np.cos(theta[1])])
+        return np.stack([first, second])
+
+    def gates(self) -> np.ndarray:
+        if self.previous is None:
+            # No velocity yet, so the first frame can only rely on being near the starting positions
+            return np.full(2, self.arm_length)
+        # Chaotic swings change speed a lot within one frame, so faster LEDs get proportionally wider gates
+        speed = np.linalg.norm(self.positions - self.previous, axis=1)
+        return np.minimum((self.gate + speed) * (1 + self.missed), 2 * self.arm_length)
+
+    def associate(self, points: np.ndarray, predicted: np.ndarray, gates: np.ndarray) -> List[Optional[int]]:
+        dist = np.linalg.norm(points[None, :, :] - predicted[:, None, :], axis=2)
+        options = [[None] + [j for j in range(len(points)) if dist[i, j] <= gates[i]] for i in range(2)]
+
+        def cost(a: Optional[int], b: Optional[int]) -> float:
+            total = MISS_COST if a is None else (dist[0, a] / gates[0])**2
+            total += MISS_COST if b is None else (dist[1, b] / gates[1])**2
+            if a is not None:
+                length = np.linalg.norm(points[a] - self.reference)
+                total += ((length - self.lengths[0]) / self.length_tolerance)**2
+                if b is not None:
+                    length = np.linalg.norm(points[b] - points[a])
+                    total += ((length - self.lengths[1]) / self.length_tolerance)**2
+            return total
+
+        pairs = [(a, b) for a in options[0] for b in options[1] if a is None or a != b]
+        return list(min(pairs, key=lambda pair: cost(*pair)))
+
+    def update(self, frame: np.ndarray, annotate: bool = False) -> Tuple[np.ndarray, List[int]]:
+        predicted = self.predict()
+        gates = self.gates()
+        # The windows cover the gates rather than the configured size, but are still skipped when that is 0
+        window = int(gates.max()) + LED_MARGIN if self.detector.window > 0 else 0
+        leds = self.detector.detect(frame, predicted, window)
+        points = np.array([point for _, point in leds], dtype=np.float64).reshape(-1, 2)
+        matches = self.associate(points, predicted, gates)
+
+        current = predicted
+        flags = []
+        for i, j in enumerate(matches):
+            if j is None:
+                flags.append(OCCLUDED)
+            else:
+                current[i] = points[j]
+                flags.append(MEASURED)
+        self.advance(current, flags)
+
+        if annotate:
+            self.annotate(frame, leds, matches, current)
+        return current, flags
+
+    def advance(self, current: np.ndarray, flags: List[int]) -> None:
+        for i, flag in enumerate(flags):
+            self.missed[i] = self.missed[i] + 1 if flag == OCCLUDED else 0
+        if not self.missed.any():
+            # Smooth out the measured arm lengths, which the pendulum model predicts with
+            self.lengths = 0.9*self.lengths + 0.1*self.arm_lengths(current)
+        self.previous, self.positions = self.positions, current
+
+    def restore(self, positions: np.ndarray, flags: np.ndarray) -> None:
+        # Replays the tracked frames through the same state updates, so a resumed run continues exactly
+        # where the earlier one stopped
+        for current, status in zip(positions, flags):
+            self.advance(np.array(current, dtype=np.float64), status.tolist())
+
+    def annotate(self, frame: np.ndarray, leds: list, matches: List[Optional[int]], current: np.ndarray) -> None:
+        styles = [("LED1", (100, 100), (255, 255, 255), (0, 0, 0)), ("LED2", (100, 120), (0, 0, 0), (255, 255, 255))]
+        for (label, pos, fg, bg), j, point in zip(styles, matches, current):
+            if j is None:
+                put_text_outline(frame, f"{label} (predicted)", pos, fg, bg)
+                cv2.circle(frame, (int(point[0]), int(point[1])), 8, bg, 5)
+                cv2.circle(frame, (int(point[0]), int(point[1])), 8, fg, 2)
+            else:
+                put_text_outline(frame, label, pos, fg, bg)
+                put_box_outline(frame, leds[j][0], fg, bg)
+
+def make_tracker(reference: Point, start_pos: Tuple[Point, Point], arm_length: float, detector: LedDetector,
+                 settings: Optional[dict] = None):
+    settings = settings or get_tracking_settings()
+    if settings["tracker"] == "proximity":
+        return ProximityTracker(reference, start_pos, arm_length, detector)
+    if settings["tracker"] == "predictive":
+        return PredictiveTracker(reference, start_pos, arm_length, detector, settings["motion_model"], settings["gate"])
+    raise ValueError(f"Unknown tracker: {settings['tracker']}")
+
+def interpolate_occlusions(reference: Point, frames: np.ndarray, positions: np.ndarray,
+                           flags: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Coasted positions between two measured ones are redone with a cubic spline through the arm's angle
+    # about its joint (and a linear one through its length), which follows the swing much better than a
+    # straight line between pixel positions; a LED still missing at
+    # the end of the video keeps its predictions. LED 1 goes first, since it is LED 2's joint.
+    positions, flags = positions.copy(), flags.copy()
+    for led in range(2):
+        joints = np.broadcast_to(np.asarray(reference, dtype=np.float64), (len(frames), 2)) if led == 0 else positions[:, 0]
+        measured = np.flatnonzero(flags[:, led] == MEASURED)
+        if len(measured) < 2:
+            continue
+        gaps = np.flatnonzero(flags[measured[0]:measured[-1], led] != MEASURED) + measured[0]
+        if not len(gaps):
+            continue
+        # Unwrapped through the coasted predictions too, so a fast arm turns the way it was heading
+        arm = positions[:, led] - joints
+        angles = np.unwrap(np.arctan2(arm[:, 0], arm[:, 1]))
+        angle = CubicSpline(frames[measured], angles[measured])(frames[gaps])
+        length = np.interp(frames[gaps], frames[measured], np.linalg.norm(arm[measured], axis=1))
+        positions[gaps, led] = joints[gaps] + length[:, None] * np.stack([np.sin(angle), np.cos(angle)], axis=1)
+        flags[gaps, led] = INTERPOLATED
+    return positions, flags
 
+def seed_positions(frame: np.ndarray, reference: Point, brightness: int, arm_length: float) -> Optional[Tuple[Point, Point]]:
+    # Without a previous frame, LED 1 is the detection closest to the first arm's radius
+    leds = [point for _, point in find_leds(frame, brightness)]
+    if len(leds) < 2:
+        return None
+    leds.sort(key=lambda p: abs(math.hypot(p[0]-reference[0], p[1]-reference[1]) - arm_length))
+    return leds[0], leds[1]
+
+def track_chunk(
+    video_path: str,
+    seek: int,
+    stop: Optional[int],
+    reference: Point,
+    seed: Optional[Tuple[Point, Point]],
+    arm_length: float,
+    settings: dict,
+    prefetch: int = 0,
+    gray: bool = False
+) -> Chunk:
+    # Runs in a worker: tracks frames seek..stop-1 (or to the end), seeding from the first frame
+    # with two detections when no seed is given
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, seek)
+    frames, positions, flags = [], [], []
+    tracker = None
+    detector = None
+    source = open_frames(cap, seek, stop, prefetch, gray)
+    try:
+        for index, frame in source:
+            if detector is None:
+                detector = make_detector(frame.shape, reference, arm_length, settings)
+            if seed is None:
+                seed = seed_positions(frame, reference, settings["brightness_value"], arm_length)
+            if seed is not None and tracker is None:
+                tracker = make_tracker(reference, seed, arm_length, detector, settings)
+            if tracker is not None:
+                current, status = tracker.update(frame)
+                frames.append(index)
+                positions.append(current)
+                flags.append(status)
+    finally:
+        if isinstance(source, FramePrefetcher):
+            source.close()
+        cap.release()
+    return (np.array(frames, dtype=np.int64), np.array(positions, dtype=np.float64).reshape(-1, 2, 2),
+            np.array(flags, dtype=np.uint8).reshape(-1, 2))
+
+def stitch_chunks(chunks: List[Chunk]) -> Chunk:
+    # Join chunks in order, swapping a chunk's LEDs if its overlap matches the previous chunk the other way round
+    frames, positions, flags = chunks[0]
+    for chunk_frames, chunk_positions, chunk_flags in chunks[1:]:
+        overlap = chunk_frames <= (frames[-1] if len(frames) else -1)
+        _, ours_idx, previous_idx = np.intersect1d(chunk_frames, frames, assume_unique=True, return_indices=True)
+        if len(ours_idx):
+            previous = positions[previous_idx]
+            ours = chunk_positions[ours_idx]
+            same = np.linalg.norm(ours - previous, axis=2).sum()
+            swapped = np.linalg.norm(ours[:, ::-1] - previous, axis=2).sum()
+            if swapped < same:
+                chunk_positions = chunk_positions[:, ::-1]
+                chunk_flags = chunk_flags[:, ::-1]
+        elif len(frames) and len(chunk_frames) and chunk_frames[0] > frames[-1] + 1:
+            print(f"Warning: frames {frames[-1] + 1}-{chunk_frames[0] - 1} have no tracked LEDs")
+        frames = np.concatenate([frames, chunk_frames[~overlap]])
+        positions = np.concatenate([positions, chunk_positions[~overlap]])
+        flags = np.concatenate([flags, chunk_flags[~overlap]])
+    return frames, positions, flags
+
+def frame_times(frames: np.ndarray, fps: float) -> np.ndarray:
+    # Frame i is read when CAP_PROP_POS_FRAMES is i+1
+    return (frames + 1) / fps
+
+def finish_log(log: TrackLog) -> Tuple[Trajectory, Trajectory]:
+    # Gaps can only be filled once the LED has been found again, so this waits until the end of the video
+    frames, _, positions, flags = log.positions(mmap=False)
+    positions, flags = interpolate_occlusions(log.header["pivot"], frames, positions, flags)
+    log.rewrite(positions, flags)
+    log.commit(complete=True)
+    return log.trajectories()
+
+def track_video_parallel(
+    video_path: str,
+    reference: Point,
+    start_pos: Tuple[Point, Point],
+    arm_length: float,
+    workers: int
+) -> Chunk:
+    # Track frames 1 onwards in one chunk per worker and stitch the chunks back together
+    cap = cv2.VideoCapture(video_path)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     cap.release()
-    cv2.destroyAllWindows()
-    return reference, first_led, second_led
 
-def plot_pos_time(data1: LEDData, data2: LEDData, pivot: Point) -> None:
-    extract_x = lambda data: [p[2][0] for p in data]
-    extract_y = lambda data: [-p[2][1] for p in data]
-    extract_t = lambda data: [p[0] for p in data]
+    # Frame 0 is only used to select the points, as in the sequential path
+    bounds = np.linspace(1, frame_count, workers + 1).astype(int)
+    overlap = CONFIG["chunk_overlap"]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            last = i == workers - 1
+            futures.append(pool.submit(
+                track_chunk, video_path,
+                1 if i == 0 else max(1, int(start) - overlap),
+                None if last else int(stop),   # the frame count can be off, so the last chunk reads to the end
+                reference,
+                start_pos if i == 0 else None,
+                arm_length,
+                get_tracking_settings(),
+                CONFIG["prefetch"],
+                CONFIG["decode_gray"]
+            ))
+        return stitch_chunks([future.result() for future in futures])
+
+def report_flags(first_led: Trajectory, second_led: Trajectory) -> None:
+    for num, led in enumerate((first_led, second_led), 1):
+        if led.flags is not None:
+            occluded = np.count_nonzero(led.flags == OCCLUDED)
+            interpolated = np.count_nonzero(led.flags == INTERPOLATED)
+            print(f"LED {num}: {len(led)} frames, {interpolated} interpolated, {occluded} predicted past the last detection")
+
+def log_matches(log: TrackLog) -> bool:
+    # Logs converted from text files never recorded their video or settings; like the text files
+    # themselves, they are kept as they are instead of being tracked again
+    if log.complete and log.header.get("converted_from") is not None:
+        return True
+    return log.header["video"] == get_video_path() and log.header["settings"] == get_tracking_settings()
+
+def open_log(frame: np.ndarray, fps: float, path: str) -> TrackLog:
+    # Carries on with an unfinished log of this video, or starts a new one from the selected points
+    if TrackLog.exists(path):
+        log = TrackLog.open(path, writable=True)
+        if log_matches(log):
+            print(f"Resuming {path} after {log.rows} tracked frames")
+            return log
+        print(f"{path} was tracked from a different video or with different settings, starting over")
+    reference, first_point, second_point = get_points(frame)
+    return TrackLog.create(path, {
+        "video": get_video_path(),
+        "pivot": list(reference),
+        "points": [list(reference), list(first_point), list(second_point)],
+        "arm_length": math.hypot(first_point[0]-reference[0], first_point[1]-reference[1]),
+        "fps": fps,
+        "frame_size": [frame.shape[1], frame.shape[0]],
+        "settings": get_tracking_settings()
+    })
+
+def append_batch(log: TrackLog, frame_indices: List[int], positions: list, flags: list, fps: float) -> None:
+    if frame_indices:
+        frames = np.array(frame_indices, dtype=np.int64)
+        log.append(frames, frame_times(frames, fps), positions, flags)
+        frame_indices.clear()
+        positions.clear()
+        flags.clear()
 
+def process_video(log_path: Optional[str] = None) -> Tuple[Point, Trajectory, Trajectory]:
+    cap = cv2.VideoCapture(get_video_path())
+    ret, frame = cap.read()
+    if not ret:
+        raise ValueError("Failed to read video")
+
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    log = open_log(frame, fps, log_path or get_log_path())
+    reference, first_point, second_point = (tuple(point) for point in log.header["points"])
+    arm_length = log.header["arm_length"]
+
+    if CONFIG["parallel"]:
+        # Parallel runs don't commit as they go, so an unfinished log is tracked again from the start
+        cap.release()
+        frames, positions, flags = track_video_parallel(
+            get_video_path(), reference, (first_point, second_point), arm_length, CONFIG["workers"]
+        )
+        log = TrackLog.create(log.path, log.header)
+        log.append(frames, frame_times(frames, fps), positions, flags)
+        first_led, second_led = finish_log(log)
+        report_flags(first_led, second_led)
+        return reference, first_led, second_led
+
+    preview_every = 0 if CONFIG["headless"] else CONFIG["preview_every"]
+    detector = make_detector(frame.shape, reference, arm_length)
+    tracker = make_tracker(reference, (first_point, second_point), arm_length, detector)
+    # Frame 0 was read for selecting the points, so tracking starts at frame 1
+    first_index = 1
+    if log.rows:
+        tracked, _, tracked_positions, tracked_flags = log.positions()
+        tracker.restore(tracked_positions, tracked_flags)
+        first_index = int(tracked[-1]) + 1
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first_index)
+    writer = None
+    if CONFIG["save_annotated"]:
+        writer = AnnotatedVideoWriter(get_annotated_path(), fps, (frame.shape[1], frame.shape[0]), CONFIG["writer_queue"])
+
+    frames = open_frames(cap, first_index, prefetch=CONFIG["prefetch"], gray=CONFIG["decode_gray"])
+    frame_indices, positions, flags = [], [], []
+    try:
+        for index, frame in frames:
+            preview = preview_every > 0 and index % preview_every == 0
+            current, status = tracker.update(frame, annotate=preview or writer is not None)
+            frame_indices.append(index)
+            positions.append(current)
+            flags.append(status)
+            if len(frame_indices) >= CONFIG["log_batch"]:
+                append_batch(log, frame_indices, positions, flags, fps)
+
+            if writer is not None:
+                # The prefetcher reuses its buffers, while cap.read() hands back a new array every frame
+                writer.write(frame.copy() if isinstance(frames, FramePrefetcher) else frame)
+            if preview:
+                cv2.imshow("Processing", frame)
+                if cv2.waitKey(1) == 27:
+                    break
+    finally:
+        # Whatever was tracked before an error or interrupt is kept, so the next run resumes after it
+        append_batch(log, frame_indices, positions, flags, fps)
+        close_frames(frames)
+        cap.release()
+        if writer is not None:
+            writer.close()
+    if preview_every > 0:
+        cv2.destroyAllWindows()
+    first_led, second_led = finish_log(log)
+    report_flags(first_led, second_led)
+    return reference, first_led, second_led
+
+def plot_pos_time(data1: Trajectory, data2: Trajectory, pivot: Point) -> None:
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
     
-    ax.plot(extract_x(data1), extract_t(data1), extract_y(data1), 
-            color='b', label='LED 1')
-    
-    ax.plot(extract_x(data2), extract_t(data2), extract_y(data2), 
-            color='r', label='LED 2')
+    ax.plot(data1.x, data1.time, -data1.y, color='b', label='LED 1')
+    ax.plot(data2.x, data2.time, -data2.y, color='r', label='LED 2')
     
-    t_points = extract_t(data1)
-    ax.plot([pivot[0]]*len(t_points),  
+    t_points = data1.time
+    ax.plot(np.full(len(t_points), pivot[0]),  
             t_points, 
-            [ -pivot[1]]*len(t_points),
+            np.full(len(t_points), -pivot[1]),
             color='g', label='Pivot')
 
     ax.set_box_aspect((3, 7, 2))
@@ -175,21 +811,21 @@ def plot_pos_time(data1: LEDData, data2: LEDData, pivot: Point) -> None:
     ax.set_zlabel('Y Position')
     ax.legend()
     plt.savefig(f"{CONFIG['proc_outpath']}{CONFIG['video_name']} - 3D {CONFIG['graph_title']}.png")
-    plt.show()
+    show_plot()
 
-def plot_angles(data: LEDData, num: int) -> None:
+def plot_angles(data: Trajectory, num: int) -> None:
     plt.figure(figsize=(8, 6))
-    plt.plot([d[0] for d in data], [math.degrees(d[1]) for d in data], 'b')
+    plt.plot(data.time, np.degrees(data.angle), 'b')
     plt.xlabel("Time (seconds)")
     plt.ylabel("Angle (degrees)")
     plt.title(f"LED {num}: {CONFIG['graph_title']}")
     plt.grid(True)
-    plt.show()
+    show_plot()
 
-def plot_comparison(data1: LEDData, data2: LEDData) -> None:
+def plot_comparison(data1: Trajectory, data2: Trajectory) -> None:
     plt.figure(figsize=(30, 8))
-    plt.plot([d[0] for d in data1], [math.degrees(d[1]) for d in data1], color='b', label='LED 1')
-    plt.plot([d[0] for d in data2], [math.degrees(d[1]) for d in data2], color='r', label='LED 2')
+    plt.plot(data1.time, np.degrees(data1.angle), color='b', label='LED 1')
+    plt.plot(data2.time, np.degrees(data2.angle), color='r', label='LED 2')
     plt.xlabel("Time (seconds)", fontsize=24)
     plt.ylabel("Angle (degrees)", fontsize=24)
     plt.title(f"Real Life {CONFIG['graph_title']}", fontsize=28)
@@ -198,20 +834,25 @@ def plot_comparison(data1: LEDData, data2: LEDData) -> None:
     plt.yticks(fontsize=20)
     plt.grid(True)
     plt.savefig(f"{CONFIG['proc_outpath']}{CONFIG['video_name']} - {CONFIG['graph_title']}.png")
-    plt.show()
+    show_plot()
 
 def main():
-    data_path = get_data_path()
-    if os.path.exists(data_path):
-        pivot, first, second = load_saved_data()
+    log = TrackLog.open(get_log_path()) if TrackLog.exists(get_log_path()) else None
+    # A finished log is only reused if it was tracked with the current settings
+    finished = log is not None and log.complete and log_matches(log)
+    if finished or (log is None and os.path.exists(get_data_path())):
+        with profiling.stage("load"):
+            pivot, first, second = load_saved_data()
     else:
-        pivot, first, second = process_video()
-        save_data(pivot, first, second)
+        # Results are written to the track log as the frames are tracked
+        with profiling.stage("process_video"):
+            pivot, first, second = process_video()
 
-    plot_angles(first, 1)
-    plot_angles(second, 2)
-    plot_comparison(first, second)
-    plot_pos_time(first, second, pivot)
+    with profiling.stage("plots"):
+        plot_angles(first, 1)
+        plot_angles(second, 2)
+        plot_comparison(first, second)
+        plot_pos_time(first, second, pivot)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,243 @@
+import matplotlib
+matplotlib.use("Agg")  # before VideoProcessing imports pyplot, in the parent and in every worker
+
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Simulations"))
+import VideoProcessing
+from cache import write_json_atomic
+from tracklog import TrackLog
+
+CONFIG = {
+    "videos": [VideoProcessing.CONFIG["path_to_videos"]],   # video files and/or directories of them
+    "cache_path": "./VideoProcessing/track_cache/",
+    # {"C:/Videos/day1/DSC_0058.AVI": [[pivot x, y], [LED 1 x, y], [LED 2 x, y]], ...}, by absolute path
+    "points_path": "./VideoProcessing/points.json",
+    "report_path": "./VideoProcessing/processing_outfiles/batch_report.csv",
+    "workers": os.cpu_count()
+}
+
+REPORT_FIELDS = ["video", "path", "key", "status", "frames", "interpolated", "predicted", "wall_time", "frames_per_second",
+                 "log", "error"]
+HASHES_NAME = "hashes.json"
+HASH_BLOCK = 1 << 20
+# Not part of the key: they only change how fast a video is tracked, not what comes out
+RUN_SETTINGS = ("prefetch", "decode_gray", "log_batch")
+
+def find_videos(paths: List[str], extension: str) -> List[str]:
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            videos += [p for p in glob.glob(os.path.join(path, "*")) if p.lower().endswith(extension.lower())]
+        else:
+            videos.append(path)
+    return sorted(set(os.path.abspath(video) for video in videos))
+
+def video_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+def video_labels(videos: List[str]) -> Dict[str, str]:
+    # Recordings are shown by their path below the folder all of them are in, so day1/run and day2/run
+    # stay apart; a single folder of videos just shows their names
+    if not videos:
+        return {}
+    root = os.path.commonpath([os.path.dirname(video) for video in videos])
+    return {video: os.path.splitext(os.path.relpath(video, root))[0].replace(os.sep, "/") for video in videos}
+
+def get_points(all_points: dict, video: str, names: Dict[str, int]) -> Optional[list]:
+    points = all_points.get(video)
+    # Older points files were keyed by the bare video name, which is only safe when no other video has it
+    if points is None and names[video_name(video)] == 1:
+        points = all_points.get(video_name(video))
+    return points
+
+def hash_video(path: str, hashes: Dict[str, dict]) -> str:
+    # Hashing gigabytes of video takes a while, so a file is only hashed again when its size or mtime changes
+    stat = os.stat(path)
+    known = hashes.get(path)
+    if known is not None and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+        return known["sha256"]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK):
+            digest.update(block)
+    hashes[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+    return digest.hexdigest()
+
+def get_result_key(content_hash: str, points: list, settings: dict) -> str:
+    """Cache key of one video's tracking: its contents, the selected points and every setting that changes the result."""
+    return hashlib.sha256(
+        json.dumps({"video": content_hash, "points": points, "settings": settings}, sort_keys=True).encode()
+    ).hexdigest()
+
+def load_json(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def select_points(video: str, label: str) -> Optional[list]:
+    # Done in the parent before anything is queued, since the workers can't open windows
+    cap = cv2.VideoCapture(video)
+    ret, frame = cap.read()
+    cap.release()
+    if not ret:
+        return None
+    points = [VideoProcessing.select_point(frame, f"{label}: Select {target}")
+              for target in ("Pivot Point", "first LED", "second LED")]
+    return None if None in points else [list(point) for point in points]
+
+def make_row(label: str, path: str, key: str, status: str, **metrics) -> Dict[str, str]:
+    row = {field: "" for field in REPORT_FIELDS}
+    row.update(video=label, path=path, key=key, status=status)
+    row.update({name: str(value) for name, value in metrics.items()})
+    return row
+
+def log_metrics(log: TrackLog) -> dict:
+    data = log.columns()
+    flags = np.stack([data["flag1"], data["flag2"]])
+    return {
+        "frames": log.rows,
+        "interpolated": int(np.count_nonzero(flags == VideoProcessing.INTERPOLATED)),
+        "predicted": int(np.count_nonzero(flags == VideoProcessing.OCCLUDED)),
+        "log": log.path
+    }
+
+def read_report(path: str) -> Dict[str, Dict[str, str]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", newline="") as f:
+        return {row["key"]: row for row in csv.DictReader(f) if row["key"]}
+
+def write_report(path: str, rows: Dict[str, Dict[str, str]]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows.values())
+    os.replace(tmp_path, path)
+
+def track_video(video: str, label: str, key: str, points: list, settings: dict, log_path: str) -> Dict[str, str]:
+    # Runs in a worker process, which owns its copy of VideoProcessing.CONFIG
+    VideoProcessing.CONFIG.update(
+        settings,
+        path_to_videos=os.path.join(os.path.dirname(video), ""),
+        video_name=video_name(video),
+        video_extension=os.path.splitext(video)[1],
+        points=points,
+        headless=True,
+        parallel=False,
+        save_annotated=False
+    )
+    try:
+        start = time.perf_counter()
+        VideoProcessing.process_video(log_path)
+        wall = time.perf_counter() - start
+        metrics = log_metrics(TrackLog.open(log_path))
+        return make_row(label, video, key, "tracked", wall_time=f"{wall:.2f}",
+                        frames_per_second=f"{metrics['frames'] / wall:.1f}", **metrics)
+    except Exception as e:
+        # One unreadable video shouldn't stop the rest of the batch; its log keeps whatever was tracked
+        return make_row(label, video, key, "failed", error=f"{type(e).__name__}: {e}")
+
+def prepare_videos(videos: List[str], cache_path: str, points_path: str,
+                   settings: dict) -> Tuple[Dict[str, Dict[str, str]], Dict[str, List[Tuple[str, list]]]]:
+    """Report rows of the cached or unusable videos by path, and the videos and points still to track under each key."""
+    os.makedirs(cache_path, exist_ok=True)
+    hashes_path = os.path.join(cache_path, HASHES_NAME)
+    hashes = load_json(hashes_path)
+    all_points = load_json(points_path)
+    labels = video_labels(videos)
+    names = {}
+    for video in videos:
+        names[video_name(video)] = names.get(video_name(video), 0) + 1
+    rows, pending = {}, {}
+    for video in videos:
+        label = labels[video]
+        points = get_points(all_points, video, names)
+        if points is None and not VideoProcessing.CONFIG["headless"]:
+            points = select_points(video, label)
+            if points is not None:
+                all_points[video] = points
+                write_json_atomic(points_path, all_points)
+        if points is None:
+            rows[video] = make_row(label, video, "", "no_points", error=f"no points for {video} in {points_path}")
+            continue
+        key = get_result_key(hash_video(video, hashes), points, settings)
+        log_path = os.path.join(cache_path, f"{key}.track")
+        if TrackLog.exists(log_path) and TrackLog.open(log_path).complete:
+            rows[video] = make_row(label, video, key, "cached", **log_metrics(TrackLog.open(log_path)))
+        else:
+            # Copies of the same recording share a key and are only tracked once
+            pending.setdefault(key, []).append((video, points))
+    write_json_atomic(hashes_path, hashes)
+    return rows, pending
+
+def run_batch(videos: List[str], cache_path: str, points_path: str, report_path: str,
+              workers: Optional[int] = None) -> Dict[str, Dict[str, str]]:
+    settings = VideoProcessing.get_tracking_settings()
+    run_settings = {name: VideoProcessing.CONFIG[name] for name in RUN_SETTINGS}
+    previous = read_report(report_path)
+    rows, pending = prepare_videos(videos, cache_path, points_path, settings)
+    labels = video_labels(videos)
+    for row in rows.values():
+        # Keep the timing from the run that actually tracked a cached video
+        if row["status"] == "cached" and previous.get(row["key"], {}).get("wall_time"):
+            row.update(wall_time=previous[row["key"]]["wall_time"],
+                       frames_per_second=previous[row["key"]]["frames_per_second"])
+    print(f"{len(videos)} videos: {sum(row['status'] == 'cached' for row in rows.values())} cached, "
+          f"{len(pending)} to track")
+    write_report(report_path, rows)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(track_video, video, labels[video], key, points, dict(settings, **run_settings),
+                        os.path.join(cache_path, f"{key}.track"))
+            for key, [(video, points), *_] in pending.items()
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            row = future.result()
+            for video, _ in pending[row["key"]]:
+                copy = video != row["path"] and row["status"] == "tracked"
+                rows[video] = dict(row, video=labels[video], path=video, status="duplicate" if copy else row["status"])
+            write_report(report_path, rows)  # rewritten every time so a killed batch keeps its report
+            print(f"[{done}/{len(pending)}] {row['video']} {row['status']} {row['wall_time']}")
+    return rows
+
+def print_report(rows: Dict[str, Dict[str, str]]) -> None:
+    width = max([14] + [len(row["video"]) + 2 for row in rows.values()])
+    print(f"{'video':<{width}}{'key':<14}{'status':<11}{'frames':>8}{'interp.':>9}{'pred.':>7}{'wall (s)':>10}{'frames/s':>10}")
+    for row in rows.values():
+        print(f"{row['video']:<{width}}{row['key'][:12]:<14}{row['status']:<11}{row['frames']:>8}{row['interpolated']:>9}"
+              f"{row['predicted']:>7}{row['wall_time']:>10}{row['frames_per_second']:>10}")
+        if row["error"]:
+            print(f"    {row['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Track many videos at once, reusing results whose video and settings haven't changed.")
+    parser.add_argument("videos", nargs="*", default=CONFIG["videos"], help="video files or directories of them")
+    parser.add_argument("--cache", default=CONFIG["cache_path"])
+    parser.add_argument("--points", default=CONFIG["points_path"])
+    parser.add_argument("--report", default=CONFIG["report_path"])
+    parser.add_argument("--workers", type=int, default=CONFIG["workers"])
+    args = parser.parse_args()
+
+    videos = find_videos(args.videos, VideoProcessing.CONFIG["video_extension"])
+    rows = run_batch(videos, args.cache, args.points, args.report, args.workers)
+    print_report(rows)
+
+if __name__ == "__main__":
+    main()
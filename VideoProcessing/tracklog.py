@@ -0,0 +1,222 @@
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Simulations"))
+from cache import write_json_atomic
+from trajectory import Trajectory
+
+HEADER_NAME = "header.json"
+COMMIT_NAME = "commit.json"
+VERSION = 1
+# One raw little-endian file per column, so each can be memory-mapped on its own
+COLUMNS = {
+    "frame": np.dtype("<i8"),
+    "time": np.dtype("<f8"),
+    "x1": np.dtype("<f8"),
+    "y1": np.dtype("<f8"),
+    "x2": np.dtype("<f8"),
+    "y2": np.dtype("<f8"),
+    "flag1": np.dtype("u1"),
+    "flag2": np.dtype("u1")
+}
+POSITION_COLUMNS = (("x1", "y1"), ("x2", "y2"))
+FLAG_COLUMNS = ("flag1", "flag2")
+
+Point = Tuple[int, int]
+
+class TrackLog:
+    """Append-only columnar log of the LED positions tracked in each frame of one video.
+
+    The log is a directory holding header.json (video, pivot, selected points, calibration and
+    tracking settings), one raw binary file per column and commit.json with the number of rows
+    committed. Rows are appended in batches: every column is written and synced before the commit
+    count is replaced, so after a crash anything past the last commit is ignored by readers and cut
+    off when the log is opened for writing again, and tracking can carry on from the last committed frame.
+    """
+
+    def __init__(self, path: str, header: dict, rows: int, complete: bool):
+        self.path = path
+        self.header = header
+        self.rows = rows
+        self.complete = complete
+
+    @classmethod
+    def create(cls, path: str, header: dict) -> "TrackLog":
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        header = dict(header, version=VERSION, columns={name: dtype.str for name, dtype in COLUMNS.items()},
+                      created=time.time())
+        write_json_atomic(os.path.join(path, HEADER_NAME), header)
+        for name in COLUMNS:
+            open(column_path(path, name), "wb").close()
+        log = cls(path, header, 0, False)
+        log.commit()
+        return log
+
+    @classmethod
+    def open(cls, path: str, writable: bool = False) -> "TrackLog":
+        with open(os.path.join(path, HEADER_NAME), "r") as f:
+            header = json.load(f)
+        if header.get("version") != VERSION:
+            raise ValueError(f"{path} is a version {header.get('version')} track log, expected {VERSION}")
+        with open(os.path.join(path, COMMIT_NAME), "r") as f:
+            commit = json.load(f)
+        log = cls(path, header, commit["rows"], commit["complete"])
+        if not writable:
+            # Readers only look at the committed rows, and mustn't cut off a running writer's next batch
+            return log
+        # Drop whatever a crash left after the last commit
+        for name, dtype in COLUMNS.items():
+            with open(column_path(path, name), "r+b") as f:
+                f.truncate(log.rows * dtype.itemsize)
+        return log
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, COMMIT_NAME))
+
+    def commit(self, complete: bool = False) -> None:
+        self.complete = complete
+        write_json_atomic(os.path.join(self.path, COMMIT_NAME), {"rows": self.rows, "complete": complete})
+
+    def append(self, frames: np.ndarray, times: np.ndarray, positions: np.ndarray, flags: np.ndarray) -> None:
+        """Write a batch of rows, positions (N, 2, 2) and flags (N, 2), and commit it."""
+        if self.complete:
+            raise ValueError(f"{self.path} is complete and can't be appended to")
+        columns = split_columns(frames, times, positions, flags)
+        for name, dtype in COLUMNS.items():
+            with open(column_path(self.path, name), "r+b") as f:
+                f.seek(self.rows * dtype.itemsize)
+                f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        self.rows += len(frames)
+        self.commit()
+
+    def columns(self, mmap: bool = True) -> Dict[str, np.ndarray]:
+        data = {}
+        for name, dtype in COLUMNS.items():
+            if mmap and self.rows:
+                data[name] = np.memmap(column_path(self.path, name), dtype=dtype, mode="r", shape=(self.rows,))
+            else:
+                data[name] = np.fromfile(column_path(self.path, name), dtype=dtype, count=self.rows)
+        return data
+
+    def positions(self, mmap: bool = True) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Frames, times, positions (N, 2, 2) and flags (N, 2), the layout the trackers work in."""
+        data = self.columns(mmap)
+        positions = np.stack([np.stack([data[x], data[y]], axis=1) for x, y in POSITION_COLUMNS], axis=1)
+        flags = np.stack([data[name] for name in FLAG_COLUMNS], axis=1)
+        return data["frame"], data["time"], positions, flags
+
+    def rewrite(self, positions: np.ndarray, flags: np.ndarray) -> None:
+        """Replace the positions and flags of every committed row in place, for filling gaps once tracking ends."""
+        columns = split_columns(np.empty(0), np.empty(0), positions, flags)
+        for name in (*sum(POSITION_COLUMNS, ()), *FLAG_COLUMNS):
+            with open(column_path(self.path, name), "r+b") as f:
+                f.write(np.ascontiguousarray(columns[name], dtype=COLUMNS[name]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+    def trajectories(self, mmap: bool = True) -> Tuple[Trajectory, Trajectory]:
+        _, times, positions, flags = self.positions(mmap)
+        return led_trajectories(self.header["pivot"], times, positions, flags)
+
+def column_path(path: str, name: str) -> str:
+    return os.path.join(path, f"{name}.bin")
+
+def split_columns(frames: np.ndarray, times: np.ndarray, positions: np.ndarray, flags: np.ndarray) -> Dict[str, np.ndarray]:
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2, 2)
+    flags = np.asarray(flags, dtype=np.uint8).reshape(-1, 2)
+    columns = {"frame": frames, "time": times}
+    for led, (x, y) in enumerate(POSITION_COLUMNS):
+        columns[x], columns[y] = positions[:, led, 0], positions[:, led, 1]
+        columns[FLAG_COLUMNS[led]] = flags[:, led]
+    return columns
+
+def led_trajectories(pivot: Point, times: np.ndarray, positions: np.ndarray,
+                     flags: Optional[np.ndarray] = None) -> Tuple[Trajectory, Trajectory]:
+    """Both LEDs from their pixel positions, with each angle measured from its own joint (0 is straight down)."""
+    first, second = positions[:, 0], positions[:, 1]
+    theta1 = np.arctan2(first[:, 0] - pivot[0], first[:, 1] - pivot[1])
+    theta2 = np.arctan2(second[:, 0] - first[:, 0], second[:, 1] - first[:, 1])
+    flags1, flags2 = (None, None) if flags is None else (flags[:, 0], flags[:, 1])
+    return (Trajectory.from_columns(times, theta1, first[:, 0], first[:, 1], flags=flags1),
+            Trajectory.from_columns(times, theta2, second[:, 0], second[:, 1], flags=flags2))
+
+def load_text_data(path: str) -> Tuple[Point, Trajectory, Trajectory]:
+    """Read a DSC_XXXX.txt file of Pivot/firstLED/secondLED JSON lines (and flag lines, if it has them)."""
+    lines = {}
+    with open(path, "r") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            lines[key] = json.loads(value)
+    return (lines.get("Pivot"),
+            Trajectory.from_records(lines.get("firstLED", []), flags=lines.get("firstLEDFlags")),
+            Trajectory.from_records(lines.get("secondLED", []), flags=lines.get("secondLEDFlags")))
+
+def convert_text_file(text_path: str, log_path: str, fps: Optional[float] = None) -> TrackLog:
+    """Write a DSC_XXXX.txt file out as a complete track log."""
+    pivot, first, second = load_text_data(text_path)
+    # Text files only have times, which were the 1-based frame position over the frame rate
+    fps = fps or 1.0 / np.median(np.diff(first.time))
+    frames = np.rint(first.time * fps).astype(np.int64) - 1
+    positions = np.stack([first.position, second.position], axis=1)
+    flags = np.stack([
+        np.zeros(len(led), dtype=np.uint8) if led.flags is None else led.flags for led in (first, second)
+    ], axis=1)
+    arm_length = float(np.median(np.linalg.norm(first.position - np.asarray(pivot), axis=1)))
+    log = TrackLog.create(log_path, {
+        "video": None,
+        "converted_from": text_path,
+        "pivot": pivot,
+        "points": None,
+        "arm_length": arm_length,
+        "fps": float(fps),
+        "settings": None
+    })
+    log.append(frames, first.time, positions, flags)
+    log.commit(complete=True)
+    return log
+
+def convert_text_files(paths: Sequence[str], fps: Optional[float] = None, remove: bool = False) -> List[str]:
+    converted = []
+    for text_path in paths:
+        log_path = f"{os.path.splitext(text_path)[0]}.track"
+        if TrackLog.exists(log_path):
+            continue
+        convert_text_file(text_path, log_path, fps)
+        if remove:
+            os.remove(text_path)
+        converted.append(log_path)
+    return converted
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert video data text files to track logs, or describe a track log.")
+    parser.add_argument("command", choices=["convert", "info"])
+    parser.add_argument("paths", nargs="+", help="DSC_XXXX.txt files or globs (convert), .track directories (info)")
+    parser.add_argument("--fps", type=float, help="frame rate of the videos, instead of working it out from the times")
+    parser.add_argument("--remove-text", action="store_true", help="delete .txt files after converting")
+    args = parser.parse_args()
+
+    paths = sorted({path for pattern in args.paths for path in glob.glob(pattern)})
+    if args.command == "convert":
+        converted = convert_text_files(paths, args.fps, args.remove_text)
+        print(f"Converted {len(converted)} text file(s)")
+    else:
+        for path in paths:
+            log = TrackLog.open(path)
+            state = "complete" if log.complete else "incomplete"
+            last = int(log.columns()["frame"][-1]) if log.rows else None
+            print(f"{path}  {log.rows} frames ({state}, last frame {last})  pivot {log.header['pivot']}")
+
+if __name__ == "__main__":
+    main()
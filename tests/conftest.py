@@ -0,0 +1,9 @@
+import sys
+
+def pytest_addoption(parser):
+    parser.addoption("--no-numba", action="store_true", help="hide numba, so everything runs on the pure NumPy kernels")
+
+def pytest_configure(config):
+    # Has to happen before any test module imports kernel.py, which checks for numba once
+    if config.getoption("--no-numba"):
+        sys.modules["numba"] = None
@@ -0,0 +1,49 @@
+import json
+import sys
+from pathlib import Path
+
+import cv2
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "VideoProcessing"))
+import VideoProcessing
+import batch
+
+PIVOT = (160, 60)
+
+def write_video(path: Path, second_x: int, frames: int = 12) -> list:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 30.0, (320, 240))
+    for _ in range(frames):
+        frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        cv2.circle(frame, (160, 120), 5, (255, 255, 255), -1)
+        cv2.circle(frame, (second_x, 180), 5, (255, 255, 255), -1)
+        writer.write(frame)
+    writer.release()
+    return [list(PIVOT), [160, 120], [second_x, 180]]
+
+def test_same_name_in_different_folders_stays_apart(tmp_path, monkeypatch):
+    monkeypatch.setitem(VideoProcessing.CONFIG, "headless", True)
+    monkeypatch.setitem(VideoProcessing.CONFIG, "video_extension", ".avi")
+    first, second = tmp_path / "videos" / "day1" / "run.avi", tmp_path / "videos" / "day2" / "run.avi"
+    points = {str(first): write_video(first, 160), str(second): write_video(second, 200)}
+    points_path = tmp_path / "points.json"
+    points_path.write_text(json.dumps(points))
+
+    videos = batch.find_videos([str(first.parent), str(second.parent)], ".avi")
+    rows = batch.run_batch(videos, str(tmp_path / "cache"), str(points_path), str(tmp_path / "report.csv"), workers=1)
+
+    assert sorted(row["video"] for row in rows.values()) == ["day1/run", "day2/run"]
+    assert {row["status"] for row in rows.values()} == {"tracked"}
+    assert rows[str(first)]["key"] != rows[str(second)]["key"]
+    assert len(batch.read_report(str(tmp_path / "report.csv"))) == 2
+
+def test_legacy_points_by_name_only_used_when_unambiguous(tmp_path):
+    videos = [str(tmp_path / "day1" / "run.avi"), str(tmp_path / "day2" / "run.avi"), str(tmp_path / "day2" / "other.avi")]
+    names = {"run": 2, "other": 1}
+    legacy = {"run": [[0, 0], [1, 1], [2, 2]], "other": [[3, 3], [4, 4], [5, 5]]}
+    assert batch.get_points(legacy, videos[0], names) is None
+    assert batch.get_points(legacy, videos[2], names) == legacy["other"]
+    assert batch.video_labels(videos[2:]) == {videos[2]: "other"}
@@ -0,0 +1,50 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Simulations"))
+import cache as cache_module
+from cache import LOCK_NAME, SimulationCache
+
+def store(cache: SimulationCache) -> None:
+    cache.store("key", {"y": np.zeros((4, 3))}, params=None, lengths=[0.5, 0.5])
+
+def write_lock(cache: SimulationCache, pid: int, age: float = 0.0) -> Path:
+    lock = Path(cache.root) / LOCK_NAME
+    lock.write_text(json.dumps({"pid": pid, "host": socket.gethostname(), "time": time.time() - age}))
+    return lock
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+@pytest.mark.skipif(os.name == "nt", reason="owners are only checked on POSIX")
+def test_lock_of_dead_process_is_broken(tmp_path):
+    cache = SimulationCache(str(tmp_path))
+    lock = write_lock(cache, dead_pid())
+    store(cache)
+    assert "key" in cache and not lock.exists()
+
+def test_old_lock_is_broken(tmp_path):
+    cache = SimulationCache(str(tmp_path))
+    lock = write_lock(cache, os.getpid(), age=cache_module.LOCK_STALE + 1)
+    store(cache)
+    assert "key" in cache and not lock.exists()
+
+def test_live_lock_is_waited_for(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_module, "LOCK_TIMEOUT", 0.2)
+    cache = SimulationCache(str(tmp_path))
+    write_lock(cache, os.getpid())
+    with pytest.raises(TimeoutError, match="unlock"):
+        store(cache)
+    assert cache.unlock()
+    store(cache)
+    assert "key" in cache and not cache.unlock()
@@ -0,0 +1,86 @@
+import sys
+from pathlib import Path
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Simulations"))
+import simulation
+from cache import SimulationCache
+
+class Killed(Exception):
+    pass
+
+@pytest.fixture
+def short_run(tmp_path, monkeypatch):
+    monkeypatch.setitem(simulation.CONFIG, "path_to_cache", str(tmp_path))
+    monkeypatch.setitem(simulation.CONFIG, "cache_max_bytes", None)
+    monkeypatch.setitem(simulation.CONFIG, "checkpoint_interval", 0.5)
+    params = dict(simulation.CONFIG["params"], time_span=(0.0, 2.0), num_points=201,
+                  solver={"method": "DOP853", "rtol": 1e-9, "atol": 1e-10})
+    monkeypatch.setitem(simulation.CONFIG, "params", params)
+
+def kill_after(monkeypatch, checkpoints: int) -> None:
+    store_progress = simulation.store_progress
+    def stop(cache, key, segment, *args):
+        store_progress(cache, key, segment, *args)
+        if segment + 1 == checkpoints:
+            raise Killed()
+    monkeypatch.setattr(simulation, "store_progress", stop)
+
+def test_checkpoints_only_write_new_samples(short_run, monkeypatch):
+    written = []
+    append = SimulationCache.append
+    def record(self, key, arrays, extra=None):
+        written.append({name.split(".")[0]: np.shape(array) for name, array in arrays.items()})
+        return append(self, key, arrays, extra)
+    monkeypatch.setattr(SimulationCache, "append", record)
+    simulation.solve_with_continuation()
+    # Segment 0 goes through store, the other three are appended with 50 samples each
+    assert [shapes["y"] for shapes in written] == [(4, 50)] * 3
+    assert [shapes["checkpoints"] for shapes in written] == [(1, 5)] * 3
+
+def test_killed_run_keeps_its_segments(short_run, monkeypatch):
+    kill_after(monkeypatch, 2)
+    with pytest.raises(Killed):
+        simulation.solve_with_continuation()
+    cache, key = simulation.get_cache(), simulation.get_param_hash()
+    meta = cache.meta(key)
+    assert meta["segments"] == 2 and not meta["complete"]
+    assert {"y.0", "y.1", "dense_t.1"} <= set(meta["arrays"]) and "y" not in meta["arrays"]
+    data = simulation.load_run(cache, key)
+    assert data["t"][-1] == pytest.approx(meta["t_end"]) == pytest.approx(1.0)
+    assert data["y"].shape == (4, 101) and len(data["checkpoints"]) == 3
+
+def test_resumed_run_matches_uninterrupted_run(short_run, monkeypatch):
+    expected, _ = simulation.solve_with_continuation()
+    cache, key = simulation.get_cache(), simulation.get_param_hash()
+    cache.remove(key)
+
+    store_progress = simulation.store_progress
+    kill_after(monkeypatch, 2)
+    with pytest.raises(Killed):
+        simulation.solve_with_continuation()
+    monkeypatch.setattr(simulation, "store_progress", store_progress)
+    resumed, _ = simulation.solve_with_continuation()
+
+    meta = cache.meta(key)
+    assert meta["complete"] and "segments" not in meta
+    assert sorted(meta["arrays"]) == ["checkpoints", "dense_coeffs", "dense_t", "t", "y"]
+    stored = simulation.load_saved_data()
+    np.testing.assert_allclose(resumed["y"], expected["y"], rtol=1e-6, atol=1e-8)
+    np.testing.assert_allclose(stored["y"], resumed["y"])
+    np.testing.assert_allclose(stored["dense"](stored["t"]), resumed["y"], atol=1e-8)
+
+def test_load_run_reads_segments_from_one_snapshot(short_run, monkeypatch):
+    kill_after(monkeypatch, 2)
+    with pytest.raises(Killed):
+        simulation.solve_with_continuation()
+    cache, key = simulation.get_cache(), simulation.get_param_hash()
+    # Another process appending a checkpoint right after the arrays were loaded
+    meta = SimulationCache.meta
+    monkeypatch.setattr(SimulationCache, "meta", lambda self, key: dict(meta(self, key), segments=3))
+    data = simulation.load_run(cache, key)
+    assert data["y"].shape == (4, 101)
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from scipy.integrate import solve_ivp
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Simulations"))
+import simulation
+from dense_output import DenseTrajectory
+
+@pytest.mark.parametrize("method", ["RK45", "DOP853", "Radau", "BDF", "LSODA"])
+def test_dense_output_reproduces_solver_interpolant(method):
+    kernel = simulation.get_kernel()
+    y0 = [*simulation.CONFIG["params"]["initial_angles"], 0.0, 0.0]
+    sol = solve_ivp(kernel.rhs, (0.0, 5.0), y0, method=method, dense_output=True, rtol=1e-10, atol=1e-12)
+    dense = DenseTrajectory.from_ode_solution(sol.sol, method)
+    t = np.linspace(0.0, 5.0, 10001)
+    np.testing.assert_allclose(dense(t), sol.sol(t), rtol=0, atol=1e-9)
+
+def test_lsoda_degree_follows_its_steps():
+    kernel = simulation.get_kernel()
+    y0 = [*simulation.CONFIG["params"]["initial_angles"], 0.0, 0.0]
+    sol = solve_ivp(kernel.rhs, (0.0, 5.0), y0, method="LSODA", dense_output=True, rtol=1e-10, atol=1e-12)
+    dense = DenseTrajectory.from_ode_solution(sol.sol, "LSODA")
+    # Adams steps at this tolerance go well past the 7 that used to be assumed
+    assert dense.coeffs.shape[2] - 1 == max(len(interpolant.p) - 1 for interpolant in sol.sol.interpolants) > 7
@@ -0,0 +1,49 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Simulations"))
+import renderer
+from renderer import PillowGifWriter, render_animation
+
+def make_solution(duration: float = 2.0) -> dict:
+    t = np.linspace(0.0, duration, 101)
+    return {"t": t, "y": np.stack([np.sin(t), np.cos(t), np.zeros_like(t), np.zeros_like(t)])}
+
+def test_gif_writer_without_frames_closes_quietly(tmp_path):
+    writer = PillowGifWriter(str(tmp_path / "empty.gif"), 15)
+    writer.close()
+    assert not (tmp_path / "empty.gif").exists()
+
+def test_render_animation_writes_gif(tmp_path, monkeypatch):
+    monkeypatch.setattr(renderer.shutil, "which", lambda name: None)
+    path = tmp_path / "run.gif"
+    frames = render_animation(make_solution(), (0.5, 0.5), str(path), fps=10, size=64, workers=1)
+    assert frames == 21 and path.stat().st_size > 0
+
+def test_render_failure_is_not_masked_by_close(tmp_path, monkeypatch):
+    monkeypatch.setattr(renderer.shutil, "which", lambda name: None)
+    def fail(self, frames):
+        raise OSError("disk full")
+    monkeypatch.setattr(PillowGifWriter, "write", fail)
+    with pytest.raises(OSError, match="disk full"):
+        render_animation(make_solution(), (0.5, 0.5), str(tmp_path / "run.gif"), fps=10, size=64, workers=1)
+
+def test_gif_writer_streams_frames_to_the_file(tmp_path):
+    from PIL import Image, ImageSequence
+
+    path = tmp_path / "stream.gif"
+    frames = (np.random.default_rng(0).random((6, 32, 32)) > 0.5).astype(np.uint8)
+    writer = PillowGifWriter(str(path), 10)
+    writer.write(frames[:3])
+    written = path.stat().st_size
+    writer.write(frames[3:])
+    assert path.stat().st_size > written > 0
+    writer.close()
+
+    with Image.open(path) as image:
+        assert image.n_frames == 6 and image.info["duration"] == 100 and image.info["loop"] == 0
+        for frame, expected in zip(ImageSequence.Iterator(image), frames):
+            np.testing.assert_array_equal(np.array(frame.convert("RGB")), renderer.PALETTE[expected])
@@ -0,0 +1,31 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Simulations"))
+import simulation
+from kernel import PendulumKernel
+from symplectic import relative_energy_drift, solve_symplectic
+
+def get_params(duration: float, num_points: int) -> dict:
+    return dict(simulation.CONFIG["params"], time_span=(0.0, duration), num_points=num_points)
+
+@pytest.mark.parametrize("method", ["Verlet", "ImplicitMidpoint", "Yoshida4"])
+def test_small_step_conserves_energy(method):
+    params = get_params(1.0, 51)
+    y, evals = solve_symplectic(params, np.linspace(0.0, 1.0, 51), {"method": method, "dt": 1e-3})
+    assert np.all(np.isfinite(y)) and evals > 0
+    assert relative_energy_drift(PendulumKernel.from_params(params), y) < 1e-2
+
+@pytest.mark.parametrize("method", ["Verlet", "ImplicitMidpoint", "Yoshida4"])
+def test_too_large_step_fails_loudly(method):
+    params = get_params(10.0, 11)
+    with pytest.raises(RuntimeError, match="did not converge"):
+        solve_symplectic(params, np.linspace(0.0, 10.0, 11), {"method": method, "dt": 1.0})
+
+def test_yoshida_at_coarse_step_raises_instead_of_returning_nan():
+    params = get_params(5.0, 251)
+    with pytest.raises(RuntimeError, match="Yoshida4"):
+        solve_symplectic(params, np.linspace(0.0, 5.0, 251), {"method": "Yoshida4", "dt": 1e-2})
@@ -0,0 +1,36 @@
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "VideoProcessing"))
+import VideoProcessing
+from VideoProcessing import LedDetector, PredictiveTracker
+
+PIVOT, FIRST, SECOND = (200, 100), (200, 200), (200, 300)
+
+def make_frame() -> np.ndarray:
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    for center in (FIRST, SECOND):
+        cv2.circle(frame, center, 6, (255, 255, 255), -1)
+    return frame
+
+@pytest.mark.parametrize("search_window, windowed", [(0.0, False), (0.5, True)])
+def test_predictive_tracker_respects_search_window(search_window, windowed):
+    frame = make_frame()
+    detector = LedDetector(frame.shape, PIVOT, 100.0, VideoProcessing.CONFIG["brightness_value"],
+                           search_window=search_window)
+    searched = []
+    find = detector.find
+    def record(frame, rect, whole=False):
+        searched.append(rect)
+        return find(frame, rect, whole)
+    detector.find = record
+
+    tracker = PredictiveTracker(PIVOT, (FIRST, SECOND), 100.0, detector)
+    positions, flags = tracker.update(frame)
+    assert flags == [VideoProcessing.MEASURED] * 2
+    np.testing.assert_allclose(positions, [FIRST, SECOND], atol=0.5)
+    assert (detector.roi not in searched) == windowed
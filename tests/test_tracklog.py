@@ -0,0 +1,61 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "VideoProcessing"))
+import VideoProcessing
+import tracklog
+from tracklog import TrackLog, convert_text_files
+
+def write_text_file(path: Path, frames: int = 50, fps: float = 30.0) -> None:
+    t = (np.arange(frames) + 1) / fps
+    first = [(float(ti), 0.1, (100.0 + i, 200.0)) for i, ti in enumerate(t)]
+    second = [(float(ti), 0.2, (120.0 + i, 260.0)) for i, ti in enumerate(t)]
+    with open(path, "w") as f:
+        f.write(f"Pivot:{json.dumps([100, 100])}\n")
+        f.write(f"firstLED:{json.dumps(first)}\n")
+        f.write(f"secondLED:{json.dumps(second)}\n")
+
+def test_converted_log_survives_main(tmp_path, monkeypatch):
+    write_text_file(tmp_path / "DSC_0001.txt")
+    [log_path] = convert_text_files([str(tmp_path / "DSC_0001.txt")])
+    monkeypatch.setitem(VideoProcessing.CONFIG, "path_to_data", f"{tmp_path}/")
+    monkeypatch.setitem(VideoProcessing.CONFIG, "video_name", "DSC_0001")
+    monkeypatch.setitem(VideoProcessing.CONFIG, "proc_outpath", f"{tmp_path}/")
+    monkeypatch.setitem(VideoProcessing.CONFIG, "headless", True)
+    assert log_path == VideoProcessing.get_log_path()
+
+    def retrack():
+        pytest.fail("main() tracked the video again instead of loading the converted log")
+    monkeypatch.setattr(VideoProcessing, "process_video", retrack)
+    VideoProcessing.main()
+
+    log = TrackLog.open(log_path)
+    assert log.complete and log.rows == 50
+    frames, _, positions, _ = log.positions()
+    np.testing.assert_array_equal(frames, np.arange(50))
+    np.testing.assert_array_equal(positions[:, 0, 0], 100.0 + np.arange(50))
+
+def test_reader_leaves_uncommitted_rows_alone(tmp_path):
+    write_text_file(tmp_path / "DSC_0001.txt")
+    first = TrackLog.open(convert_text_files([str(tmp_path / "DSC_0001.txt")])[0]).positions(mmap=False)
+    log = TrackLog.create(str(tmp_path / "DSC_0002.track"), {"pivot": [100, 100]})
+    log.append(first[0][:20], first[1][:20], first[2][:20], first[3][:20])
+    # A writer part way through a batch: the rows are in the column files but not committed yet
+    for name, dtype in tracklog.COLUMNS.items():
+        with open(tracklog.column_path(log.path, name), "ab") as f:
+            f.write(np.zeros(10, dtype=dtype).tobytes())
+    sizes = {name: os.path.getsize(tracklog.column_path(log.path, name)) for name in tracklog.COLUMNS}
+
+    reader = TrackLog.open(log.path)
+    assert reader.rows == 20 and len(reader.columns()["frame"]) == 20
+    assert sizes == {name: os.path.getsize(tracklog.column_path(log.path, name)) for name in tracklog.COLUMNS}
+    # Reopening to write drops them, as after a crash
+    assert TrackLog.open(log.path, writable=True).rows == 20
+    assert os.path.getsize(tracklog.column_path(log.path, "frame")) == 20 * 8
@@ -0,0 +1,19 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Simulations"))
+from kernel import HAS_NUMBA
+
+@pytest.mark.skipif(not HAS_NUMBA, reason="the suite already runs on the pure NumPy kernels")
+def test_suite_passes_without_numba():
+    # The compiled and the pure NumPy kernels have to behave the same, including how they fail
+    tests = Path(__file__).resolve().parent
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "--no-numba", str(tests), "--deselect",
+         f"{Path(__file__).relative_to(tests.parent)}::test_suite_passes_without_numba"],
+        cwd=tests.parent, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stdout[-4000:]